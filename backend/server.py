@@ -1,9 +1,12 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status, UploadFile, File
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, ReturnDocument
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 import os
@@ -11,12 +14,32 @@ import logging
 import jwt
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr, validator
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set
 import uuid
 from bson import ObjectId
 import functools
 import aiofiles
+import asyncio
+import json
 import re
+import base64
+import csv
+import io
+import zlib
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+from openpyxl import Workbook
+from openpyxl.styles import Font
+from docx import Document
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -620,6 +643,14 @@ class QuotationGroup(BaseModel):
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     is_deleted: bool = False
 
+# Embedded in QuotationItem.yearly_allocations (formerly one quotation_item_yearly document per year)
+class QuotationItemYearly(BaseModel):
+    year_no: int  # 1-10
+    allocated_otp: float = 0.0
+    allocated_recurring: float = 0.0
+    year_total: float = 0.0
+    proration_factor: float = 1.0
+
 class QuotationItem(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     group_id: str
@@ -644,6 +675,7 @@ class QuotationItem(BaseModel):
     line_total_recurring: float = 0.0
     item_order: int
     custom_notes: Optional[str] = None
+    yearly_allocations: List[QuotationItemYearly] = []  # Y1-Y10, maintained by the totals engine
     is_active: bool = True
     created_by: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -651,27 +683,15 @@ class QuotationItem(BaseModel):
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     is_deleted: bool = False
 
-class QuotationItemYearly(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    item_id: str
-    year_no: int  # 1-10
-    allocated_otp: float = 0.0
-    allocated_recurring: float = 0.0
-    year_total: float = 0.0
-    year_start_date: Optional[str] = None
-    year_end_date: Optional[str] = None
-    proration_factor: float = 1.0
-    base_year_price: float = 0.0
-    currency_id: str = "1"
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
 class QuotationVersion(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     quotation_id: str
     version_number: int
     version_name: Optional[str] = None
-    snapshot_data: str  # JSON string
+    encoding: str = "full"  # full, delta
+    anchor_version: int  # Full snapshot this version's delta chain starts from
+    snapshot_data: bytes  # zlib-compressed canonical JSON: the snapshot, or a structural diff against the previous version
+    snapshot_size: int = 0
     change_summary: Optional[str] = None
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -781,6 +801,27 @@ class ExportTemplate(BaseModel):
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     is_deleted: bool = False
 
+class ExportJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    job_type: str  # leads, activity_logs, quotation, pnl
+    params: Dict[str, Any] = {}
+    user_id: str
+    status: str = "queued"  # queued, running, completed, failed, expired
+    processed: int = 0
+    total: Optional[int] = None
+    progress: float = 0.0  # percent
+    error: Optional[str] = None
+    attempts: int = 0
+    locked_until: Optional[datetime] = None
+    filename: Optional[str] = None
+    media_type: Optional[str] = None
+    file_path: Optional[str] = None
+    file_size: Optional[int] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
 class CustomerQuotationAccess(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     quotation_id: str
@@ -985,8 +1026,12 @@ def create_refresh_token(data: dict):
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
+async def authenticate_token(token: str) -> User:
+    """Resolve the active user for a JWT access token"""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
@@ -1435,6 +1480,7 @@ async def update_user(user_id: str, user_data: dict, current_user: User = Depend
         update_data["password"] = get_password_hash(user_data["password"])
     
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    await enqueue_display_name_fanout("user", user_id, existing_user, update_data)
     
     # Log activity
     user_name = user_data.get("name") or existing_user["name"]
@@ -2305,6 +2351,10 @@ async def upload_opportunity_document(
         }
         
         await db.opportunity_documents.insert_one(document_record)
+        await record_opportunity_audit(
+            opportunity_id, "create", current_user.id, f"Uploaded document {file.filename}",
+            subject_type="document", subject_id=document_record["id"]
+        )
         
         # Log activity
         activity_log = ActivityLog(
@@ -2852,7 +2902,32 @@ async def export_activity_logs(
     if format.lower() != "csv":
         raise HTTPException(status_code=400, detail="Only CSV format is currently supported")
     
-    # Build filter query (same as get_activity_logs)
+    filter_query = activity_log_export_query(user_id, action_filter, start_date, end_date)
+    
+    # Get all matching logs (limit to 10000 for performance; use an export job for more)
+    logs = await db.activity_logs.find(filter_query).sort("timestamp", -1).limit(10000).to_list(10000)
+    
+    # Create CSV content
+    csv_content = "Date,Time,User Name,User Email,Action\n"
+    csv_content += csv_text(await activity_log_export_rows(logs), quoting=csv.QUOTE_ALL)
+    
+    return APIResponse(
+        success=True,
+        message="Activity logs exported successfully",
+        data={
+            "filename": f"activity_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            "content": csv_content,
+            "total_records": len(logs)
+        }
+    )
+
+def activity_log_export_query(
+    user_id: Optional[str] = None,
+    action_filter: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> dict:
+    """Build filter query (same as get_activity_logs)"""
     filter_query = {"is_active": True}
     
     if user_id:
@@ -2877,33 +2952,33 @@ async def export_activity_logs(
                 raise HTTPException(status_code=400, detail="Invalid end_date format")
         if date_filter:
             filter_query["timestamp"] = date_filter
-    
-    # Get all matching logs (limit to 10000 for performance)
-    logs = await db.activity_logs.find(filter_query).sort("timestamp", -1).limit(10000).to_list(10000)
-    
-    # Create CSV content
-    csv_content = "Date,Time,User Name,User Email,Action\n"
-    
+    return filter_query
+
+async def activity_log_export_rows(logs: List[dict]) -> List[List[str]]:
+    """Date, time, user name, user email and action per log, with one user lookup per batch"""
+    users = {
+        user["id"]: user for user in await db.users.find(
+            {"id": {"$in": list({log["user_id"] for log in logs})}, "is_deleted": False},
+            {"_id": 0, "id": 1, "name": 1, "email": 1}
+        ).to_list(None)
+    }
+    rows = []
     for log in logs:
-        user = await db.users.find_one({"id": log["user_id"], "is_deleted": False})
+        user = users.get(log["user_id"])
         timestamp = log["timestamp"]
-        date_str = timestamp.strftime("%Y-%m-%d")
-        time_str = timestamp.strftime("%H:%M:%S")
-        user_name = user["name"] if user else "Unknown User"
-        user_email = user["email"] if user else "Unknown Email"
-        action = log["action"].replace('"', '""')  # Escape quotes for CSV
-        
-        csv_content += f'"{date_str}","{time_str}","{user_name}","{user_email}","{action}"\n'
-    
-    return APIResponse(
-        success=True,
-        message="Activity logs exported successfully",
-        data={
-            "filename": f"activity_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            "content": csv_content,
-            "total_records": len(logs)
-        }
-    )
+        rows.append([
+            timestamp.strftime("%Y-%m-%d"),
+            timestamp.strftime("%H:%M:%S"),
+            user["name"] if user else "Unknown User",
+            user["email"] if user else "Unknown Email",
+            log["action"]
+        ])
+    return rows
+
+def csv_text(rows: List[list], **options) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n", **options).writerows(rows)
+    return buffer.getvalue()
 
 # Initialize QMS master data
 async def initialize_qms_master_data():
@@ -3114,6 +3189,7 @@ async def initialize_qms_master_data():
             }
             pricing = PricingModel(**pricing_data)
             await db.pricing_models.insert_one(pricing.dict())
+    _quotation_catalog_cache.clear()
     
     # Initialize default pricing lists
     default_pricing_lists = [
@@ -3775,6 +3851,9 @@ async def update_master_data(table_name: str, record_id: str, data: dict, curren
         data["updated_at"] = datetime.now(timezone.utc)
         
         await collection.update_one({id_field: record_id}, {"$set": data})
+        for source, (source_collection, key_field, _) in DISPLAY_NAME_SOURCES.items():
+            if source_collection == collection_name and key_field == id_field:
+                await enqueue_display_name_fanout(source, record_id, existing, data)
         
         # Log activity
         await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated {table_name}: {data.get(unique_field, record_id)}"))
@@ -4330,6 +4409,7 @@ async def update_company(company_id: str, company_data: dict, current_user: User
         company_data["updated_at"] = datetime.now(timezone.utc)
         
         await db.companies.update_one({"company_id": company_id}, {"$set": company_data})
+        await enqueue_display_name_fanout("company", company_id, existing, company_data)
         
         # Log activity
         await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated company: {company_id}"))
@@ -5051,6 +5131,23 @@ class OpportunityAnalytics(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Enhanced Audit Trails
+class AuditEvent(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    
+    # Stream key: (entity_type, entity_id, timestamp)
+    entity_type: str  # opportunity
+    entity_id: str
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    
+    # What changed: the entity itself or one of its sub-records
+    action: str  # create, update, transition, reassign, qualify, approval_request
+    subject_type: str  # opportunity, document, clause, important_date, won_details, ...
+    subject_id: Optional[str] = None
+    summary: str
+    changes: List[List[Any]] = []  # [[field, old, new], ...]
+    
+    user_id: str
+
 class OpportunityAuditLog(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     
@@ -5677,6 +5774,23 @@ class QualificationRule(BaseModel):
     updated_by: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    
+    @validator('validation_logic')
+    def validate_validation_logic(cls, v):
+        if not v:
+            return v
+        try:
+            logic = json.loads(v)
+        except ValueError:
+            raise ValueError('Validation logic must be valid JSON')
+        if not isinstance(logic, dict):
+            raise ValueError('Validation logic must be a JSON object')
+        if logic.get("type") == "regex" and logic.get("pattern"):
+            try:
+                re.compile(logic["pattern"])
+            except (TypeError, re.error) as e:
+                raise ValueError(f'Invalid validation pattern: {str(e)}')
+        return v
 
 # Opportunity Qualification Status - Track compliance with 38 rules
 class OpportunityQualification(BaseModel):
@@ -6067,73 +6181,10 @@ async def generate_lead_id():
 async def get_leads(current_user: User = Depends(get_current_user)):
     """Get all leads with enriched data"""
     try:
-        # Get leads with enriched master data
-        pipeline = [
-            {"$match": {"is_deleted": False}},
-            # Lookup lead subtype
-            {"$lookup": {
-                "from": "lead_subtype_master",
-                "localField": "lead_subtype_id",
-                "foreignField": "id",
-                "as": "lead_subtype"
-            }},
-            {"$unwind": {"path": "$lead_subtype", "preserveNullAndEmptyArrays": True}},
-            # Lookup lead source
-            {"$lookup": {
-                "from": "lead_source_master",
-                "localField": "lead_source_id",
-                "foreignField": "id",
-                "as": "lead_source"
-            }},
-            {"$unwind": {"path": "$lead_source", "preserveNullAndEmptyArrays": True}},
-            # Lookup company
-            {"$lookup": {
-                "from": "companies",
-                "localField": "company_id",
-                "foreignField": "company_id",
-                "as": "company"
-            }},
-            {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            # Lookup currency
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            # Lookup assigned user
-            {"$lookup": {
-                "from": "users",
-                "localField": "assigned_to_user_id",
-                "foreignField": "id",
-                "as": "assigned_user"
-            }},
-            {"$unwind": {"path": "$assigned_user", "preserveNullAndEmptyArrays": True}},
-            # Add enriched fields
-            {"$addFields": {
-                "lead_subtype_name": "$lead_subtype.lead_subtype_name",
-                "lead_source_name": "$lead_source.lead_source_name",
-                "company_name": "$company.company_name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
-                "assigned_user_name": "$assigned_user.name"
-            }},
-            {"$sort": {"created_at": -1}}
-        ]
-        
-        leads_cursor = db.leads.aggregate(pipeline)
-        leads = await leads_cursor.to_list(1000)
-        
-        # Remove MongoDB _id field
-        for lead in leads:
-            lead.pop("_id", None)
-            # Remove nested objects to avoid duplication
-            lead.pop("lead_subtype", None)
-            lead.pop("lead_source", None)
-            lead.pop("company", None)
-            lead.pop("currency", None)
-            lead.pop("assigned_user", None)
+        # Display names (company, currency, assignee, subtype, source) are stored on the lead
+        leads = await db.leads.find(
+            {"is_deleted": False}, {"_id": 0, "display_fields_version": 0}
+        ).sort("created_at", -1).to_list(1000)
         
         return APIResponse(success=True, message="Leads retrieved successfully", data=leads)
         
@@ -6181,7 +6232,7 @@ async def create_lead(lead_data: dict, current_user: User = Depends(get_current_
             raise HTTPException(status_code=400, detail="Assigned user not found")
         
         # Insert lead
-        await db.leads.insert_one(lead.dict())
+        await db.leads.insert_one(await with_display_fields("leads", lead.dict()))
         
         # Log activity
         await log_activity(ActivityLog(user_id=current_user.id, action=f"Created lead: {lead.project_title} ({lead_id})"))
@@ -6313,6 +6364,7 @@ async def update_lead(lead_id: str, lead_data: dict, current_user: User = Depend
                 raise HTTPException(status_code=400, detail="Assigned user not found")
         
         # Update lead
+        lead_data.update(await display_field_updates("leads", lead_data))
         await db.leads.update_one({"id": lead_id}, {"$set": lead_data})
         
         # Log activity
@@ -6446,7 +6498,10 @@ async def approve_lead(lead_id: str, approval_data: dict, current_user: User = D
                     )
                     
                     # Insert opportunity
-                    await db.opportunities.insert_one(opportunity_data.dict())
+                    await insert_new_opportunity(
+                        opportunity_data.dict(), current_user.id,
+                        f"Auto-created opportunity {opp_id} from approved lead: {existing_lead.get('project_title', lead_id)}"
+                    )
                     opportunity_id = opp_id
                     
                     # Create stage history entry
@@ -6841,6 +6896,7 @@ async def create_lead_competitor(lead_id: str, competitor_data: dict, current_us
         
         # Insert competitor
         await db.lead_competitors.insert_one(competitor.dict())
+        await apply_lead_competitor_added(competitor.dict())
         
         return APIResponse(success=True, message="Lead competitor created successfully", data={"competitor_id": competitor.id})
         
@@ -6922,82 +6978,92 @@ async def create_lead_document(lead_id: str, document_data: dict, current_user:
 
 # ===== LEAD BULK OPERATIONS =====
 
+# Lead export columns, in CSV order
+LEAD_EXPORT_COLUMNS = [
+    "lead_id", "project_title", "lead_subtype_name", "lead_source_name", "company_name", "expected_revenue",
+    "currency_code", "convert_to_opportunity_date", "assigned_user_name", "approval_status",
+    "project_description", "decision_maker_percentage", "notes", "created_at", "updated_at"
+]
+
+def lead_export_pipeline() -> List[dict]:
+    """Leads enriched with master data names, newest first"""
+    return [
+        {"$match": {"is_deleted": False}},
+        # Add all the lookups from get_leads
+        {"$lookup": {
+            "from": "lead_subtype_master",
+            "localField": "lead_subtype_id",
+            "foreignField": "id",
+            "as": "lead_subtype"
+        }},
+        {"$unwind": {"path": "$lead_subtype", "preserveNullAndEmptyArrays": True}},
+        {"$lookup": {
+            "from": "lead_source_master",
+            "localField": "lead_source_id",
+            "foreignField": "id",
+            "as": "lead_source"
+        }},
+        {"$unwind": {"path": "$lead_source", "preserveNullAndEmptyArrays": True}},
+        {"$lookup": {
+            "from": "companies",
+            "localField": "company_id",
+            "foreignField": "company_id",
+            "as": "company"
+        }},
+        {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
+        {"$lookup": {
+            "from": "master_currencies",
+            "localField": "revenue_currency_id",
+            "foreignField": "currency_id",
+            "as": "currency"
+        }},
+        {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "assigned_to_user_id",
+            "foreignField": "id",
+            "as": "assigned_user"
+        }},
+        {"$unwind": {"path": "$assigned_user", "preserveNullAndEmptyArrays": True}},
+        # Project fields for export
+        {"$project": {
+            "lead_id": 1,
+            "project_title": 1,
+            "lead_subtype_name": "$lead_subtype.lead_subtype_name",
+            "lead_source_name": "$lead_source.lead_source_name",
+            "company_name": "$company.company_name",
+            "expected_revenue": 1,
+            "currency_code": "$currency.currency_code",
+            "convert_to_opportunity_date": 1,
+            "assigned_user_name": "$assigned_user.name",
+            "approval_status": 1,
+            "project_description": 1,
+            "decision_maker_percentage": 1,
+            "notes": 1,
+            "created_at": 1,
+            "updated_at": 1
+        }},
+        {"$sort": {"created_at": -1}}
+    ]
+
+def format_lead_export_row(lead: dict) -> dict:
+    """Format dates for CSV"""
+    if lead.get("created_at"):
+        lead["created_at"] = lead["created_at"].strftime("%Y-%m-%d %H:%M:%S")
+    if lead.get("updated_at"):
+        lead["updated_at"] = lead["updated_at"].strftime("%Y-%m-%d %H:%M:%S")
+    if lead.get("convert_to_opportunity_date"):
+        lead["convert_to_opportunity_date"] = lead["convert_to_opportunity_date"].strftime("%Y-%m-%d")
+    return lead
+
 @api_router.get("/leads/export", response_model=APIResponse)
 @require_permission("/leads", "view")
 async def export_leads(current_user: User = Depends(get_current_user)):
     """Export leads to CSV format"""
     try:
-        # Get leads with enriched data for export
-        pipeline = [
-            {"$match": {"is_deleted": False}},
-            # Add all the lookups from get_leads
-            {"$lookup": {
-                "from": "lead_subtype_master",
-                "localField": "lead_subtype_id",
-                "foreignField": "id",
-                "as": "lead_subtype"
-            }},
-            {"$unwind": {"path": "$lead_subtype", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "lead_source_master",
-                "localField": "lead_source_id",
-                "foreignField": "id",
-                "as": "lead_source"
-            }},
-            {"$unwind": {"path": "$lead_source", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "companies",
-                "localField": "company_id",
-                "foreignField": "company_id",
-                "as": "company"
-            }},
-            {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "assigned_to_user_id",
-                "foreignField": "id",
-                "as": "assigned_user"
-            }},
-            {"$unwind": {"path": "$assigned_user", "preserveNullAndEmptyArrays": True}},
-            # Project fields for export
-            {"$project": {
-                "lead_id": 1,
-                "project_title": 1,
-                "lead_subtype_name": "$lead_subtype.lead_subtype_name",
-                "lead_source_name": "$lead_source.lead_source_name",
-                "company_name": "$company.company_name",
-                "expected_revenue": 1,
-                "currency_code": "$currency.currency_code",
-                "convert_to_opportunity_date": 1,
-                "assigned_user_name": "$assigned_user.name",
-                "approval_status": 1,
-                "project_description": 1,
-                "decision_maker_percentage": 1,
-                "notes": 1,
-                "created_at": 1,
-                "updated_at": 1
-            }},
-            {"$sort": {"created_at": -1}}
-        ]
-        
-        leads_cursor = db.leads.aggregate(pipeline)
-        leads = await leads_cursor.to_list(1000)  # Limit to 1000 records for export
-        
-        # Format dates for CSV
-        for lead in leads:
-            if lead.get("created_at"):
-                lead["created_at"] = lead["created_at"].strftime("%Y-%m-%d %H:%M:%S")
-            if lead.get("updated_at"):
-                lead["updated_at"] = lead["updated_at"].strftime("%Y-%m-%d %H:%M:%S")
-            if lead.get("convert_to_opportunity_date"):
-                lead["convert_to_opportunity_date"] = lead["convert_to_opportunity_date"].strftime("%Y-%m-%d")
+        leads_cursor = db.leads.aggregate(lead_export_pipeline())
+        leads = await leads_cursor.to_list(1000)  # Limit to 1000 records for export; use an export job for more
+        leads = [format_lead_export_row(lead) for lead in leads]
         
         return APIResponse(success=True, message="Leads exported successfully", data=leads)
         
@@ -7045,7 +7111,7 @@ async def import_leads(leads_data: list, current_user: User = Depends(get_curren
                     raise ValueError(f"Lead with project title '{lead.project_title}' already exists for this company")
                 
                 # Insert lead
-                await db.leads.insert_one(lead.dict())
+                await db.leads.insert_one(await with_display_fields("leads", lead.dict()))
                 imported_count += 1
                 
             except Exception as e:
@@ -7134,80 +7200,11 @@ async def search_leads(
                 revenue_filter["$lte"] = max_revenue
             match_criteria["expected_revenue"] = revenue_filter
         
-        # Build aggregation pipeline
-        pipeline = [
-            {"$match": match_criteria},
-            # Add enrichment lookups (same as get_leads)
-            {"$lookup": {
-                "from": "lead_subtype_master",
-                "localField": "lead_subtype_id",
-                "foreignField": "id",
-                "as": "lead_subtype"
-            }},
-            {"$unwind": {"path": "$lead_subtype", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "lead_source_master", 
-                "localField": "lead_source_id",
-                "foreignField": "id",
-                "as": "lead_source"
-            }},
-            {"$unwind": {"path": "$lead_source", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "companies",
-                "localField": "company_id",
-                "foreignField": "company_id",
-                "as": "company"
-            }},
-            {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "assigned_to_user_id",
-                "foreignField": "id",
-                "as": "assigned_user"
-            }},
-            {"$unwind": {"path": "$assigned_user", "preserveNullAndEmptyArrays": True}},
-            {"$addFields": {
-                "lead_subtype_name": "$lead_subtype.lead_subtype_name",
-                "lead_source_name": "$lead_source.lead_source_name",
-                "company_name": "$company.company_name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
-                "assigned_user_name": "$assigned_user.name"
-            }},
-            {"$sort": {"created_at": -1}},
-            {"$skip": offset},
-            {"$limit": limit}
-        ]
-        
-        # Get total count for pagination
-        count_pipeline = [
-            {"$match": match_criteria},
-            {"$count": "total"}
-        ]
-        
-        # Execute queries
-        leads_cursor = db.leads.aggregate(pipeline)
-        leads = await leads_cursor.to_list(limit)
-        
-        count_cursor = db.leads.aggregate(count_pipeline)
-        count_result = await count_cursor.to_list(1)
-        total_count = count_result[0]["total"] if count_result else 0
-        
-        # Clean up results
-        for lead in leads:
-            lead.pop("_id", None)
-            lead.pop("lead_subtype", None)
-            lead.pop("lead_source", None)
-            lead.pop("company", None)
-            lead.pop("currency", None)
-            lead.pop("assigned_user", None)
+        # Display names are stored on the lead, so no enrichment lookups are needed
+        leads = await db.leads.find(
+            match_criteria, {"_id": 0, "display_fields_version": 0}
+        ).sort("created_at", -1).skip(offset).limit(limit).to_list(limit)
+        total_count = await db.leads.count_documents(match_criteria)
         
         result = {
             "leads": leads,
@@ -7333,7 +7330,10 @@ async def check_and_convert_old_leads():
                 )
                 
                 # Insert opportunity
-                await db.opportunities.insert_one(opportunity_data.dict())
+                await insert_new_opportunity(
+                    opportunity_data.dict(), "system",
+                    f"Auto-converted opportunity {opp_id} from lead approved over 4 weeks ago: {lead.get('project_title', lead['id'])}"
+                )
                 
                 # Create stage history entry
                 if initial_stage:
@@ -7953,6 +7953,7 @@ async def initialize_qualification_rules():
                 rule = QualificationRule(**rule_data)
                 await db.qualification_rules.insert_one(rule.dict())
         
+        _qualification_rule_cache.clear()
         print("38 Qualification rules initialized successfully")
         
     except Exception as e:
@@ -8047,73 +8048,14 @@ async def get_opportunities(current_user: User = Depends(get_current_user)):
         # Run auto-conversion check
         await check_and_convert_old_leads()
         
-        # Get opportunities with enriched data
+        # Display names are stored on the opportunity; only the stage name needs mapping
         pipeline = [
             {"$match": {"is_deleted": False}},
-            # Lookup company
-            {"$lookup": {
-                "from": "companies",
-                "localField": "company_id",
-                "foreignField": "company_id",
-                "as": "company"
-            }},
-            {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            # Lookup current stage
-            {"$lookup": {
-                "from": "opportunity_stages",
-                "localField": "current_stage_id",
-                "foreignField": "id",
-                "as": "current_stage"
-            }},
-            {"$unwind": {"path": "$current_stage", "preserveNullAndEmptyArrays": True}},
-            # Lookup opportunity owner
-            {"$lookup": {
-                "from": "users",
-                "localField": "opportunity_owner_id",
-                "foreignField": "id",
-                "as": "owner"
-            }},
-            {"$unwind": {"path": "$owner", "preserveNullAndEmptyArrays": True}},
-            # Lookup currency
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            # Lookup linked lead
-            {"$lookup": {
-                "from": "leads",
-                "localField": "lead_id",
-                "foreignField": "id",
-                "as": "linked_lead"
-            }},
-            {"$unwind": {"path": "$linked_lead", "preserveNullAndEmptyArrays": True}},
-            # Add enriched fields
-            {"$addFields": {
-                "company_name": "$company.company_name",
-                "current_stage_name": "$current_stage.stage_name",
-                "current_stage_code": "$current_stage.stage_code",
-                "owner_name": "$owner.name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
-                "linked_lead_id": "$linked_lead.lead_id"
-            }},
-            {"$sort": {"created_at": -1}}
+            {"$sort": {"created_at": -1}},
+            {"$limit": 1000},
+            *OPPORTUNITY_DISPLAY_STAGES
         ]
-        
-        opportunities_cursor = db.opportunities.aggregate(pipeline)
-        opportunities = await opportunities_cursor.to_list(1000)
-        
-        # Remove MongoDB _id field and nested objects
-        for opp in opportunities:
-            opp.pop("_id", None)
-            opp.pop("company", None)
-            opp.pop("current_stage", None)
-            opp.pop("owner", None)
-            opp.pop("currency", None)
-            opp.pop("linked_lead", None)
+        opportunities = await db.opportunities.aggregate(pipeline).to_list(1000)
         
         return APIResponse(success=True, message="Opportunities retrieved successfully", data=opportunities)
         
@@ -8212,7 +8154,7 @@ async def create_opportunity(opportunity_data: dict, current_user: User = Depend
             raise HTTPException(status_code=400, detail="Opportunity owner not found")
         
         # Insert opportunity
-        await db.opportunities.insert_one(opportunity.dict())
+        await insert_new_opportunity(opportunity.dict(), current_user.id, f"Created opportunity: {opportunity.opportunity_title} ({opp_id})")
         
         # Create initial stage history entry
         if opportunity.current_stage_id:
@@ -8237,9 +8179,1805 @@ async def create_opportunity(opportunity_data: dict, current_user: User = Depend
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ===== OPPORTUNITY KPI SNAPSHOT STORE =====
+
+# Stage codes written directly by update_opportunity_stage that close an opportunity
+CLOSING_STAGE_CODE_NAMES = {"L6": "Won", "L7": "Lost", "L8": "Dropped"}
+LOST_STAGE_NAMES = ["Lost", "Dropped"]
+KPI_SNAPSHOT_REBUILD_HOUR_UTC = int(os.environ.get('KPI_SNAPSHOT_REBUILD_HOUR_UTC', '2'))
+
+# Opportunity stage master cache (small table, loaded once per process)
+_opportunity_stage_cache: Dict[str, Dict[str, Any]] = {}
+
+async def get_opportunity_stage_map(refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Get opportunity stages keyed by id, reloading only when requested or empty"""
+    if refresh or not _opportunity_stage_cache:
+        stages = await db.opportunity_stages.find({"is_deleted": False}, {"_id": 0}).to_list(None)
+        _opportunity_stage_cache.clear()
+        _opportunity_stage_cache.update({stage["id"]: stage for stage in stages})
+    return _opportunity_stage_cache
+
+def describe_opportunity_stage(stage_ref: Optional[str], stage_map: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Resolve a current_stage_id (stage id or raw stage code) to its name, code and outcome"""
+    stage = stage_map.get(stage_ref) if stage_ref else None
+    if stage:
+        stage_name, stage_code = stage.get("stage_name", "Unknown"), stage.get("stage_code")
+    else:
+        stage_name = CLOSING_STAGE_CODE_NAMES.get(stage_ref, stage_ref or "Unknown")
+        stage_code = stage_ref
+    
+    if stage_name == "Won":
+        outcome = "won"
+    elif stage_name in LOST_STAGE_NAMES:
+        outcome = "lost"
+    else:
+        outcome = "open"
+    return {"stage_id": stage_ref, "stage_name": stage_name, "stage_code": stage_code, "outcome": outcome}
+
+def stage_code_outcomes(stage_map: Dict[str, Dict[str, Any]], stage_refs=()) -> Dict[str, Set[str]]:
+    """Get every outcome each funnel stage code can stand for across tracks.
+    
+    Codes repeat across tracks (Tender L5 is Commercial Evaluation, Non-Tender L5 is Won), so a
+    code maps to the outcomes of all master stages and referenced stages using it, falling back
+    to the closing-code defaults only for codes nothing defines."""
+    outcomes = {code: set() for code in FUNNEL_STAGE_CODES}
+    for stage_id in list(stage_map) + [ref for ref in stage_refs if ref not in stage_map]:
+        stage = describe_opportunity_stage(stage_id, stage_map)
+        if stage["stage_code"] in outcomes:
+            outcomes[stage["stage_code"]].add(stage["outcome"])
+    for code, code_outcomes in outcomes.items():
+        if not code_outcomes:
+            code_outcomes.add(describe_opportunity_stage(code, {})["outcome"])
+    return outcomes
+
+def opportunity_snapshot_contribution(opportunity: Optional[dict], stage_map: Dict[str, Dict[str, Any]]):
+    """Get the snapshot key, stage info and metric contribution of a single opportunity"""
+    if not opportunity or opportunity.get("is_deleted"):
+        return None
+    
+    created_at = opportunity.get("created_at")
+    period = created_at.strftime("%Y-%m") if isinstance(created_at, datetime) else "unknown"
+    stage = describe_opportunity_stage(opportunity.get("current_stage_id"), stage_map)
+    revenue = float(opportunity.get("expected_revenue") or 0)
+    
+    metrics = {
+        "opportunity_count": 1,
+        "pipeline_value": revenue,
+        "won_count": 1 if stage["outcome"] == "won" else 0,
+        "won_revenue": revenue if stage["outcome"] == "won" else 0.0,
+        "lost_count": 1 if stage["outcome"] == "lost" else 0,
+        "lost_revenue": revenue if stage["outcome"] == "lost" else 0.0
+    }
+    return (period, opportunity.get("opportunity_owner_id"), stage["stage_id"]), stage, metrics
+
+KPI_SNAPSHOT_APPLIED_EVENTS = 200  # Recent event ids kept per snapshot to make outbox replays no-ops
+
+async def update_opportunity_kpi_snapshot(before: Optional[dict], after: Optional[dict]):
+    """Apply the difference between two versions of an opportunity to the KPI snapshot store"""
+    await update_opportunity_kpi_snapshots([(before, after)])
+
+async def update_opportunity_kpi_snapshots(changes: List[tuple], event_id: Optional[str] = None):
+    """Apply many (before, after) opportunity changes to the KPI snapshot store in one write
+    
+    With an event_id each snapshot records the event, so replaying it changes nothing.
+    """
+    try:
+        stage_map = await get_opportunity_stage_map()
+        deltas = {}
+        for before, after in changes:
+            for sign, opportunity in ((-1, before), (1, after)):
+                contribution = opportunity_snapshot_contribution(opportunity, stage_map)
+                if contribution is None:
+                    continue
+                key, stage, metrics = contribution
+                bucket = deltas.setdefault(key, {"stage": stage, "metrics": {name: 0 for name in metrics}})
+                for name, value in metrics.items():
+                    bucket["metrics"][name] += sign * value
+        
+        now = datetime.now(timezone.utc)
+        operations = []
+        for (period, owner_id, stage_id), bucket in deltas.items():
+            increments = {name: value for name, value in bucket["metrics"].items() if value}
+            if not increments:
+                continue
+            query = {"period": period, "owner_id": owner_id, "stage_id": stage_id}
+            update = {
+                "$inc": increments,
+                "$set": {
+                    "stage_name": bucket["stage"]["stage_name"],
+                    "stage_code": bucket["stage"]["stage_code"],
+                    "outcome": bucket["stage"]["outcome"],
+                    "updated_at": now
+                },
+                "$setOnInsert": {"id": str(uuid.uuid4())}
+            }
+            if event_id:
+                query["applied_events"] = {"$ne": event_id}
+                update["$push"] = {"applied_events": {"$each": [event_id], "$slice": -KPI_SNAPSHOT_APPLIED_EVENTS}}
+            operations.append(UpdateOne(query, update, upsert=True))
+        
+        if operations:
+            try:
+                await db.opportunity_kpi_snapshots.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # A snapshot that already holds the event fails the upsert on the unique key: already applied
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+    except Exception as e:
+        # The nightly rebuild reconciles any missed delta
+        print(f"Warning: Failed to update KPI snapshot: {str(e)}")
+
+async def rebuild_opportunity_kpi_snapshots() -> int:
+    """Rebuild the KPI snapshot store from raw opportunities"""
+    stage_map = await get_opportunity_stage_map(refresh=True)
+    rebuilt_at = datetime.now(timezone.utc)
+    
+    pipeline = [
+        {"$match": {"is_deleted": False}},
+        {"$group": {
+            "_id": {
+                "period": {"$dateToString": {"format": "%Y-%m", "date": "$created_at", "onNull": "unknown"}},
+                "owner_id": "$opportunity_owner_id",
+                "stage_id": "$current_stage_id"
+            },
+            "opportunity_count": {"$sum": 1},
+            "pipeline_value": {"$sum": {"$ifNull": [{"$toDouble": "$expected_revenue"}, 0]}}
+        }}
+    ]
+    groups = await db.opportunities.aggregate(pipeline).to_list(None)
+    
+    operations = []
+    for group in groups:
+        key = group["_id"]
+        stage = describe_opportunity_stage(key.get("stage_id"), stage_map)
+        is_won, is_lost = stage["outcome"] == "won", stage["outcome"] == "lost"
+        operations.append(ReplaceOne(
+            {"period": key.get("period"), "owner_id": key.get("owner_id"), "stage_id": key.get("stage_id")},
+            {
+                "id": str(uuid.uuid4()),
+                "period": key.get("period"),
+                "owner_id": key.get("owner_id"),
+                "stage_id": key.get("stage_id"),
+                "stage_name": stage["stage_name"],
+                "stage_code": stage["stage_code"],
+                "outcome": stage["outcome"],
+                "opportunity_count": group["opportunity_count"],
+                "pipeline_value": group["pipeline_value"],
+                "won_count": group["opportunity_count"] if is_won else 0,
+                "won_revenue": group["pipeline_value"] if is_won else 0.0,
+                "lost_count": group["opportunity_count"] if is_lost else 0,
+                "lost_revenue": group["pipeline_value"] if is_lost else 0.0,
+                "rebuilt_at": rebuilt_at,
+                "updated_at": rebuilt_at
+            },
+            upsert=True
+        ))
+    
+    if operations:
+        await db.opportunity_kpi_snapshots.bulk_write(operations, ordered=False)
+    
+    # Drop buckets that no longer have any opportunities
+    await db.opportunity_kpi_snapshots.delete_many({"$or": [
+        {"rebuilt_at": {"$lt": rebuilt_at}},
+        {"rebuilt_at": {"$exists": False}}
+    ]})
+    return len(operations)
+
+async def run_nightly_kpi_snapshot_rebuild():
+    """Background loop that reconciles the KPI snapshot store once a day"""
+    while True:
+        now = datetime.now(timezone.utc)
+        next_run = now.replace(hour=KPI_SNAPSHOT_REBUILD_HOUR_UTC, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            bucket_count = await rebuild_opportunity_kpi_snapshots()
+            print(f"KPI snapshot store rebuilt ({bucket_count} buckets)")
+        except Exception as e:
+            print(f"Error rebuilding KPI snapshot store: {str(e)}")
+
+async def summarize_opportunity_kpi_snapshots(query: dict) -> Dict[str, Any]:
+    """Sum snapshot buckets matching a query into headline pipeline metrics"""
+    buckets = await db.opportunity_kpi_snapshots.find(query, {"_id": 0}).to_list(None)
+    
+    totals = {name: 0 for name in ["opportunity_count", "pipeline_value", "won_count", "won_revenue", "lost_count", "lost_revenue"]}
+    stage_breakdown = {}
+    for bucket in buckets:
+        for name in totals:
+            totals[name] += bucket.get(name, 0)
+        stage = stage_breakdown.setdefault(bucket.get("stage_name", "Unknown"), {
+            "stage_code": bucket.get("stage_code"), "outcome": bucket.get("outcome", "open"), "count": 0, "value": 0.0
+        })
+        stage["count"] += bucket.get("opportunity_count", 0)
+        stage["value"] += bucket.get("pipeline_value", 0)
+    
+    closed = totals["won_count"] + totals["lost_count"]
+    totals["win_rate"] = (totals["won_count"] / closed * 100) if closed > 0 else 0
+    totals["average_deal_size"] = (totals["pipeline_value"] / totals["opportunity_count"]) if totals["opportunity_count"] > 0 else 0
+    totals["stage_breakdown"] = stage_breakdown
+    return totals
+
+@api_router.post("/opportunities/kpi-snapshots/rebuild", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def trigger_kpi_snapshot_rebuild(current_user: User = Depends(get_current_user)):
+    """Manually rebuild the KPI snapshot store from raw opportunities"""
+    try:
+        bucket_count = await rebuild_opportunity_kpi_snapshots()
+        
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Rebuilt KPI snapshot store: {bucket_count} buckets"))
+        
+        return APIResponse(success=True, message="KPI snapshot store rebuilt successfully", data={"bucket_count": bucket_count})
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ===== DENORMALIZED DISPLAY NAMES =====
+
+DISPLAY_FIELDS_VERSION = 1
+DISPLAY_FIELDS_BATCH_SIZE = 500
+
+# Source -> (collection, key field, fields copied onto referencing documents)
+DISPLAY_NAME_SOURCES = {
+    "company": ("companies", "company_id", ["company_name"]),
+    "user": ("users", "id", ["name"]),
+    "currency": ("master_currencies", "currency_id", ["currency_code", "symbol"]),
+    "stage": ("opportunity_stages", "id", ["stage_name", "stage_code"]),
+    "lead": ("leads", "id", ["lead_id"]),
+    "lead_subtype": ("lead_subtype_master", "id", ["lead_subtype_name"]),
+    "lead_source": ("lead_source_master", "id", ["lead_source_name"])
+}
+
+# Target collection -> [(source, foreign key field, {source field: display field})]
+DENORMALIZED_DISPLAY_FIELDS = {
+    "leads": [
+        ("company", "company_id", {"company_name": "company_name"}),
+        ("currency", "revenue_currency_id", {"currency_code": "currency_code", "symbol": "currency_symbol"}),
+        ("user", "assigned_to_user_id", {"name": "assigned_user_name"}),
+        ("lead_subtype", "lead_subtype_id", {"lead_subtype_name": "lead_subtype_name"}),
+        ("lead_source", "lead_source_id", {"lead_source_name": "lead_source_name"})
+    ],
+    "opportunities": [
+        ("company", "company_id", {"company_name": "company_name"}),
+        ("user", "opportunity_owner_id", {"name": "owner_name"}),
+        ("currency", "revenue_currency_id", {"currency_code": "currency_code", "symbol": "currency_symbol"}),
+        # current_stage_name already holds raw stage codes on some paths, so the display name has its own field
+        ("stage", "current_stage_id", {"stage_name": "current_stage_display_name", "stage_code": "current_stage_code"}),
+        ("lead", "lead_id", {"lead_id": "linked_lead_id"})
+    ],
+    "quotations": [
+        ("company", "company_id", {"company_name": "company_name"})
+    ],
+    "service_delivery_requests": [
+        ("company", "company_id", {"company_name": "client_name"}),
+        ("user", "sales_owner_id", {"name": "sales_owner_name"}),
+        ("user", "delivery_owner_id", {"name": "delivery_owner_name"})
+    ]
+}
+
+# Collections whose company_id is taken from the parent opportunity
+DISPLAY_FIELDS_FROM_OPPORTUNITY = {"quotations", "service_delivery_requests"}
+
+async def load_display_source_values(source: str, keys) -> Dict[str, dict]:
+    collection_name, key_field, fields = DISPLAY_NAME_SOURCES[source]
+    keys = [key for key in set(keys) if key]
+    if not keys:
+        return {}
+    projection = {"_id": 0, key_field: 1, **{field: 1 for field in fields}}
+    rows = await db[collection_name].find({key_field: {"$in": keys}}, projection).to_list(None)
+    return {row[key_field]: row for row in rows}
+
+async def apply_display_fields(collection_name: str, documents: List[dict], only_fields: Optional[set] = None) -> List[dict]:
+    """Fill the denormalized display fields of documents in place, batching lookups per source.
+    
+    With only_fields, just the specs whose foreign key is in that set are resolved.
+    """
+    if collection_name in DISPLAY_FIELDS_FROM_OPPORTUNITY and only_fields is None:
+        missing = [document for document in documents if not document.get("company_id") and document.get("opportunity_id")]
+        if missing:
+            opportunities = await db.opportunities.find(
+                {"id": {"$in": list({document["opportunity_id"] for document in missing})}},
+                {"_id": 0, "id": 1, "company_id": 1}
+            ).to_list(None)
+            company_ids = {opportunity["id"]: opportunity.get("company_id") for opportunity in opportunities}
+            for document in missing:
+                if company_ids.get(document["opportunity_id"]):
+                    document["company_id"] = company_ids[document["opportunity_id"]]
+    
+    for source, key_field, mapping in DENORMALIZED_DISPLAY_FIELDS[collection_name]:
+        if only_fields is not None and key_field not in only_fields:
+            continue
+        values = await load_display_source_values(source, (document.get(key_field) for document in documents))
+        for document in documents:
+            if not document.get(key_field):
+                # Nothing referenced, so nothing to display
+                for display_field in mapping.values():
+                    document[display_field] = None
+                continue
+            # A missing source row or value keeps whatever the document already holds
+            row = values.get(document[key_field], {})
+            for source_field, display_field in mapping.items():
+                if row.get(source_field) is not None:
+                    document[display_field] = row[source_field]
+    
+    if only_fields is None:
+        for document in documents:
+            document["display_fields_version"] = DISPLAY_FIELDS_VERSION
+    return documents
+
+async def with_display_fields(collection_name: str, document: dict) -> dict:
+    """Return a new document with its display fields filled"""
+    return (await apply_display_fields(collection_name, [document]))[0]
+
+async def display_field_updates(collection_name: str, changes: dict) -> dict:
+    """Display fields to $set alongside an update that may change foreign keys"""
+    key_fields = {key_field for _, key_field, _ in DENORMALIZED_DISPLAY_FIELDS[collection_name]} & set(changes)
+    if not key_fields:
+        return {}
+    resolved = dict(changes)
+    await apply_display_fields(collection_name, [resolved], only_fields=key_fields)
+    return {field: value for field, value in resolved.items() if field not in changes}
+
+async def backfill_display_fields():
+    """Populate display fields on documents written before they were denormalized"""
+    for collection_name in DENORMALIZED_DISPLAY_FIELDS:
+        collection = db[collection_name]
+        while True:
+            documents = await collection.find(
+                {"display_fields_version": {"$ne": DISPLAY_FIELDS_VERSION}}
+            ).limit(DISPLAY_FIELDS_BATCH_SIZE).to_list(DISPLAY_FIELDS_BATCH_SIZE)
+            if not documents:
+                break
+            
+            display_fields = [
+                field for _, _, mapping in DENORMALIZED_DISPLAY_FIELDS[collection_name] for field in mapping.values()
+            ] + ["company_id", "display_fields_version"]
+            await apply_display_fields(collection_name, documents)
+            await collection.bulk_write([
+                UpdateOne({"_id": document["_id"]}, {"$set": {field: document[field] for field in display_fields if field in document}})
+                for document in documents
+            ], ordered=False)
+
+async def enqueue_display_name_fanout(source: str, key: str, before: dict, changes: dict):
+    """Queue propagation of renamed source fields to every document that displays them"""
+    _, _, fields = DISPLAY_NAME_SOURCES[source]
+    values = {field: changes[field] for field in fields if field in changes and changes[field] != before.get(field)}
+    if not values:
+        return
+    event = build_outbox_event("display_names.changed", key, {"source": source, "values": values}, ["display_name_fanout"])
+    await db.outbox_events.insert_one(event)
+    _outbox_wakeup.set()
+
+async def handle_display_name_fanout_event(event: dict):
+    source, values = event["payload"]["source"], event["payload"]["values"]
+    for collection_name, specs in DENORMALIZED_DISPLAY_FIELDS.items():
+        for spec_source, key_field, mapping in specs:
+            update = {mapping[field]: value for field, value in values.items() if field in mapping}
+            if spec_source == source and update:
+                await db[collection_name].update_many({key_field: event["aggregate_id"]}, {"$set": update})
+                if collection_name in LIVE_UPDATE_COLLECTIONS:
+                    for entity_id in await db[collection_name].distinct("id", {key_field: event["aggregate_id"]}):
+                        publish_live_update(collection_name, entity_id, "update", list(update))
+    
+    # The quotation inbox shows creator and submitter names
+    if source == "user" and "name" in values:
+        quotation_ids = await db.quotations.distinct("id", {"$or": [
+            {"created_by": event["aggregate_id"]}, {"submitted_by": event["aggregate_id"]}
+        ]})
+        for quotation_id in quotation_ids:
+            publish_live_update("quotations", quotation_id, "update")
+
+# ===== TRANSACTIONAL OUTBOX & EVENT WORKERS =====
+
+OUTBOX_WORKER_COUNT = int(os.environ.get('OUTBOX_WORKER_COUNT', '4'))
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_POLL_SECONDS = 5
+OUTBOX_LOCK_SECONDS = 60
+OUTBOX_RETENTION_DAYS = 7
+
+# Opportunity fields carried in events so consumers never re-read the document
+OUTBOX_OPPORTUNITY_FIELDS = [
+    "id", "opportunity_id", "lead_id", "created_at", "current_stage_id",
+    "opportunity_owner_id", "expected_revenue", "is_deleted"
+]
+
+_outbox_wakeup = asyncio.Event()
+_transactions_supported: Optional[bool] = None
+
+def outbox_opportunity_state(opportunity: Optional[dict]) -> Optional[dict]:
+    """Compact copy of the opportunity fields event consumers rely on"""
+    if opportunity is None:
+        return None
+    return {field: opportunity.get(field) for field in OUTBOX_OPPORTUNITY_FIELDS}
+
+def build_outbox_event(event_type: str, aggregate_id: str, payload: dict, handlers: List[str]) -> dict:
+    """Create an outbox event; its id doubles as the idempotency key for every handler"""
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "event_type": event_type,
+        "aggregate_id": aggregate_id,
+        "payload": payload,
+        "handlers": handlers,
+        "completed_handlers": [],
+        "status": "pending",
+        "attempts": 0,
+        "available_at": now,
+        "created_at": now
+    }
+
+async def run_in_transaction(operation):
+    """Run operation(session) in a transaction, or with session=None where transactions are unavailable"""
+    global _transactions_supported
+    if _transactions_supported is not False:
+        try:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    result = await operation(session)
+            _transactions_supported = True
+            return result
+        except OperationFailure as e:
+            # Standalone servers reject transactions (IllegalOperation)
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+    
+    return await operation(None)
+
+async def write_with_outbox(collection, query: dict, update: dict, events: List[dict], related_writes=None):
+    """Apply an update, any related_writes(session) and its outbox events, atomically when transactions are available.
+    
+    Returns False without writing anything else when the query matched no document."""
+    async def write(session):
+        result = await collection.update_one(query, update, session=session)
+        if result.matched_count == 0:
+            return False
+        if related_writes is not None:
+            await related_writes(session)
+        await db.outbox_events.insert_many(events, session=session)
+        return True
+    
+    if not await run_in_transaction(write):
+        return False
+    _outbox_wakeup.set()
+    publish_live_update(collection.name, query.get("id"), "update", list(update.get("$set", {})))
+    return True
+
+async def handle_stage_history_event(event: dict):
+    history = event["payload"]["stage_history"]
+    await db.opportunity_stage_history.update_one({"id": history["id"]}, {"$setOnInsert": history}, upsert=True)
+
+async def handle_activity_log_event(event: dict):
+    activity = event["payload"]["activity_log"]
+    await db.activity_logs.update_one({"id": activity["id"]}, {"$setOnInsert": activity}, upsert=True)
+
+async def handle_audit_event(event: dict):
+    audit_event = event["payload"]["audit_event"]
+    await db.audit_events.update_one({"id": audit_event["id"]}, {"$setOnInsert": audit_event}, upsert=True)
+
+async def handle_kpi_snapshot_event(event: dict):
+    await update_opportunity_kpi_snapshots([(event["payload"]["before"], event["payload"]["after"])], event["id"])
+
+async def handle_competitor_analytics_event(event: dict):
+    await apply_competitor_analytics_delta(event["payload"]["before"], event["payload"]["after"], event["id"])
+
+async def handle_service_delivery_event(event: dict):
+    # auto_initiate_service_delivery returns the existing SDR when one is already there
+    await auto_initiate_service_delivery(event["aggregate_id"], event["payload"]["user_id"])
+
+OUTBOX_HANDLERS = {
+    "stage_history": handle_stage_history_event,
+    "activity_log": handle_activity_log_event,
+    "audit": handle_audit_event,
+    "kpi_snapshot": handle_kpi_snapshot_event,
+    "competitor_analytics": handle_competitor_analytics_event,
+    "service_delivery": handle_service_delivery_event,
+    "display_name_fanout": handle_display_name_fanout_event
+}
+
+async def claim_outbox_event() -> Optional[dict]:
+    """Lease the next due event, including ones whose previous lease expired"""
+    now = datetime.now(timezone.utc)
+    return await db.outbox_events.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "available_at": {"$lte": now}},
+            {"status": "processing", "locked_until": {"$lte": now}}
+        ]},
+        {"$set": {"status": "processing", "locked_until": now + timedelta(seconds=OUTBOX_LOCK_SECONDS)}, "$inc": {"attempts": 1}},
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def process_outbox_event(event: dict):
+    """Run the event's outstanding handlers, scheduling a retry with backoff on failure"""
+    # Writes are fenced by the claimed attempt so a worker whose lease expired cannot
+    # overwrite the state of a newer claim
+    lease = {"id": event["id"], "attempts": event["attempts"]}
+    
+    async def keep_lease():
+        while True:
+            await asyncio.sleep(OUTBOX_LOCK_SECONDS / 4)
+            result = await db.outbox_events.update_one(lease, {"$set": {
+                "locked_until": datetime.now(timezone.utc) + timedelta(seconds=OUTBOX_LOCK_SECONDS)
+            }})
+            if result.matched_count == 0:
+                return
+    
+    heartbeat = asyncio.create_task(keep_lease())
+    try:
+        for handler_name in event["handlers"]:
+            if handler_name in event.get("completed_handlers", []):
+                continue
+            try:
+                await OUTBOX_HANDLERS[handler_name](event)
+            except Exception as e:
+                error = e.detail if isinstance(e, HTTPException) else str(e)
+                exhausted = event["attempts"] >= OUTBOX_MAX_ATTEMPTS
+                await db.outbox_events.update_one(lease, {"$set": {
+                    "status": "failed" if exhausted else "pending",
+                    "available_at": datetime.now(timezone.utc) + timedelta(seconds=2 ** event["attempts"]),
+                    "last_error": f"{handler_name}: {error}"
+                }})
+                print(f"Warning: Outbox handler {handler_name} failed for event {event['id']} (attempt {event['attempts']}): {error}")
+                return
+            marked = await db.outbox_events.update_one(lease, {"$addToSet": {"completed_handlers": handler_name}})
+            if marked.matched_count == 0:
+                # Another worker holds the event now; its claim finishes the remaining handlers
+                return
+        
+        await db.outbox_events.update_one(lease, {"$set": {
+            "status": "done",
+            "processed_at": datetime.now(timezone.utc)
+        }})
+    finally:
+        heartbeat.cancel()
+
+async def run_outbox_worker():
+    """Consume outbox events until cancelled, waking early when new events are written"""
+    while True:
+        _outbox_wakeup.clear()
+        try:
+            event = await claim_outbox_event()
+        except Exception as e:
+            print(f"Error claiming outbox event: {str(e)}")
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+            continue
+        
+        if event is None:
+            try:
+                await asyncio.wait_for(_outbox_wakeup.wait(), timeout=OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await process_outbox_event(event)
+
+# ===== LIVE UPDATES (SERVER-SENT EVENTS) =====
+
+# Watched collection -> (entity name, menu path whose view permission grants access)
+LIVE_UPDATE_COLLECTIONS = {
+    "opportunities": ("opportunity", "/opportunities"),
+    "quotations": ("quotation", "/opportunities"),
+    "service_delivery_requests": ("service_delivery", "/service-delivery")
+}
+LIVE_UPDATE_QUEUE_SIZE = 1000
+LIVE_UPDATE_HEARTBEAT_SECONDS = 15
+LIVE_UPDATE_RETRY_SECONDS = 5
+
+_live_update_subscribers: List[Dict[str, Any]] = []
+_live_update_source = "memory"
+
+def dispatch_live_update(event: dict):
+    """Fan an event out to every subscriber interested in its entity"""
+    for subscriber in _live_update_subscribers:
+        if event["entity"] not in subscriber["entities"]:
+            continue
+        try:
+            subscriber["queue"].put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow client: drop its backlog and ask it to refetch
+            while not subscriber["queue"].empty():
+                subscriber["queue"].get_nowait()
+            subscriber["queue"].put_nowait({"entity": event["entity"], "operation": "resync"})
+
+def publish_live_update(collection_name: str, entity_id: str, operation: str, changed_fields: Optional[List[str]] = None):
+    """Publish a change from the write path; a no-op while the change stream feeds subscribers"""
+    if _live_update_source == "change_stream" or collection_name not in LIVE_UPDATE_COLLECTIONS:
+        return
+    dispatch_live_update({
+        "entity": LIVE_UPDATE_COLLECTIONS[collection_name][0],
+        "id": entity_id,
+        "operation": operation,
+        "changed_fields": sorted(changed_fields or [])
+    })
+
+def change_stream_live_update(change: dict) -> Optional[dict]:
+    """Convert a change stream document into a compact live update event"""
+    collection_name = change["ns"]["coll"]
+    entity_id = (change.get("fullDocument") or {}).get("id")
+    if collection_name not in LIVE_UPDATE_COLLECTIONS or not entity_id:
+        return None
+    
+    description = change.get("updateDescription") or {}
+    changed_fields = {field.split(".")[0] for field in description.get("updatedFields", {})}
+    changed_fields.update(field.split(".")[0] for field in description.get("removedFields", []))
+    return {
+        "entity": LIVE_UPDATE_COLLECTIONS[collection_name][0],
+        "id": entity_id,
+        "operation": change["operationType"],
+        "changed_fields": sorted(changed_fields)
+    }
+
+async def run_live_update_change_stream():
+    """Feed subscribers from a MongoDB change stream, falling back to in-process publishing on standalone servers"""
+    global _live_update_source
+    pipeline = [
+        {"$match": {
+            "ns.coll": {"$in": list(LIVE_UPDATE_COLLECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace"]}
+        }},
+        # Only the application id is needed from the looked-up document
+        {"$project": {"ns": 1, "operationType": 1, "updateDescription": 1, "fullDocument.id": 1}}
+    ]
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                _live_update_source = "change_stream"
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    event = change_stream_live_update(change)
+                    if event:
+                        dispatch_live_update(event)
+        except OperationFailure as e:
+            _live_update_source = "memory"
+            # 40573: change streams require a replica set; keep the in-process bus
+            if e.code == 40573:
+                print("Change streams unavailable, live updates use the in-process bus")
+                return
+            print(f"Live update change stream failed: {str(e)}")
+            resume_token = None
+        except Exception as e:
+            _live_update_source = "memory"
+            print(f"Live update change stream failed: {str(e)}")
+        await asyncio.sleep(LIVE_UPDATE_RETRY_SECONDS)
+
+async def stream_live_updates(subscriber: Dict[str, Any]):
+    """Yield SSE frames for a subscriber, with heartbeats to keep proxies from closing the stream"""
+    _live_update_subscribers.append(subscriber)
+    sequence = 0
+    try:
+        yield f"event: ready\ndata: {json.dumps({'entities': sorted(subscriber['entities'])})}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber["queue"].get(), timeout=LIVE_UPDATE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            sequence += 1
+            yield f"id: {sequence}\nevent: change\ndata: {json.dumps(event)}\n\n"
+    finally:
+        _live_update_subscribers.remove(subscriber)
+
+@api_router.get("/live-updates")
+async def get_live_updates(token: str, entities: Optional[str] = None):
+    """Stream opportunity, quotation and service delivery changes as Server-Sent Events.
+    
+    EventSource cannot send headers, so the access token is passed as a query parameter.
+    Change streams need a replica set; for local testing start mongod with
+    `--replSet rs0` and run `rs.initiate()` once. Standalone servers use the in-process bus.
+    """
+    current_user = await authenticate_token(token)
+    
+    available_entities = {entity: menu_path for entity, menu_path in LIVE_UPDATE_COLLECTIONS.values()}
+    requested = set(entities.split(",")) if entities else set(available_entities)
+    unknown = requested - set(available_entities)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown entities: {', '.join(sorted(unknown))}")
+    
+    allowed = set()
+    for entity in requested:
+        if await check_permission(current_user, available_entities[entity], "view"):
+            allowed.add(entity)
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Insufficient permissions for live updates")
+    
+    subscriber = {"entities": allowed, "queue": asyncio.Queue(maxsize=LIVE_UPDATE_QUEUE_SIZE)}
+    return StreamingResponse(
+        stream_live_updates(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ===== READ MODEL PROJECTIONS =====
+
+PROJECTION_BATCH_SIZE = 500
+PROJECTION_DEBOUNCE_SECONDS = 0.5
+PROJECTION_VIEWS = ["pipeline_board_view", "sd_upcoming_view", "quotation_inbox_view"]
+
+# Pipeline stages used by the service delivery board (same as enhanced-opportunities)
+SD_PIPELINE_STAGES = {
+    'L1': {'name': 'Prospect', 'probability': 10},
+    'L2': {'name': 'Qualification', 'probability': 25},
+    'L3': {'name': 'Proposal/Bid', 'probability': 40},
+    'L4': {'name': 'Technical Qualification', 'probability': 60},
+    'L5': {'name': 'Commercial Negotiations', 'probability': 75},
+    'L6': {'name': 'Won', 'probability': 100},
+    'L7': {'name': 'Lost', 'probability': 0},
+    'L8': {'name': 'Dropped', 'probability': 0}
+}
+SD_STAGE_ORDER = {"L6": 1, "L5": 2, "L4": 3, "L3": 4, "L2": 5, "L1": 6, "L7": 7, "L8": 8}
+
+def primary_quotation(quotations: List[dict]) -> Optional[dict]:
+    """Approved quotation if there is one, otherwise the latest (quotations sorted newest first)"""
+    approved = [quotation for quotation in quotations if quotation.get("status") == "Approved"]
+    return approved[0] if approved else (quotations[0] if quotations else None)
+
+def build_pipeline_board_row(opportunity: dict, quotations: List[dict], sdr: Optional[dict]) -> dict:
+    quotation = primary_quotation(quotations)
+    return {
+        "id": opportunity["id"],
+        "opportunity_id": opportunity.get("opportunity_id"),
+        "opportunity_title": opportunity.get("opportunity_title"),
+        "opportunity_type": opportunity.get("opportunity_type"),
+        "company_id": opportunity.get("company_id"),
+        "company_name": opportunity.get("company_name"),
+        "owner_id": opportunity.get("opportunity_owner_id"),
+        "owner_name": opportunity.get("owner_name"),
+        "current_stage_id": opportunity.get("current_stage_id"),
+        "current_stage_name": opportunity.get("current_stage_display_name") or opportunity.get("current_stage_name"),
+        "current_stage_code": opportunity.get("current_stage_code") or opportunity.get("current_stage_id"),
+        "state": opportunity.get("state", "Open"),
+        "expected_revenue": opportunity.get("expected_revenue", 0),
+        "currency_code": opportunity.get("currency_code"),
+        "currency_symbol": opportunity.get("currency_symbol"),
+        "qualification_status": opportunity.get("qualification_status"),
+        "expected_closure_date": opportunity.get("expected_closure_date"),
+        "quotation_count": len(quotations),
+        "quotation_status": quotation.get("status") if quotation else None,
+        "quotation_total": quotation.get("grand_total", 0) if quotation else 0,
+        "sdr_status": sdr.get("project_status") if sdr else None,
+        "created_at": opportunity.get("created_at"),
+        "updated_at": opportunity.get("updated_at")
+    }
+
+def build_sd_upcoming_row(opportunity: dict, quotations: List[dict], sdr: Optional[dict]) -> dict:
+    quotation = primary_quotation(quotations)
+    
+    # Enhanced opportunities keeps the pipeline stage code in current_stage_name
+    stage_id = opportunity.get("current_stage_name", "L1")
+    stage_info = SD_PIPELINE_STAGES.get(stage_id, {'name': 'Prospect', 'probability': 10})
+    
+    # Estimate delivery 30 days after the expected close for closed opportunities
+    estimated_delivery_date = None
+    close_date = opportunity.get("expected_closure_date")
+    if stage_id in ["L6", "L7", "L8"] and close_date:
+        # Stored as a datetime; older records may still hold an ISO string
+        close_dt = close_date if isinstance(close_date, datetime) else None
+        if isinstance(close_date, str):
+            try:
+                close_dt = datetime.fromisoformat(close_date.replace('Z', '+00:00'))
+            except ValueError:
+                pass
+        if close_dt:
+            estimated_delivery_date = (close_dt + timedelta(days=30)).strftime('%Y-%m-%d')
+    
+    return {
+        "id": sdr["id"] if sdr else opportunity["id"],
+        "sd_request_id": sdr.get("sd_request_id", "") if sdr else "",
+        "opportunity_id": opportunity["id"],
+        "opportunity_title": opportunity.get("opportunity_title", ""),
+        "opportunity_value": opportunity.get("expected_revenue", 0),
+        "client_name": opportunity.get("company_name", ""),
+        "sales_owner_name": opportunity.get("owner_name") or "Unassigned",
+        "sales_owner_id": opportunity.get("opportunity_owner_id"),
+        "quotation_id": quotation.get("quotation_number", "") if quotation else "",
+        "quotation_total": quotation.get("grand_total", 0) if quotation else 0,
+        "quotation_status": quotation.get("status", "") if quotation else "",
+        "current_stage_id": stage_id,
+        "current_stage_name": stage_info['name'],
+        "probability": stage_info['probability'],
+        "opportunity_type": opportunity.get("opportunity_type", ""),
+        "state": opportunity.get("state", "Open"),
+        "item_type": "service_delivery_request" if sdr else "sales_opportunity",
+        "project_status": sdr.get("project_status", "Upcoming") if sdr else "In Sales Process",
+        "approval_status": sdr.get("approval_status", "Pending") if sdr else "N/A",
+        "estimated_delivery_date": estimated_delivery_date,
+        "expected_close_date": close_date,
+        "created_at": sdr.get("created_at") if sdr else opportunity.get("created_at"),
+        "priority": "High" if stage_id in ["L5", "L6"] else "Medium" if stage_id in ["L3", "L4"] else "Low",
+        "stage_rank": SD_STAGE_ORDER.get(stage_id, 99)
+    }
+
+def build_quotation_inbox_row(quotation: dict, opportunity: Optional[dict], user_names: Dict[str, str]) -> dict:
+    return {
+        "id": quotation["id"],
+        "quotation_number": quotation.get("quotation_number"),
+        "status": quotation.get("status"),
+        "opportunity_id": quotation.get("opportunity_id"),
+        "opportunity_code": opportunity.get("opportunity_id") if opportunity else None,
+        "opportunity_title": opportunity.get("opportunity_title") if opportunity else None,
+        "owner_id": opportunity.get("opportunity_owner_id") if opportunity else None,
+        "owner_name": opportunity.get("owner_name") if opportunity else None,
+        "company_name": quotation.get("company_name"),
+        "customer_name": quotation.get("customer_name"),
+        "grand_total": quotation.get("grand_total", 0),
+        "validity_date": quotation.get("validity_date"),
+        "created_by": quotation.get("created_by"),
+        "created_by_name": user_names.get(quotation.get("created_by")),
+        "submitted_by_name": user_names.get(quotation.get("submitted_by")),
+        "submitted_at": quotation.get("submitted_at"),
+        "approved_at": quotation.get("approved_at"),
+        "rejected_at": quotation.get("rejected_at"),
+        "created_at": quotation.get("created_at"),
+        "updated_at": quotation.get("updated_at")
+    }
+
+async def project_opportunities(opportunity_ids, projected_at: datetime):
+    """Regenerate every read model row derived from the given opportunities"""
+    opportunity_ids = list(set(opportunity_ids))
+    if not opportunity_ids:
+        return
+    
+    opportunities = await db.opportunities.find({"id": {"$in": opportunity_ids}, "is_deleted": False}).to_list(None)
+    quotations = await db.quotations.find({"opportunity_id": {"$in": opportunity_ids}}).sort("created_at", -1).to_list(None)
+    sdrs = await db.service_delivery_requests.find({"opportunity_id": {"$in": opportunity_ids}, "is_deleted": False}).to_list(None)
+    
+    opportunities_by_id = {opportunity["id"]: opportunity for opportunity in opportunities}
+    quotations_by_opportunity: Dict[str, List[dict]] = {}
+    for quotation in quotations:
+        if not quotation.get("is_deleted"):
+            quotations_by_opportunity.setdefault(quotation["opportunity_id"], []).append(quotation)
+    sdr_by_opportunity = {}
+    for sdr in sdrs:
+        sdr_by_opportunity.setdefault(sdr["opportunity_id"], sdr)
+    
+    board_operations, upcoming_operations = [], []
+    for opportunity in opportunities:
+        related = (opportunity, quotations_by_opportunity.get(opportunity["id"], []), sdr_by_opportunity.get(opportunity["id"]))
+        board_operations.append(ReplaceOne(
+            {"id": opportunity["id"]}, {**build_pipeline_board_row(*related), "projected_at": projected_at}, upsert=True
+        ))
+        upcoming_operations.append(ReplaceOne(
+            {"opportunity_id": opportunity["id"]}, {**build_sd_upcoming_row(*related), "projected_at": projected_at}, upsert=True
+        ))
+    if board_operations:
+        await db.pipeline_board_view.bulk_write(board_operations, ordered=False)
+        await db.sd_upcoming_view.bulk_write(upcoming_operations, ordered=False)
+    
+    removed_ids = [opportunity_id for opportunity_id in opportunity_ids if opportunity_id not in opportunities_by_id]
+    if removed_ids:
+        await db.pipeline_board_view.delete_many({"id": {"$in": removed_ids}})
+        await db.sd_upcoming_view.delete_many({"opportunity_id": {"$in": removed_ids}})
+    
+    # Quotation inbox rows show opportunity details, so they are refreshed with their opportunity
+    user_ids = {quotation.get(field) for quotation in quotations for field in ["created_by", "submitted_by"] if quotation.get(field)}
+    user_names = {}
+    if user_ids:
+        async for user in db.users.find({"id": {"$in": list(user_ids)}}, {"_id": 0, "id": 1, "name": 1}):
+            user_names[user["id"]] = user.get("name")
+    
+    inbox_operations = [
+        ReplaceOne(
+            {"id": quotation["id"]},
+            {**build_quotation_inbox_row(quotation, opportunities_by_id.get(quotation["opportunity_id"]), user_names), "projected_at": projected_at},
+            upsert=True
+        )
+        for quotation in quotations if not quotation.get("is_deleted")
+    ]
+    if inbox_operations:
+        await db.quotation_inbox_view.bulk_write(inbox_operations, ordered=False)
+    deleted_quotation_ids = [quotation["id"] for quotation in quotations if quotation.get("is_deleted")]
+    if deleted_quotation_ids:
+        await db.quotation_inbox_view.delete_many({"id": {"$in": deleted_quotation_ids}})
+
+async def refresh_projections(changed_ids: Dict[str, set]):
+    """Apply a batch of entity changes to the read models"""
+    opportunity_ids = set(changed_ids.get("opportunity", set()))
+    if changed_ids.get("quotation"):
+        opportunity_ids.update(await db.quotations.distinct("opportunity_id", {"id": {"$in": list(changed_ids["quotation"])}}))
+    if changed_ids.get("service_delivery"):
+        opportunity_ids.update(await db.service_delivery_requests.distinct("opportunity_id", {"id": {"$in": list(changed_ids["service_delivery"])}}))
+    await project_opportunities(opportunity_ids, datetime.now(timezone.utc))
+
+async def rebuild_projections():
+    """Regenerate all read models from the source collections"""
+    started_at = datetime.now(timezone.utc)
+    opportunity_ids = set(await db.opportunities.distinct("id", {"is_deleted": False}))
+    opportunity_ids.update(await db.quotations.distinct("opportunity_id", {"is_deleted": False}))
+    opportunity_ids = sorted(opportunity_ids)
+    for start in range(0, len(opportunity_ids), PROJECTION_BATCH_SIZE):
+        await project_opportunities(opportunity_ids[start:start + PROJECTION_BATCH_SIZE], started_at)
+    
+    # Rows not touched by this rebuild belong to deleted records
+    for view in PROJECTION_VIEWS:
+        await db[view].delete_many({"projected_at": {"$lt": started_at}})
+    return len(opportunity_ids)
+
+async def run_projection_consumer():
+    """Keep read models current from the live update event stream"""
+    subscriber = {
+        "entities": {entity for entity, _ in LIVE_UPDATE_COLLECTIONS.values()},
+        "queue": asyncio.Queue(maxsize=LIVE_UPDATE_QUEUE_SIZE)
+    }
+    _live_update_subscribers.append(subscriber)
+    while True:
+        events = [await subscriber["queue"].get()]
+        # Coalesce bursts (bulk operations, fan-outs) into one refresh
+        await asyncio.sleep(PROJECTION_DEBOUNCE_SECONDS)
+        while not subscriber["queue"].empty():
+            events.append(subscriber["queue"].get_nowait())
+        
+        try:
+            if any(event["operation"] == "resync" for event in events):
+                await rebuild_projections()
+                continue
+            changed_ids: Dict[str, set] = {}
+            for event in events:
+                changed_ids.setdefault(event["entity"], set()).add(event["id"])
+            await refresh_projections(changed_ids)
+        except Exception as e:
+            print(f"Error updating read model projections: {str(e)}")
+
+@api_router.post("/projections/rebuild", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def trigger_projection_rebuild(current_user: User = Depends(get_current_user)):
+    """Regenerate the dashboard read models from raw data"""
+    try:
+        opportunity_count = await rebuild_projections()
+        await log_activity(ActivityLog(user_id=current_user.id, action="Rebuilt dashboard read models"))
+        return APIResponse(success=True, message="Read models rebuilt successfully", data={
+            "views": PROJECTION_VIEWS,
+            "opportunities_projected": opportunity_count
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+PIPELINE_BOARD_FILTER_FIELDS = ["current_stage_code", "owner_id", "state", "opportunity_type", "company_id"]
+
+@api_router.get("/opportunities/pipeline-board", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def get_pipeline_board(
+    current_stage_code: Optional[str] = None,
+    owner_id: Optional[str] = None,
+    state: Optional[str] = None,
+    opportunity_type: Optional[str] = None,
+    company_id: Optional[str] = None,
+    limit: int = 1000,
+    current_user: User = Depends(get_current_user)
+):
+    """Pipeline board rows from the pipeline_board_view read model"""
+    try:
+        filters = {"current_stage_code": current_stage_code, "owner_id": owner_id, "state": state,
+                   "opportunity_type": opportunity_type, "company_id": company_id}
+        query = {field: value for field, value in filters.items() if value is not None}
+        rows = await db.pipeline_board_view.find(query, {"_id": 0, "projected_at": 0}).sort(
+            "updated_at", -1
+        ).limit(max(1, min(limit, 5000))).to_list(None)
+        return APIResponse(success=True, message="Pipeline board retrieved successfully", data=rows)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/quotations/inbox", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def get_quotation_inbox(status: str = "Unapproved", owner_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Quotations awaiting action, from the quotation_inbox_view read model"""
+    try:
+        query = {"status": status}
+        if owner_id:
+            query["owner_id"] = owner_id
+        rows = await db.quotation_inbox_view.find(query, {"_id": 0, "projected_at": 0}).sort(
+            "updated_at", -1
+        ).to_list(1000)
+        return APIResponse(success=True, message="Quotation inbox retrieved successfully", data=rows)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ===== ANALYTICS SNAPSHOTS & REPORT QUERIES =====
+
+ANALYTICS_SNAPSHOT_DIR = Path(os.environ.get('ANALYTICS_SNAPSHOT_DIR', str(ROOT_DIR / 'analytics_snapshots')))
+ANALYTICS_SNAPSHOT_HOUR_UTC = int(os.environ.get('ANALYTICS_SNAPSHOT_HOUR_UTC', '3'))
+ANALYTICS_SNAPSHOT_RETENTION_DAYS = int(os.environ.get('ANALYTICS_SNAPSHOT_RETENTION_DAYS', '30'))
+ANALYTICS_WORKER_COUNT = int(os.environ.get('ANALYTICS_WORKER_COUNT', '2'))
+ANALYTICS_EXPORT_BATCH_SIZE = 50000
+ANALYTICS_MAX_ROWS = 10000
+ANALYTICS_MAX_PIVOT_COLUMNS = 100
+ANALYTICS_AGGREGATIONS = ["count", "sum", "mean", "min", "max", "nunique"]
+ANALYTICS_NUMERIC_AGGREGATIONS = ["sum", "mean"]
+ANALYTICS_INTERVALS = {"day": "D", "week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+
+# Dataset -> (permission menu path, {column: type}); only flat columns are exported
+ANALYTICS_DATASETS = {
+    "opportunities": ("/opportunities", {
+        "id": "string", "opportunity_id": "string", "opportunity_title": "string", "opportunity_type": "string",
+        "company_id": "string", "company_name": "string", "opportunity_owner_id": "string", "owner_name": "string",
+        "current_stage_id": "string", "current_stage_code": "string", "current_stage_display_name": "string",
+        "state": "string", "expected_revenue": "number", "currency_code": "string", "lead_id": "string",
+        "lead_source_id": "string", "qualification_status": "string", "approval_status": "string",
+        "expected_closure_date": "datetime", "created_at": "datetime", "updated_at": "datetime"
+    }),
+    "leads": ("/leads", {
+        "id": "string", "lead_id": "string", "project_title": "string", "company_id": "string",
+        "company_name": "string", "lead_subtype_name": "string", "lead_source_name": "string",
+        "assigned_to_user_id": "string", "assigned_user_name": "string", "approval_status": "string",
+        "status": "string", "expected_revenue": "number", "currency_code": "string",
+        "convert_to_opportunity_date": "datetime", "created_at": "datetime", "updated_at": "datetime"
+    }),
+    "quotations": ("/opportunities", {
+        "id": "string", "quotation_number": "string", "opportunity_id": "string", "customer_id": "string",
+        "customer_name": "string", "company_name": "string", "status": "string", "currency_id": "string",
+        "total_otp": "number", "grand_total": "number", "overall_discount_value": "number",
+        "created_by": "string", "quotation_date": "datetime", "validity_date": "datetime",
+        "submitted_at": "datetime", "approved_at": "datetime", "created_at": "datetime", "updated_at": "datetime"
+    }),
+    "service_delivery_requests": ("/service-delivery", {
+        "id": "string", "sd_request_id": "string", "opportunity_id": "string", "client_name": "string",
+        "project_status": "string", "approval_status": "string", "delivery_status": "string",
+        "delivery_progress": "number", "project_value": "number", "sales_owner_id": "string",
+        "sales_owner_name": "string", "delivery_owner_id": "string", "delivery_owner_name": "string",
+        "expected_delivery_date": "datetime", "actual_delivery_date": "datetime",
+        "created_at": "datetime", "updated_at": "datetime"
+    })
+}
+
+_analytics_executor: Optional[ProcessPoolExecutor] = None
+
+def analytics_executor() -> ProcessPoolExecutor:
+    """Process pool that keeps Parquet encoding and report queries off the event loop"""
+    global _analytics_executor
+    if _analytics_executor is None:
+        _analytics_executor = ProcessPoolExecutor(max_workers=ANALYTICS_WORKER_COUNT)
+    return _analytics_executor
+
+def analytics_frame(records: List[dict], columns: Dict[str, str]) -> pd.DataFrame:
+    """Build a DataFrame with a stable schema so every partition has identical column types"""
+    frame = pd.DataFrame.from_records(records, columns=list(columns))
+    for column, column_type in columns.items():
+        if column_type == "number":
+            frame[column] = pd.to_numeric(frame[column], errors="coerce").astype("float64")
+        elif column_type == "datetime":
+            frame[column] = pd.to_datetime(frame[column], utc=True, errors="coerce", format="mixed")
+        else:
+            frame[column] = frame[column].astype("string")
+    return frame
+
+def write_analytics_snapshot_part(path: str, records: List[dict], columns: Dict[str, str]):
+    analytics_frame(records, columns).to_parquet(path, index=False)
+
+def apply_analytics_filters(frame: pd.DataFrame, filters: Dict[str, Any], columns: Dict[str, str]) -> pd.DataFrame:
+    def column_value(field, value):
+        if columns[field] == "datetime":
+            value = pd.Timestamp(value)
+            return value.tz_localize("UTC") if value.tzinfo is None else value
+        return value
+    
+    for field, value in filters.items():
+        if isinstance(value, list):
+            frame = frame[frame[field].isin([column_value(field, item) for item in value])]
+        elif isinstance(value, dict):
+            for operator, bound in value.items():
+                frame = frame[getattr(frame[field], operator)(column_value(field, bound))]
+        else:
+            frame = frame[frame[field] == column_value(field, value)]
+    return frame
+
+def run_analytics_query(snapshot_path: str, columns: Dict[str, str], spec: dict) -> dict:
+    """Execute a validated report query against one snapshot (runs in the process pool)"""
+    frame = pd.read_parquet(snapshot_path, columns=spec["columns"])
+    frame = apply_analytics_filters(frame, spec["filters"], columns)
+    
+    if spec["type"] == "pivot":
+        result = pd.pivot_table(
+            frame, index=spec["index"], columns=spec["pivot_column"], values=spec["values"],
+            aggfunc=spec["aggregation"], fill_value=0
+        )
+        if len(result.columns) > ANALYTICS_MAX_PIVOT_COLUMNS:
+            result = result.iloc[:, :ANALYTICS_MAX_PIVOT_COLUMNS]
+        result.columns = [str(column) for column in result.columns]
+        result = result.reset_index()
+    else:
+        group_by = list(spec["group_by"])
+        if spec["type"] == "time_series":
+            dates = frame[spec["date_field"]].dt.tz_convert(None)
+            frame = frame.assign(period=dates.dt.to_period(ANALYTICS_INTERVALS[spec["interval"]]).dt.start_time)
+            group_by.insert(0, "period")
+        aggregations = {
+            metric["name"]: (metric["field"], metric["aggregation"]) for metric in spec["metrics"]
+        }
+        if group_by:
+            result = frame.groupby(group_by, dropna=False).agg(**aggregations).reset_index()
+        else:
+            result = pd.DataFrame([{name: frame[field].agg(aggregation) for name, (field, aggregation) in aggregations.items()}])
+        if spec["type"] == "time_series":
+            result = result.sort_values(group_by)
+        elif spec["metrics"]:
+            result = result.sort_values(spec["metrics"][0]["name"], ascending=False)
+    
+    row_count = len(result)
+    result = result.head(spec["limit"])
+    return {
+        "rows": json.loads(result.to_json(orient="records", date_format="iso")),
+        "row_count": row_count,
+        "truncated": row_count > len(result)
+    }
+
+def analytics_snapshot_dates(dataset: str) -> List[str]:
+    """Snapshot dates available for a dataset, newest first"""
+    dataset_dir = ANALYTICS_SNAPSHOT_DIR / dataset
+    if not dataset_dir.exists():
+        return []
+    return sorted(
+        (path.name.split("=", 1)[1] for path in dataset_dir.iterdir() if path.is_dir() and path.name.startswith("snapshot_date=")),
+        reverse=True
+    )
+
+async def export_analytics_snapshots(snapshot_date: Optional[str] = None) -> Dict[str, int]:
+    """Write each reporting collection to a date-partitioned Parquet snapshot"""
+    snapshot_date = snapshot_date or datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    loop = asyncio.get_running_loop()
+    row_counts = {}
+    for dataset, (_, columns) in ANALYTICS_DATASETS.items():
+        # Write into a staging directory so readers never see a half-written snapshot
+        staging_dir = ANALYTICS_SNAPSHOT_DIR / dataset / f".staging-{snapshot_date}"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        staging_dir.mkdir(parents=True)
+        
+        part, batch, row_count = 0, [], 0
+        cursor = db[dataset].find(
+            {"is_deleted": {"$ne": True}}, {"_id": 0, **{column: 1 for column in columns}}
+        ).batch_size(ANALYTICS_EXPORT_BATCH_SIZE)
+        async for document in cursor:
+            batch.append(document)
+            if len(batch) >= ANALYTICS_EXPORT_BATCH_SIZE:
+                await loop.run_in_executor(analytics_executor(), write_analytics_snapshot_part,
+                                           str(staging_dir / f"part-{part:05d}.parquet"), batch, columns)
+                part, row_count, batch = part + 1, row_count + len(batch), []
+        if batch or part == 0:
+            await loop.run_in_executor(analytics_executor(), write_analytics_snapshot_part,
+                                       str(staging_dir / f"part-{part:05d}.parquet"), batch, columns)
+            row_count += len(batch)
+        
+        snapshot_dir = ANALYTICS_SNAPSHOT_DIR / dataset / f"snapshot_date={snapshot_date}"
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        os.replace(staging_dir, snapshot_dir)
+        row_counts[dataset] = row_count
+        
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=ANALYTICS_SNAPSHOT_RETENTION_DAYS)).strftime('%Y-%m-%d')
+        for expired_date in analytics_snapshot_dates(dataset):
+            if expired_date < cutoff:
+                shutil.rmtree(ANALYTICS_SNAPSHOT_DIR / dataset / f"snapshot_date={expired_date}", ignore_errors=True)
+    return row_counts
+
+async def run_nightly_analytics_snapshot_export():
+    """Background loop that exports reporting snapshots once a day"""
+    while True:
+        now = datetime.now(timezone.utc)
+        next_run = now.replace(hour=ANALYTICS_SNAPSHOT_HOUR_UTC, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            row_counts = await export_analytics_snapshots()
+            print(f"Analytics snapshots exported ({sum(row_counts.values())} rows)")
+        except Exception as e:
+            print(f"Error exporting analytics snapshots: {str(e)}")
+
+def build_analytics_query_spec(request_data: dict, columns: Dict[str, str]) -> dict:
+    """Validate a report query request against the dataset schema"""
+    def require_columns(fields, allowed_types=None):
+        for field in fields:
+            if not isinstance(field, str) or field not in columns:
+                raise HTTPException(status_code=400, detail=f"Unknown column: {field}")
+            if allowed_types and columns[field] not in allowed_types:
+                raise HTTPException(status_code=400, detail=f"Column {field} must be of type {' or '.join(allowed_types)}")
+    
+    def column_names(value, name):
+        names = [value] if isinstance(value, str) else value
+        if not isinstance(names, list) or not all(isinstance(field, str) for field in names):
+            raise HTTPException(status_code=400, detail=f"{name} must be a column name or a list of column names")
+        return names
+    
+    query_type = request_data.get("type", "group_by")
+    if query_type not in ["group_by", "pivot", "time_series"]:
+        raise HTTPException(status_code=400, detail="type must be group_by, pivot or time_series")
+    
+    def coerce_filter_value(field, value):
+        # Filter values must match the column type, or pandas raises inside the worker
+        if isinstance(value, (dict, list)) or value is None:
+            raise HTTPException(status_code=400, detail=f"Filter {field} values must be plain values")
+        try:
+            if columns[field] == "number":
+                return float(value)
+            if columns[field] == "datetime":
+                pd.Timestamp(value)
+                return value
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Filter {field} expects a {columns[field]} value, got {value!r}")
+        return str(value)
+    
+    raw_filters = request_data.get("filters") or {}
+    if not isinstance(raw_filters, dict):
+        raise HTTPException(status_code=400, detail="filters must be an object")
+    require_columns(raw_filters)
+    filters = {}
+    for field, value in raw_filters.items():
+        if isinstance(value, dict):
+            if not set(value) <= {"gt", "ge", "lt", "le"}:
+                raise HTTPException(status_code=400, detail=f"Range filter on {field} supports gt, ge, lt and le")
+            filters[field] = {operator: coerce_filter_value(field, bound) for operator, bound in value.items()}
+        elif isinstance(value, list):
+            filters[field] = [coerce_filter_value(field, item) for item in value]
+        else:
+            filters[field] = coerce_filter_value(field, value)
+    
+    try:
+        limit = int(request_data.get("limit", 1000))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="limit must be an integer")
+    
+    spec = {
+        "type": query_type,
+        "filters": filters,
+        "limit": max(1, min(limit, ANALYTICS_MAX_ROWS))
+    }
+    
+    if query_type == "pivot":
+        index = column_names(request_data.get("index") or [], "index")
+        pivot_column, values = request_data.get("columns"), request_data.get("values", "id")
+        aggregation = request_data.get("aggregation", "count")
+        if not index or not pivot_column:
+            raise HTTPException(status_code=400, detail="Pivot queries require index and columns")
+        if aggregation not in ANALYTICS_AGGREGATIONS:
+            raise HTTPException(status_code=400, detail=f"aggregation must be one of {', '.join(ANALYTICS_AGGREGATIONS)}")
+        require_columns(index + [pivot_column])
+        require_columns([values], ["number"] if aggregation in ANALYTICS_NUMERIC_AGGREGATIONS else None)
+        spec.update({"index": index, "pivot_column": pivot_column, "values": values, "aggregation": aggregation})
+        used_columns = index + [pivot_column, values]
+    else:
+        group_by = column_names(request_data.get("group_by") or [], "group_by")
+        require_columns(group_by)
+        raw_metrics = request_data.get("metrics") or [{"aggregation": "count"}]
+        if not isinstance(raw_metrics, list) or not all(isinstance(metric, dict) for metric in raw_metrics):
+            raise HTTPException(status_code=400, detail="metrics must be a list of objects")
+        metrics = []
+        for metric in raw_metrics:
+            field, aggregation = metric.get("field") or "id", metric.get("aggregation", "count")
+            if aggregation not in ANALYTICS_AGGREGATIONS:
+                raise HTTPException(status_code=400, detail=f"aggregation must be one of {', '.join(ANALYTICS_AGGREGATIONS)}")
+            require_columns([field], ["number"] if aggregation in ANALYTICS_NUMERIC_AGGREGATIONS else None)
+            name = "count" if aggregation == "count" and field == "id" else f"{field}_{aggregation}"
+            metrics.append({"name": name, "field": field, "aggregation": aggregation})
+        spec.update({"group_by": group_by, "metrics": metrics})
+        used_columns = group_by + [metric["field"] for metric in metrics]
+        
+        if query_type == "time_series":
+            date_field, interval = request_data.get("date_field", "created_at"), request_data.get("interval", "month")
+            require_columns([date_field], ["datetime"])
+            if interval not in ANALYTICS_INTERVALS:
+                raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(ANALYTICS_INTERVALS)}")
+            spec.update({"date_field": date_field, "interval": interval})
+            used_columns.append(date_field)
+    
+    spec["columns"] = list(dict.fromkeys(used_columns + list(filters)))
+    return spec
+
+@api_router.get("/reports/snapshots", response_model=APIResponse)
+async def get_analytics_snapshots(current_user: User = Depends(get_current_user)):
+    """List the Parquet snapshot dates and columns available for reporting"""
+    try:
+        datasets = {}
+        for dataset, (menu_path, columns) in ANALYTICS_DATASETS.items():
+            if await check_permission(current_user, menu_path, "view"):
+                datasets[dataset] = {"snapshot_dates": analytics_snapshot_dates(dataset), "columns": columns}
+        return APIResponse(success=True, message="Analytics snapshots retrieved successfully", data=datasets)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/reports/snapshots", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def trigger_analytics_snapshot_export(current_user: User = Depends(get_current_user)):
+    """Export today's reporting snapshots immediately"""
+    try:
+        row_counts = await export_analytics_snapshots()
+        await log_activity(ActivityLog(user_id=current_user.id, action="Exported analytics snapshots"))
+        return APIResponse(success=True, message="Analytics snapshots exported successfully", data=row_counts)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/reports/query", response_model=APIResponse)
+async def query_analytics_snapshot(request_data: dict, current_user: User = Depends(get_current_user)):
+    """Run a group-by, pivot or time-series query over a Parquet snapshot"""
+    try:
+        dataset = request_data.get("dataset")
+        if dataset not in ANALYTICS_DATASETS:
+            raise HTTPException(status_code=400, detail=f"dataset must be one of {', '.join(ANALYTICS_DATASETS)}")
+        menu_path, columns = ANALYTICS_DATASETS[dataset]
+        if not await check_permission(current_user, menu_path, "view"):
+            raise HTTPException(status_code=403, detail=f"Insufficient permissions. Required: view access to {menu_path}")
+        
+        available_dates = analytics_snapshot_dates(dataset)
+        snapshot_date = request_data.get("snapshot_date") or (available_dates[0] if available_dates else None)
+        if snapshot_date not in available_dates:
+            raise HTTPException(status_code=404, detail=f"No {dataset} snapshot available for {snapshot_date or 'any date'}")
+        
+        spec = build_analytics_query_spec(request_data, columns)
+        snapshot_path = str(ANALYTICS_SNAPSHOT_DIR / dataset / f"snapshot_date={snapshot_date}")
+        result = await asyncio.get_running_loop().run_in_executor(
+            analytics_executor(), run_analytics_query, snapshot_path, columns, spec
+        )
+        return APIResponse(success=True, message="Report query executed successfully", data={
+            "dataset": dataset,
+            "snapshot_date": snapshot_date,
+            **result
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ===== EXPORT JOBS =====
+# Exports run as jobs persisted in export_jobs and executed by in-process workers; claims are
+# atomic, so several app processes can share the queue without an external broker.
+
+EXPORT_JOB_DIR = Path(os.environ.get('EXPORT_JOB_DIR', str(ROOT_DIR / 'export_jobs')))
+EXPORT_JOB_WORKER_COUNT = int(os.environ.get('EXPORT_JOB_WORKER_COUNT', '2'))
+EXPORT_JOB_MAX_ACTIVE_PER_USER = int(os.environ.get('EXPORT_JOB_MAX_ACTIVE_PER_USER', '3'))
+EXPORT_JOB_RETENTION_HOURS = int(os.environ.get('EXPORT_JOB_RETENTION_HOURS', '24'))
+EXPORT_JOB_HISTORY_DAYS = 7
+EXPORT_JOB_MAX_ATTEMPTS = 3
+EXPORT_JOB_POLL_SECONDS = 5
+EXPORT_JOB_LOCK_SECONDS = 120
+EXPORT_JOB_CLEANUP_SECONDS = 3600
+EXPORT_JOB_BATCH_SIZE = 1000
+EXPORT_JOB_PUBLIC_PROJECTION = {"_id": 0, "file_path": 0, "locked_until": 0}
+
+_export_job_wakeup = asyncio.Event()
+
+async def run_lead_export_job(params: dict, user: User, directory: Path, report) -> Dict[str, Any]:
+    total = await db.leads.count_documents({"is_deleted": False})
+    path = directory / "leads.csv"
+    processed, batch = 0, []
+    async with aiofiles.open(path, "w", newline="") as f:
+        await f.write(csv_text([LEAD_EXPORT_COLUMNS]))
+        async for lead in db.leads.aggregate(lead_export_pipeline(), allowDiskUse=True):
+            lead = format_lead_export_row(lead)
+            batch.append([lead.get(column, "") for column in LEAD_EXPORT_COLUMNS])
+            if len(batch) == EXPORT_JOB_BATCH_SIZE:
+                await f.write(csv_text(batch))
+                processed, batch = processed + len(batch), []
+                await report(processed, total)
+        await f.write(csv_text(batch))
+    await report(processed + len(batch), total)
+    return {"path": path, "filename": f"leads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", "media_type": "text/csv"}
+
+async def run_activity_log_export_job(params: dict, user: User, directory: Path, report) -> Dict[str, Any]:
+    query = activity_log_export_query(
+        params.get("user_id"), params.get("action_filter"), params.get("start_date"), params.get("end_date")
+    )
+    total = await db.activity_logs.count_documents(query)
+    path = directory / "activity_logs.csv"
+    processed, batch = 0, []
+    async with aiofiles.open(path, "w", newline="") as f:
+        await f.write("Date,Time,User Name,User Email,Action\n")
+        async for log in db.activity_logs.find(query, {"_id": 0, "user_id": 1, "timestamp": 1, "action": 1}).sort("timestamp", -1):
+            batch.append(log)
+            if len(batch) == EXPORT_JOB_BATCH_SIZE:
+                await f.write(csv_text(await activity_log_export_rows(batch), quoting=csv.QUOTE_ALL))
+                processed, batch = processed + len(batch), []
+                await report(processed, total)
+        await f.write(csv_text(await activity_log_export_rows(batch), quoting=csv.QUOTE_ALL))
+    await report(processed + len(batch), total)
+    return {"path": path, "filename": f"activity_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", "media_type": "text/csv"}
+
+async def run_quotation_export_job(params: dict, user: User, directory: Path, report) -> Dict[str, Any]:
+    export = await export_quotation_file(params["quotation_id"], params["format"], params.get("template_id"), user.id)
+    # Copy out of the render cache so cache pruning and job cleanup stay independent
+    path = directory / export["path"].name
+    await asyncio.to_thread(shutil.copyfile, export["path"], path)
+    await report(1, 1)
+    return {"path": path, "filename": export["filename"], "media_type": export["media_type"]}
+
+async def run_pnl_export_job(params: dict, user: User, directory: Path, report) -> Dict[str, Any]:
+    opportunity_id, currency = params["opportunity_id"], params.get("currency", "INR")
+    opportunity = await db.opportunities.find_one({"id": opportunity_id, "is_deleted": False}, {"_id": 0})
+    if not opportunity:
+        raise HTTPException(status_code=404, detail="Opportunity not found")
+    profitability = await get_opportunity_profitability(opportunity_id, currency, user)
+    if not profitability.success:
+        raise HTTPException(status_code=400, detail=profitability.message)
+    
+    filename = f"PnL_Analysis_{opportunity.get('opportunity_id')}_{currency}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    path = directory / "pnl.xlsx"
+    await asyncio.to_thread(write_pnl_workbook, str(path), opportunity, profitability.data)
+    await report(1, 1)
+    return {"path": path, "filename": filename, "media_type": QUOTATION_EXPORT_FORMATS["excel"][1]}
+
+# Job type -> (menu path whose view permission is required, handler, required params)
+EXPORT_JOB_TYPES = {
+    "leads": ("/leads", run_lead_export_job, []),
+    "activity_logs": (None, run_activity_log_export_job, []),
+    "quotation": ("/opportunities", run_quotation_export_job, ["quotation_id", "format"]),
+    "pnl": ("/opportunities", run_pnl_export_job, ["opportunity_id"])
+}
+
+async def claim_export_job() -> Optional[dict]:
+    """Lease the oldest queued job, including running ones whose worker stopped heartbeating"""
+    now = datetime.now(timezone.utc)
+    return await db.export_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "locked_until": {"$lte": now}}
+        ]},
+        {
+            "$set": {"status": "running", "started_at": now, "locked_until": now + timedelta(seconds=EXPORT_JOB_LOCK_SECONDS)},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def process_export_job(job: dict):
+    """Run a claimed job, reporting progress as it goes and keeping the file only on success"""
+    # Every write is fenced by the claimed attempt, so a worker whose lease was taken over
+    # can neither overwrite the new attempt's status nor touch its files
+    lease = {"id": job["id"], "attempts": job["attempts"]}
+    directory = EXPORT_JOB_DIR / job["id"] / f"attempt-{job['attempts']}"
+    
+    async def report(processed: int, total: Optional[int]):
+        result = await db.export_jobs.update_one(lease, {"$set": {
+            "processed": processed,
+            "total": total,
+            "progress": round(100.0 * processed / total, 1) if total else 0.0,
+            "locked_until": datetime.now(timezone.utc) + timedelta(seconds=EXPORT_JOB_LOCK_SECONDS)
+        }})
+        if result.matched_count == 0:
+            raise RuntimeError("Export job was reclaimed by another worker")
+    
+    async def keep_lease():
+        # Handlers that only report at the end (single renders) still hold the lease while they run
+        while True:
+            await asyncio.sleep(EXPORT_JOB_LOCK_SECONDS / 4)
+            result = await db.export_jobs.update_one(lease, {"$set": {
+                "locked_until": datetime.now(timezone.utc) + timedelta(seconds=EXPORT_JOB_LOCK_SECONDS)
+            }})
+            if result.matched_count == 0:
+                return
+    
+    heartbeat = asyncio.create_task(keep_lease())
+    result, error = None, None
+    try:
+        if job["attempts"] > EXPORT_JOB_MAX_ATTEMPTS:
+            raise RuntimeError("Export job exceeded its retry limit")
+        user = await db.users.find_one({"id": job["user_id"], "is_deleted": False}, {"_id": 0})
+        if not user:
+            raise RuntimeError("Job owner no longer exists")
+        # Discard output left by earlier, interrupted attempts
+        await asyncio.to_thread(shutil.rmtree, directory.parent, True)
+        directory.mkdir(parents=True, exist_ok=True)
+        result = await EXPORT_JOB_TYPES[job["job_type"]][1](job["params"], User(**user), directory, report)
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+    finally:
+        heartbeat.cancel()
+    
+    now = datetime.now(timezone.utc)
+    if result is None:
+        outcome = {"status": "failed", "error": error}
+    else:
+        outcome = {
+            "status": "completed",
+            "progress": 100.0,
+            "filename": result["filename"],
+            "media_type": result["media_type"],
+            "file_path": str(result["path"]),
+            "file_size": result["path"].stat().st_size
+        }
+    written = await db.export_jobs.update_one(lease, {"$set": {
+        **outcome,
+        "completed_at": now,
+        "expires_at": now + timedelta(hours=EXPORT_JOB_RETENTION_HOURS)
+    }})
+    if result is None or written.matched_count == 0:
+        await asyncio.to_thread(shutil.rmtree, directory, True)
+
+async def run_export_job_worker():
+    """Execute export jobs until cancelled, waking early when a job is created"""
+    while True:
+        _export_job_wakeup.clear()
+        try:
+            job = await claim_export_job()
+        except Exception as e:
+            print(f"Error claiming export job: {str(e)}")
+            await asyncio.sleep(EXPORT_JOB_POLL_SECONDS)
+            continue
+        
+        if job is None:
+            try:
+                await asyncio.wait_for(_export_job_wakeup.wait(), timeout=EXPORT_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await process_export_job(job)
+
+async def cleanup_export_jobs() -> int:
+    """Delete the files of finished jobs past their retention and mark the jobs expired"""
+    expired = await db.export_jobs.find(
+        {"status": {"$in": ["completed", "failed"]}, "expires_at": {"$lte": datetime.now(timezone.utc)}},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+    for job in expired:
+        await asyncio.to_thread(shutil.rmtree, EXPORT_JOB_DIR / job["id"], True)
+    if expired:
+        await db.export_jobs.update_many(
+            {"id": {"$in": [job["id"] for job in expired]}},
+            {"$set": {"status": "expired"}, "$unset": {"file_path": ""}}
+        )
+    return len(expired)
+
+async def run_export_job_cleanup():
+    while True:
+        try:
+            await cleanup_export_jobs()
+        except Exception as e:
+            print(f"Error cleaning up export jobs: {str(e)}")
+        await asyncio.sleep(EXPORT_JOB_CLEANUP_SECONDS)
+
+@api_router.post("/export-jobs", response_model=APIResponse)
+async def create_export_job(request_data: dict, current_user: User = Depends(get_current_user)):
+    """Queue an export (leads, activity_logs, quotation, pnl); poll its status and download the file when complete"""
+    try:
+        job_type = request_data.get("job_type")
+        if job_type not in EXPORT_JOB_TYPES:
+            raise HTTPException(status_code=400, detail=f"job_type must be one of: {', '.join(EXPORT_JOB_TYPES)}")
+        menu_path, _, required_params = EXPORT_JOB_TYPES[job_type]
+        if menu_path and not await check_permission(current_user, menu_path, "view"):
+            raise HTTPException(status_code=403, detail=f"Insufficient permissions. Required: view access to {menu_path}")
+        
+        params = request_data.get("params") or {}
+        missing = [param for param in required_params if not params.get(param)]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Missing params: {', '.join(missing)}")
+        if job_type == "quotation" and params["format"] not in QUOTATION_EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail="Invalid export format")
+        if job_type == "activity_logs":
+            activity_log_export_query(params.get("user_id"), params.get("action_filter"), params.get("start_date"), params.get("end_date"))
+        
+        active = await db.export_jobs.count_documents({"user_id": current_user.id, "status": {"$in": ["queued", "running"]}})
+        if active >= EXPORT_JOB_MAX_ACTIVE_PER_USER:
+            raise HTTPException(
+                status_code=429,
+                detail=f"You already have {active} export jobs in progress; wait for one to finish"
+            )
+        
+        job = ExportJob(job_type=job_type, params=params, user_id=current_user.id)
+        await db.export_jobs.insert_one(job.dict())
+        _export_job_wakeup.set()
+        
+        return APIResponse(success=True, message="Export job queued", data={
+            key: value for key, value in job.dict().items() if key not in ["file_path", "locked_until"]
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/export-jobs", response_model=APIResponse)
+async def get_export_jobs(current_user: User = Depends(get_current_user)):
+    """List the current user's recent export jobs"""
+    try:
+        jobs = await db.export_jobs.find(
+            {"user_id": current_user.id}, EXPORT_JOB_PUBLIC_PROJECTION
+        ).sort("created_at", -1).to_list(50)
+        return APIResponse(success=True, message="Export jobs retrieved successfully", data=jobs)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/export-jobs/{job_id}", response_model=APIResponse)
+async def get_export_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Get an export job's status and progress"""
+    try:
+        job = await db.export_jobs.find_one({"id": job_id, "user_id": current_user.id}, EXPORT_JOB_PUBLIC_PROJECTION)
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        return APIResponse(success=True, message="Export job retrieved successfully", data=job)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/export-jobs/{job_id}/download")
+async def download_export_job(job_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Stream a completed export job's file"""
+    try:
+        job = await db.export_jobs.find_one({"id": job_id, "user_id": current_user.id}, {"_id": 0})
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        if job["status"] != "completed":
+            raise HTTPException(status_code=409, detail=f"Export job is {job['status']}")
+        path = Path(job["file_path"])
+        if not path.is_file():
+            raise HTTPException(status_code=410, detail="Export file has expired")
+        return file_download_response(request, path, job["media_type"], job["filename"], job_id, "private, no-cache")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ===== PHASE 4: GOVERNANCE & REPORTING APIs (Specific Routes) =====
 
 # Analytics and KPI Endpoints
+def resolve_analytics_period(period: str, start_date: Optional[str], end_date: Optional[str]):
+    """Resolve the analytics date window for a period, honouring explicit dates"""
+    if start_date and end_date:
+        return datetime.fromisoformat(start_date), datetime.fromisoformat(end_date)
+    
+    end_date_obj = datetime.now(timezone.utc)
+    if period == "monthly":
+        start_date_obj = end_date_obj.replace(day=1)
+    elif period == "quarterly":
+        quarter_start_month = ((end_date_obj.month - 1) // 3) * 3 + 1
+        start_date_obj = end_date_obj.replace(month=quarter_start_month, day=1)
+    elif period == "yearly":
+        start_date_obj = end_date_obj.replace(month=1, day=1)
+    else:  # weekly or daily
+        start_date_obj = end_date_obj - timedelta(days=30)
+    return start_date_obj, end_date_obj
+
+def sales_cycle_stages() -> List[dict]:
+    """Aggregation stages averaging creation-to-Won days over won opportunities"""
+    return [
+        # Join the earliest "Won" transition for each won opportunity
+        {"$lookup": {
+            "from": "opportunity_stage_history",
+            "let": {"opp_id": "$id"},
+            "pipeline": [
+                {"$match": {
+                    "$expr": {"$eq": ["$opportunity_id", "$$opp_id"]},
+                    "stage_name": "Won"
+                }},
+                {"$sort": {"transition_date": 1}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "transition_date": 1}}
+            ],
+            "as": "won_history"
+        }},
+        {"$unwind": "$won_history"},
+        {"$group": {
+            "_id": None,
+            "average_sales_cycle": {"$avg": {"$floor": {"$divide": [
+                {"$subtract": ["$won_history.transition_date", "$created_at"]},
+                86400000
+            ]}}},
+            "won_with_history": {"$sum": 1}
+        }}
+    ]
+
+def qualification_pipeline(start_date_obj: datetime, end_date_obj: datetime) -> List[dict]:
+    """Aggregation counting total and completed qualification rows in a date window"""
+    return [
+        {"$match": {"created_at": {"$gte": start_date_obj, "$lte": end_date_obj}}},
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "completed": {"$sum": {"$cond": [
+                {"$in": ["$compliance_status", ["compliant", "exempted"]]}, 1, 0
+            ]}}
+        }}
+    ]
+
+async def compute_cycle_and_qualification_metrics(start_date_obj: datetime, end_date_obj: datetime) -> Dict[str, Any]:
+    """Compute average sales cycle and qualification completion for a date window"""
+    stage_map = await get_opportunity_stage_map()
+    won_stage_ids = [stage_id for stage_id, stage in stage_map.items() if stage.get("stage_name") == "Won"]
+    
+    cycle_pipeline = [
+        {"$match": {
+            "created_at": {"$gte": start_date_obj, "$lte": end_date_obj},
+            "current_stage_id": {"$in": won_stage_ids},
+            "is_deleted": False
+        }}
+    ] + sales_cycle_stages()
+    
+    cycle_result, qualification_result = await asyncio.gather(
+        db.opportunities.aggregate(cycle_pipeline).to_list(1),
+        db.opportunity_qualifications.aggregate(qualification_pipeline(start_date_obj, end_date_obj)).to_list(1)
+    )
+    cycle = cycle_result[0] if cycle_result else {}
+    qualification_totals = qualification_result[0] if qualification_result else {}
+    total_qualifications = qualification_totals.get("total", 0)
+    
+    return {
+        "average_sales_cycle": round(cycle.get("average_sales_cycle") or 0),
+        "qualification_completion_rate": round((qualification_totals.get("completed", 0) / total_qualifications * 100) if total_qualifications else 0, 2)
+    }
+
+async def compute_opportunity_analytics(period: str, start_date_obj: datetime, end_date_obj: datetime) -> Dict[str, Any]:
+    """Compute opportunity analytics for a date window in a single $facet aggregation"""
+    is_won = {"$eq": ["$stage_name", "Won"]}
+    is_lost = {"$in": ["$stage_name", ["Lost", "Dropped"]]}
+    
+    pipeline = [
+        {"$match": {
+            "created_at": {"$gte": start_date_obj, "$lte": end_date_obj},
+            "is_deleted": False
+        }},
+        {"$lookup": {
+            "from": "opportunity_stages",
+            "localField": "current_stage_id",
+            "foreignField": "id",
+            "as": "current_stage"
+        }},
+        {"$unwind": {"path": "$current_stage", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "id": 1,
+            "created_at": 1,
+            "stage_name": "$current_stage.stage_name",
+            "revenue": {"$ifNull": [{"$toDouble": "$expected_revenue"}, 0]}
+        }},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "total_opportunities": {"$sum": 1},
+                    "total_pipeline_value": {"$sum": "$revenue"},
+                    "won_opportunities": {"$sum": {"$cond": [is_won, 1, 0]}},
+                    "lost_opportunities": {"$sum": {"$cond": [is_lost, 1, 0]}},
+                    "won_revenue": {"$sum": {"$cond": [is_won, "$revenue", 0]}},
+                    "lost_revenue": {"$sum": {"$cond": [is_lost, "$revenue", 0]}}
+                }}
+            ],
+            "stage_distribution": [
+                {"$match": {"stage_name": {"$ne": None}}},
+                {"$group": {"_id": "$stage_name", "count": {"$sum": 1}}}
+            ],
+            "sales_cycle": [{"$match": {"stage_name": "Won"}}] + sales_cycle_stages()
+        }}
+    ]
+    
+    facet_result, qualification_result = await asyncio.gather(
+        db.opportunities.aggregate(pipeline).to_list(1),
+        db.opportunity_qualifications.aggregate(qualification_pipeline(start_date_obj, end_date_obj)).to_list(1)
+    )
+    facets = facet_result[0] if facet_result else {}
+    totals = (facets.get("totals") or [{}])[0]
+    sales_cycle = (facets.get("sales_cycle") or [{}])[0]
+    qualification_totals = qualification_result[0] if qualification_result else {}
+    
+    total_opportunities = totals.get("total_opportunities", 0)
+    won_opportunities = totals.get("won_opportunities", 0)
+    lost_opportunities = totals.get("lost_opportunities", 0)
+    total_pipeline_value = float(totals.get("total_pipeline_value", 0.0))
+    
+    # Calculate derived metrics
+    closed_opportunities = won_opportunities + lost_opportunities
+    win_rate = (won_opportunities / closed_opportunities * 100) if closed_opportunities > 0 else 0
+    loss_rate = (lost_opportunities / closed_opportunities * 100) if closed_opportunities > 0 else 0
+    average_deal_size = total_pipeline_value / total_opportunities if total_opportunities > 0 else 0
+    average_sales_cycle = sales_cycle.get("average_sales_cycle") or 0
+    
+    total_qualifications = qualification_totals.get("total", 0)
+    qualification_completion_rate = (qualification_totals.get("completed", 0) / total_qualifications * 100) if total_qualifications else 0
+    
+    return {
+        "period": period,
+        "period_start": start_date_obj.isoformat(),
+        "period_end": end_date_obj.isoformat(),
+        "total_opportunities": total_opportunities,
+        "new_opportunities": total_opportunities,
+        "closed_opportunities": closed_opportunities,
+        "won_opportunities": won_opportunities,
+        "lost_opportunities": lost_opportunities,
+        "total_pipeline_value": round(total_pipeline_value, 2),
+        "won_revenue": round(float(totals.get("won_revenue", 0.0)), 2),
+        "lost_revenue": round(float(totals.get("lost_revenue", 0.0)), 2),
+        "average_deal_size": round(average_deal_size, 2),
+        "win_rate": round(win_rate, 2),
+        "loss_rate": round(loss_rate, 2),
+        "average_sales_cycle": round(average_sales_cycle),
+        "qualification_completion_rate": round(qualification_completion_rate, 2),
+        "stage_distribution": {s["_id"]: s["count"] for s in facets.get("stage_distribution", [])},
+        "generated_at": datetime.now(timezone.utc).isoformat()
+    }
+
 @api_router.get("/opportunities/analytics", response_model=APIResponse)
 @require_permission("/opportunities", "view")
 async def get_opportunity_analytics(
@@ -8250,112 +9988,8 @@ async def get_opportunity_analytics(
 ):
     """Get comprehensive opportunity analytics and KPIs"""
     try:
-        # Set default date range if not provided
-        if not start_date or not end_date:
-            end_date_obj = datetime.now(timezone.utc)
-            if period == "monthly":
-                start_date_obj = end_date_obj.replace(day=1)
-            elif period == "quarterly":
-                quarter_start_month = ((end_date_obj.month - 1) // 3) * 3 + 1
-                start_date_obj = end_date_obj.replace(month=quarter_start_month, day=1)
-            elif period == "yearly":
-                start_date_obj = end_date_obj.replace(month=1, day=1)
-            else:  # weekly or daily
-                start_date_obj = end_date_obj - timedelta(days=30)
-        else:
-            start_date_obj = datetime.fromisoformat(start_date)
-            end_date_obj = datetime.fromisoformat(end_date)
-        
-        # Get opportunities in the date range
-        opportunities_cursor = db.opportunities.find({
-            "created_at": {"$gte": start_date_obj, "$lte": end_date_obj},
-            "is_deleted": False
-        })
-        opportunities = await opportunities_cursor.to_list(1000)
-        
-        # Calculate metrics
-        total_opportunities = len(opportunities)
-        new_opportunities = total_opportunities
-        
-        # Won/Lost opportunities (based on stage)
-        won_opportunities = 0
-        lost_opportunities = 0
-        total_pipeline_value = 0.0
-        won_revenue = 0.0
-        lost_revenue = 0.0
-        
-        stage_distribution = {}
-        sales_cycles = []
-        
-        for opp in opportunities:
-            # Calculate pipeline value
-            if opp.get("expected_revenue"):
-                total_pipeline_value += float(opp["expected_revenue"])
-            
-            # Get current stage
-            current_stage = await db.opportunity_stages.find_one({"id": opp.get("current_stage_id")})
-            if current_stage:
-                stage_name = current_stage.get("stage_name", "Unknown")
-                stage_distribution[stage_name] = stage_distribution.get(stage_name, 0) + 1
-                
-                # Check if Won or Lost
-                if stage_name == "Won":
-                    won_opportunities += 1
-                    if opp.get("expected_revenue"):
-                        won_revenue += float(opp["expected_revenue"])
-                elif stage_name in ["Lost", "Dropped"]:
-                    lost_opportunities += 1
-                    if opp.get("expected_revenue"):
-                        lost_revenue += float(opp["expected_revenue"])
-            
-            # Calculate sales cycle
-            if opp.get("created_at") and current_stage and stage_name == "Won":
-                # Get stage history to find when it was won
-                stage_history = await db.opportunity_stage_history.find_one({
-                    "opportunity_id": opp["id"],
-                    "stage_name": "Won"
-                })
-                if stage_history:
-                    cycle_days = (stage_history["transition_date"] - opp["created_at"]).days
-                    sales_cycles.append(cycle_days)
-        
-        # Calculate derived metrics
-        closed_opportunities = won_opportunities + lost_opportunities
-        win_rate = (won_opportunities / closed_opportunities * 100) if closed_opportunities > 0 else 0
-        loss_rate = (lost_opportunities / closed_opportunities * 100) if closed_opportunities > 0 else 0
-        average_deal_size = total_pipeline_value / total_opportunities if total_opportunities > 0 else 0
-        average_sales_cycle = sum(sales_cycles) / len(sales_cycles) if sales_cycles else 0
-        
-        # Get qualification metrics
-        qualification_cursor = db.opportunity_qualifications.find({
-            "created_at": {"$gte": start_date_obj, "$lte": end_date_obj}
-        })
-        qualifications = await qualification_cursor.to_list(1000)
-        
-        completed_qualifications = len([q for q in qualifications if q.get("compliance_status") in ["compliant", "exempted"]])
-        qualification_completion_rate = (completed_qualifications / len(qualifications) * 100) if qualifications else 0
-        
-        # Create analytics response
-        analytics_data = {
-            "period": period,
-            "period_start": start_date_obj.isoformat(),
-            "period_end": end_date_obj.isoformat(),
-            "total_opportunities": total_opportunities,
-            "new_opportunities": new_opportunities,
-            "closed_opportunities": closed_opportunities,
-            "won_opportunities": won_opportunities,
-            "lost_opportunities": lost_opportunities,
-            "total_pipeline_value": round(total_pipeline_value, 2),
-            "won_revenue": round(won_revenue, 2),
-            "lost_revenue": round(lost_revenue, 2),
-            "average_deal_size": round(average_deal_size, 2),
-            "win_rate": round(win_rate, 2),
-            "loss_rate": round(loss_rate, 2),
-            "average_sales_cycle": round(average_sales_cycle),
-            "qualification_completion_rate": round(qualification_completion_rate, 2),
-            "stage_distribution": stage_distribution,
-            "generated_at": datetime.now(timezone.utc).isoformat()
-        }
+        start_date_obj, end_date_obj = resolve_analytics_period(period, start_date, end_date)
+        analytics_data = await compute_opportunity_analytics(period, start_date_obj, end_date_obj)
         
         return APIResponse(success=True, message="Analytics generated successfully", data=analytics_data)
         
@@ -8367,9 +10001,20 @@ async def get_opportunity_analytics(
 async def get_opportunity_kpis(current_user: User = Depends(get_current_user)):
     """Get all opportunity KPIs with current values"""
     try:
-        # Get current period analytics for KPI calculation
-        analytics_response = await get_opportunity_analytics("monthly", None, None, current_user)
-        analytics_data = analytics_response.data
+        # Get current period metrics from the KPI snapshot store
+        start_date_obj, end_date_obj = resolve_analytics_period("monthly", None, None)
+        snapshot_totals, cycle_metrics = await asyncio.gather(
+            summarize_opportunity_kpi_snapshots({"period": start_date_obj.strftime("%Y-%m")}),
+            compute_cycle_and_qualification_metrics(start_date_obj, end_date_obj)
+        )
+        analytics_data = {
+            "win_rate": round(snapshot_totals["win_rate"], 2),
+            "average_deal_size": round(snapshot_totals["average_deal_size"], 2),
+            "total_pipeline_value": round(snapshot_totals["pipeline_value"], 2),
+            "period_start": start_date_obj.isoformat(),
+            "period_end": end_date_obj.isoformat(),
+            **cycle_metrics
+        }
         
         # Define standard KPIs with targets
         kpis = [
@@ -8453,65 +10098,35 @@ async def get_opportunity_kpis(current_user: User = Depends(get_current_user)):
 async def get_team_performance(current_user: User = Depends(get_current_user)):
     """Get team performance metrics"""
     try:
-        # Get all opportunities with owner information
+        # Roll up KPI snapshot buckets per owner
         pipeline = [
-            {"$match": {"is_deleted": False}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "opportunity_owner_id",
-                "foreignField": "id",
-                "as": "owner"
-            }},
-            {"$unwind": {"path": "$owner", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "opportunity_stages",
-                "localField": "current_stage_id",
-                "foreignField": "id",
-                "as": "current_stage"
-            }},
-            {"$unwind": {"path": "$current_stage", "preserveNullAndEmptyArrays": True}},
             {"$group": {
-                "_id": "$opportunity_owner_id",
-                "owner_name": {"$first": "$owner.name"},
-                "owner_email": {"$first": "$owner.email"},
-                "total_opportunities": {"$sum": 1},
-                "total_pipeline_value": {"$sum": "$expected_revenue"},
-                "won_opportunities": {
-                    "$sum": {
-                        "$cond": [{"$eq": ["$current_stage.stage_name", "Won"]}, 1, 0]
-                    }
-                },
-                "won_revenue": {
-                    "$sum": {
-                        "$cond": [{"$eq": ["$current_stage.stage_name", "Won"]}, "$expected_revenue", 0]
-                    }
-                }
+                "_id": "$owner_id",
+                "total_opportunities": {"$sum": "$opportunity_count"},
+                "total_pipeline_value": {"$sum": "$pipeline_value"},
+                "won_opportunities": {"$sum": "$won_count"},
+                "won_revenue": {"$sum": "$won_revenue"}
             }},
+            {"$match": {"total_opportunities": {"$gt": 0}}},
             {"$addFields": {
-                "win_rate": {
-                    "$cond": [
-                        {"$gt": ["$total_opportunities", 0]},
-                        {"$multiply": [{"$divide": ["$won_opportunities", "$total_opportunities"]}, 100]},
-                        0
-                    ]
-                },
-                "average_deal_size": {
-                    "$cond": [
-                        {"$gt": ["$total_opportunities", 0]},
-                        {"$divide": ["$total_pipeline_value", "$total_opportunities"]},
-                        0
-                    ]
-                }
+                "win_rate": {"$multiply": [{"$divide": ["$won_opportunities", "$total_opportunities"]}, 100]},
+                "average_deal_size": {"$divide": ["$total_pipeline_value", "$total_opportunities"]}
             }},
             {"$sort": {"won_revenue": -1}}
         ]
         
-        performance_cursor = db.opportunities.aggregate(pipeline)
-        team_performance = await performance_cursor.to_list(100)
+        team_performance = await db.opportunity_kpi_snapshots.aggregate(pipeline).to_list(100)
+        
+        # Enrich owner details with a single users query
+        owner_ids = [performance["_id"] for performance in team_performance if performance["_id"]]
+        owners = await db.users.find({"id": {"$in": owner_ids}}, {"_id": 0, "id": 1, "name": 1, "email": 1}).to_list(None)
+        owners_by_id = {owner["id"]: owner for owner in owners}
         
-        # Remove MongoDB _id field
         for performance in team_performance:
             performance["user_id"] = performance.pop("_id")
+            owner = owners_by_id.get(performance["user_id"], {})
+            performance["owner_name"] = owner.get("name")
+            performance["owner_email"] = owner.get("email")
         
         # Calculate team totals
         total_team_opportunities = sum(p["total_opportunities"] for p in team_performance)
@@ -8542,132 +10157,633 @@ async def get_team_performance(current_user: User = Depends(get_current_user)):
 async def get_enhanced_analytics(current_user: User = Depends(get_current_user)):
     """Get enhanced analytics including forecasting and competitor analysis"""
     try:
-        # Get all opportunities
-        opportunities = await db.opportunities.find({"is_deleted": False}).to_list(None)
-        
-        # Calculate weighted revenue by stage
-        stage_probabilities = {
-            "L1": 10, "L2": 25, "L3": 40, "L4": 60, 
-            "L5": 75, "L6": 100, "L7": 0, "L8": 0
-        }
-        
-        weighted_revenue = 0
-        stage_breakdown = {}
-        
-        for opp in opportunities:
-            stage = opp.get("current_stage_name", "L1")
-            probability = stage_probabilities.get(stage, 10)
-            revenue = opp.get("expected_revenue", 0)
-            weighted_value = revenue * (probability / 100)
-            weighted_revenue += weighted_value
-            
-            if stage not in stage_breakdown:
-                stage_breakdown[stage] = {"count": 0, "value": 0, "weighted_value": 0}
-            
-            stage_breakdown[stage]["count"] += 1
-            stage_breakdown[stage]["value"] += revenue
-            stage_breakdown[stage]["weighted_value"] += weighted_value
-        
-        # Calculate win rate
-        total_closed = len([o for o in opportunities if o.get("current_stage_name") in ["L6", "L7"]])
-        won_count = len([o for o in opportunities if o.get("current_stage_name") == "L6"])
-        win_rate = (won_count / total_closed * 100) if total_closed > 0 else 0
-        
-        # Mock competitor analysis
-        competitor_analysis = [
-            {"name": "Competitor A", "opportunities": 15, "win_rate": 25},
-            {"name": "Competitor B", "opportunities": 12, "win_rate": 30},
-            {"name": "Competitor C", "opportunities": 8, "win_rate": 15}
-        ]
+        # Get pipeline totals from the KPI snapshot store alongside the forecast
+        snapshot_totals, forecast = await asyncio.gather(
+            summarize_opportunity_kpi_snapshots({}),
+            compute_pipeline_forecast()
+        )
+        
+        # Calculate weighted revenue by stage using historical win probabilities
+        win_probabilities = forecast["win_probabilities"]
+        outcome_probabilities = {"won": 1.0, "lost": 0.0}
+        
+        weighted_revenue = 0
+        stage_breakdown = {}
+        
+        for stage_name, stage in snapshot_totals["stage_breakdown"].items():
+            probability = outcome_probabilities.get(
+                stage["outcome"],
+                win_probabilities.get(stage["stage_code"], {}).get("win_probability", FORECAST_DEFAULT_PRIOR)
+            )
+            weighted_value = stage["value"] * probability
+            weighted_revenue += weighted_value
+            stage_breakdown[stage_name] = {
+                "count": stage["count"],
+                "value": stage["value"],
+                "win_probability": round(probability, 4),
+                "weighted_value": weighted_value
+            }
+        
+        win_rate = snapshot_totals["win_rate"]
+        
+        # Competitor win/loss from lead competitor records
+        competitor_analysis = await compute_competitor_analytics(*resolve_cached_analytics_window(None, None))
+        
+        analytics_data = {
+            "weighted_revenue": weighted_revenue,
+            "stage_breakdown": stage_breakdown,
+            "win_rate": round(win_rate, 1),
+            "total_opportunities": snapshot_totals["opportunity_count"],
+            "competitor_analysis": competitor_analysis,
+            "forecast": forecast
+        }
+        
+        return APIResponse(success=True, message="Enhanced analytics retrieved successfully", data=analytics_data)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ===== OPPORTUNITY FUNNEL ANALYTICS =====
+
+FUNNEL_STAGE_CODES = ["L1", "L2", "L3", "L4", "L5", "L6", "L7", "L8"]
+FUNNEL_CACHE_TTL_SECONDS = 600
+
+# Funnel results keyed by (start, end) window -> (expires_at, data)
+_funnel_analytics_cache: Dict[tuple, tuple] = {}
+
+def build_funnel_analytics(opportunity_ids, stage_refs, transition_dates, stage_map: Dict[str, Dict[str, Any]],
+                           creation_months: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Build the transition matrix, stage dwell times and creation-month cohorts from stage history arrays"""
+    stage_count = len(FUNNEL_STAGE_CODES)
+    empty_result = {
+        "stages": FUNNEL_STAGE_CODES,
+        "transition_matrix": [[0] * stage_count for _ in range(stage_count)],
+        "dwell_time_days": {code: {"samples": 0, "median": None, "p90": None} for code in FUNNEL_STAGE_CODES},
+        "cohorts": [],
+        "opportunities_analyzed": 0,
+        "transitions_analyzed": 0
+    }
+    if len(opportunity_ids) == 0:
+        return empty_result
+    
+    # Encode opportunities and stages as integer arrays
+    unique_refs, ref_index = np.unique(np.asarray(stage_refs, dtype=object).astype(str), return_inverse=True)
+    ref_stages = [describe_opportunity_stage(ref, stage_map) for ref in unique_refs]
+    code_positions = {code: position for position, code in enumerate(FUNNEL_STAGE_CODES)}
+    ref_stage_index = np.array([code_positions.get(stage["stage_code"], -1) for stage in ref_stages], dtype=np.int64)
+    ref_is_won = np.array([stage["outcome"] == "won" for stage in ref_stages], dtype=np.int64)
+    ref_is_lost = np.array([stage["outcome"] == "lost" for stage in ref_stages], dtype=bool)
+    
+    # Codes that are only ever Lost/Dropped are terminal outcomes, not steps of the progression;
+    # rows are resolved per stage, so a code shared with an open stage counts only its open rows
+    code_outcomes = stage_code_outcomes(stage_map, unique_refs)
+    progression = [
+        (position, code) for position, code in enumerate(FUNNEL_STAGE_CODES)
+        if code_outcomes[code] - {"lost"}
+    ]
+    
+    unique_opportunities, opportunity_index = np.unique(np.asarray(opportunity_ids, dtype=object).astype(str), return_inverse=True)
+    timestamps = np.array([date.timestamp() for date in transition_dates], dtype=np.float64)
+    
+    # Order rows by opportunity, then by transition time
+    order = np.lexsort((timestamps, opportunity_index))
+    opportunity_index = opportunity_index[order]
+    timestamps = timestamps[order]
+    stage_index = ref_stage_index[ref_index[order]]
+    is_won = ref_is_won[ref_index[order]]
+    is_lost = ref_is_lost[ref_index[order]]
+    
+    # Consecutive rows of the same opportunity form a transition
+    same_opportunity = opportunity_index[1:] == opportunity_index[:-1]
+    from_stage = stage_index[:-1][same_opportunity]
+    to_stage = stage_index[1:][same_opportunity]
+    dwell_days = (timestamps[1:] - timestamps[:-1])[same_opportunity] / 86400.0
+    
+    valid = (from_stage >= 0) & (to_stage >= 0)
+    transition_matrix = np.bincount(
+        from_stage[valid] * stage_count + to_stage[valid],
+        minlength=stage_count * stage_count
+    ).reshape(stage_count, stage_count)
+    
+    dwell_time_days = {}
+    for position, code in enumerate(FUNNEL_STAGE_CODES):
+        samples = dwell_days[from_stage == position]
+        dwell_time_days[code] = {
+            "samples": int(samples.size),
+            "median": round(float(np.median(samples)), 2) if samples.size else None,
+            "p90": round(float(np.percentile(samples, 90)), 2) if samples.size else None
+        }
+    
+    # Stages each opportunity actually visited; terminal codes never count as reached
+    starts = np.flatnonzero(np.r_[True, ~same_opportunity])
+    visited = np.zeros((unique_opportunities.size, stage_count), dtype=bool)
+    reached = (stage_index >= 0) & ~is_lost
+    visited[opportunity_index[reached], stage_index[reached]] = True
+    reached_won = np.maximum.reduceat(is_won, starts)
+    reached_lost = np.maximum.reduceat(is_lost.astype(np.int64), starts)
+    
+    # Cohorts by creation month, falling back to the first recorded transition when unknown
+    creation_months = creation_months or {}
+    cohort_months = np.array([
+        creation_months.get(opportunity_id) or datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m")
+        for opportunity_id, ts in zip(unique_opportunities[opportunity_index[starts]], timestamps[starts])
+    ])
+    
+    cohorts = []
+    for month in np.unique(cohort_months):
+        in_cohort = cohort_months == month
+        cohort_size = int(in_cohort.sum())
+        cohort_visited = visited[in_cohort]
+        cohorts.append({
+            "cohort": str(month),
+            "opportunities": cohort_size,
+            "reached_stage_rate": {
+                code: round(float(cohort_visited[:, position].sum()) / cohort_size * 100, 2)
+                for position, code in progression
+            },
+            "won_rate": round(float(reached_won[in_cohort].sum()) / cohort_size * 100, 2),
+            "lost_rate": round(float(reached_lost[in_cohort].sum()) / cohort_size * 100, 2)
+        })
+    
+    return {
+        "stages": FUNNEL_STAGE_CODES,
+        "transition_matrix": transition_matrix.tolist(),
+        "dwell_time_days": dwell_time_days,
+        "cohorts": cohorts,
+        "opportunities_analyzed": int(starts.size),
+        "transitions_analyzed": int(same_opportunity.sum())
+    }
+
+def resolve_cached_analytics_window(start_date: Optional[str], end_date: Optional[str]):
+    """Resolve a cacheable analytics window, defaulting to the trailing year aligned to day boundaries"""
+    if start_date and end_date:
+        return datetime.fromisoformat(start_date), datetime.fromisoformat(end_date)
+    end_date_obj = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return end_date_obj - timedelta(days=365), end_date_obj
+
+async def compute_funnel_analytics(start_date_obj: datetime, end_date_obj: datetime) -> Dict[str, Any]:
+    """Compute funnel analytics over stage history in a window, served from a short-lived cache"""
+    cache_key = (start_date_obj.isoformat(), end_date_obj.isoformat())
+    cached = _funnel_analytics_cache.get(cache_key)
+    now = datetime.now(timezone.utc)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    # Single projection query over the window
+    history = await db.opportunity_stage_history.find(
+        {"transition_date": {"$gte": start_date_obj, "$lte": end_date_obj}},
+        {"_id": 0, "opportunity_id": 1, "to_stage_id": 1, "transition_date": 1}
+    ).to_list(None)
+    history = [row for row in history if isinstance(row.get("transition_date"), datetime)]
+    
+    stage_map = await get_opportunity_stage_map()
+    
+    # Creation months of the opportunities in the window, for cohort keying
+    opportunities = await db.opportunities.find(
+        {"id": {"$in": list({row.get("opportunity_id") for row in history})}},
+        {"_id": 0, "id": 1, "created_at": 1}
+    ).to_list(None)
+    creation_months = {
+        opportunity["id"]: opportunity["created_at"].strftime("%Y-%m")
+        for opportunity in opportunities if isinstance(opportunity.get("created_at"), datetime)
+    }
+    
+    funnel_data = build_funnel_analytics(
+        [row.get("opportunity_id") for row in history],
+        [row.get("to_stage_id") for row in history],
+        [row["transition_date"] if row["transition_date"].tzinfo else row["transition_date"].replace(tzinfo=timezone.utc) for row in history],
+        stage_map,
+        creation_months
+    )
+    funnel_data.update({
+        "period_start": start_date_obj.isoformat(),
+        "period_end": end_date_obj.isoformat(),
+        "generated_at": now.isoformat()
+    })
+    
+    # Drop expired windows before caching the new one
+    for key in [key for key, (expires_at, _) in _funnel_analytics_cache.items() if expires_at <= now]:
+        _funnel_analytics_cache.pop(key, None)
+    _funnel_analytics_cache[cache_key] = (now + timedelta(seconds=FUNNEL_CACHE_TTL_SECONDS), funnel_data)
+    return funnel_data
+
+@api_router.get("/opportunities/funnel-analytics", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def get_funnel_analytics(
+    start_date: str = None,
+    end_date: str = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get stage transition matrix, dwell times and cohort conversion from stage history"""
+    try:
+        start_date_obj, end_date_obj = resolve_cached_analytics_window(start_date, end_date)
+        funnel_data = await compute_funnel_analytics(start_date_obj, end_date_obj)
+        
+        return APIResponse(success=True, message="Funnel analytics generated successfully", data=funnel_data)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ===== OPPORTUNITY FORECASTING =====
+
+# Prior win probabilities blended with observed outcomes: codes with an open stage use the
+# per-code prior, codes that only ever stand for Won or only for Lost use the outcome prior
+FORECAST_OUTCOME_PRIORS = {"won": 1.0, "lost": 0.0}
+FORECAST_OPEN_STAGE_PRIORS = {
+    "L1": 0.10, "L2": 0.25, "L3": 0.40, "L4": 0.60,
+    "L5": 0.75, "L6": 0.85, "L7": 0.90, "L8": 0.90
+}
+FORECAST_DEFAULT_PRIOR = 0.10
+FORECAST_PRIOR_WEIGHT = 5  # Pseudo-observations given to the prior
+FORECAST_SIMULATIONS = 10000
+FORECAST_EXACT_GROUP_SIZE = 256  # Larger quarters use a moment-matched normal draw
+FORECAST_DRAW_CHUNK_SIZE = 1024  # Opportunities per exact draw batch, bounding the draw matrix
+FORECAST_CACHE_TTL_SECONDS = 600
+
+# Cached (expires_at, win probabilities) estimated from stage history
+_win_probability_cache: Dict[str, tuple] = {}
+
+def estimate_win_probabilities(opportunity_ids, stage_refs, stage_map: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Estimate per-stage win probabilities from closed opportunities in stage history"""
+    stage_count = len(FUNNEL_STAGE_CODES)
+    won_samples = np.zeros(stage_count, dtype=np.int64)
+    closed_samples = np.zeros(stage_count, dtype=np.int64)
+    unique_refs = []
+    
+    if len(opportunity_ids) > 0:
+        unique_refs, ref_index = np.unique(np.asarray(stage_refs, dtype=object).astype(str), return_inverse=True)
+        ref_stages = [describe_opportunity_stage(ref, stage_map) for ref in unique_refs]
+        code_positions = {code: position for position, code in enumerate(FUNNEL_STAGE_CODES)}
+        stage_index = np.array([code_positions.get(stage["stage_code"], -1) for stage in ref_stages], dtype=np.int64)[ref_index]
+        row_won = np.array([stage["outcome"] == "won" for stage in ref_stages], dtype=bool)[ref_index]
+        row_lost = np.array([stage["outcome"] == "lost" for stage in ref_stages], dtype=bool)[ref_index]
+        
+        _, opportunity_index = np.unique(np.asarray(opportunity_ids, dtype=object).astype(str), return_inverse=True)
+        opportunity_count = int(opportunity_index.max()) + 1
+        
+        # Which open stages each opportunity passed through, and how it finished; Won/Lost rows
+        # are outcomes, so they never count as a visit to the code they share with an open stage
+        visited = np.zeros((opportunity_count, stage_count), dtype=bool)
+        valid = (stage_index >= 0) & ~row_won & ~row_lost
+        visited[opportunity_index[valid], stage_index[valid]] = True
+        won = np.zeros(opportunity_count, dtype=bool)
+        won[opportunity_index[row_won]] = True
+        lost = np.zeros(opportunity_count, dtype=bool)
+        lost[opportunity_index[row_lost]] = True
+        closed = won | lost
+        
+        won_samples = visited[won].sum(axis=0)
+        closed_samples = visited[closed].sum(axis=0)
+    
+    code_outcomes = stage_code_outcomes(stage_map, unique_refs)
+    priors = np.array([
+        FORECAST_OUTCOME_PRIORS[next(iter(code_outcomes[code]))]
+        if len(code_outcomes[code]) == 1 and "open" not in code_outcomes[code]
+        else FORECAST_OPEN_STAGE_PRIORS.get(code, FORECAST_DEFAULT_PRIOR)
+        for code in FUNNEL_STAGE_CODES
+    ])
+    probabilities = (won_samples + priors * FORECAST_PRIOR_WEIGHT) / (closed_samples + FORECAST_PRIOR_WEIGHT)
+    
+    return {
+        code: {
+            "win_probability": round(float(probabilities[position]), 4),
+            "won_samples": int(won_samples[position]),
+            "closed_samples": int(closed_samples[position])
+        }
+        for position, code in enumerate(FUNNEL_STAGE_CODES)
+    }
+
+async def get_stage_win_probabilities() -> Dict[str, Dict[str, Any]]:
+    """Get historical per-stage win probabilities, re-estimated at most every few minutes"""
+    cached = _win_probability_cache.get("all")
+    now = datetime.now(timezone.utc)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    history = await db.opportunity_stage_history.find(
+        {}, {"_id": 0, "opportunity_id": 1, "to_stage_id": 1}
+    ).to_list(None)
+    stage_map = await get_opportunity_stage_map()
+    probabilities = estimate_win_probabilities(
+        [row.get("opportunity_id") for row in history],
+        [row.get("to_stage_id") for row in history],
+        stage_map
+    )
+    _win_probability_cache["all"] = (now + timedelta(seconds=FORECAST_CACHE_TTL_SECONDS), probabilities)
+    return probabilities
+
+def closure_quarter(closure_date) -> str:
+    """Label the calendar quarter of an expected closure date"""
+    if not isinstance(closure_date, datetime):
+        return "Unscheduled"
+    return f"{closure_date.year}-Q{(closure_date.month - 1) // 3 + 1}"
+
+def simulate_pipeline_outcomes(revenues: np.ndarray, probabilities: np.ndarray, bucket_index: np.ndarray,
+                               bucket_count: int, simulations: int = FORECAST_SIMULATIONS, seed: Optional[int] = None) -> np.ndarray:
+    """Monte Carlo draws of won revenue per bucket, returned as a (buckets x simulations) array"""
+    rng = np.random.default_rng(seed)
+    outcomes = np.zeros((bucket_count, simulations))
+    if revenues.size == 0:
+        return outcomes
+    
+    # Sort by bucket once so every bucket is a contiguous slice
+    order = np.argsort(bucket_index, kind="stable")
+    revenues, probabilities, bucket_index = revenues[order], probabilities[order], bucket_index[order]
+    bucket_sizes = np.bincount(bucket_index, minlength=bucket_count)
+    
+    # Sum of many independent Bernoulli-weighted deals is close to normal
+    large = np.flatnonzero(bucket_sizes > FORECAST_EXACT_GROUP_SIZE)
+    if large.size:
+        means = np.bincount(bucket_index, weights=probabilities * revenues, minlength=bucket_count)[large]
+        stds = np.sqrt(np.bincount(
+            bucket_index, weights=probabilities * (1 - probabilities) * np.square(revenues), minlength=bucket_count
+        )[large])
+        totals = np.bincount(bucket_index, weights=revenues, minlength=bucket_count)[large]
+        draws = rng.normal(means[:, None], stds[:, None], (large.size, simulations))
+        outcomes[large] = np.clip(draws, 0, totals[:, None])
+    
+    # Smaller buckets are drawn exactly, all of them together in fixed-size batches
+    exact = bucket_sizes[bucket_index] <= FORECAST_EXACT_GROUP_SIZE
+    exact_revenues, exact_probabilities, exact_buckets = revenues[exact], probabilities[exact], bucket_index[exact]
+    for chunk_start in range(0, exact_revenues.size, FORECAST_DRAW_CHUNK_SIZE):
+        chunk = slice(chunk_start, chunk_start + FORECAST_DRAW_CHUNK_SIZE)
+        chunk_buckets = exact_buckets[chunk]
+        wins = rng.random((simulations, chunk_buckets.size), dtype=np.float32) < exact_probabilities[chunk]
+        bucket_starts = np.flatnonzero(np.r_[True, chunk_buckets[1:] != chunk_buckets[:-1]])
+        outcomes[chunk_buckets[bucket_starts]] += np.add.reduceat(wins * exact_revenues[chunk], bucket_starts, axis=1).T
+    return outcomes
+
+def percentile_summary(draws: np.ndarray) -> Dict[str, float]:
+    """P10/P50/P90 of simulated outcomes"""
+    p10, p50, p90 = np.percentile(draws, [10, 50, 90])
+    return {"p10": round(float(p10), 2), "p50": round(float(p50), 2), "p90": round(float(p90), 2)}
+
+async def compute_pipeline_forecast() -> Dict[str, Any]:
+    """Forecast open pipeline revenue per closure quarter with historical win probabilities"""
+    stage_map, win_probabilities = await asyncio.gather(
+        get_opportunity_stage_map(),
+        get_stage_win_probabilities()
+    )
+    
+    # Exclude opportunities already sitting in a Won/Lost/Dropped stage
+    closed_refs = [
+        stage_id for stage_id in stage_map
+        if describe_opportunity_stage(stage_id, stage_map)["outcome"] != "open"
+    ] + list(CLOSING_STAGE_CODE_NAMES.keys())
+    open_opportunities = await db.opportunities.find(
+        {"is_deleted": False, "state": {"$ne": "Closed"}, "current_stage_id": {"$nin": closed_refs}},
+        {"_id": 0, "current_stage_id": 1, "expected_revenue": 1, "expected_closure_date": 1}
+    ).to_list(None)
+    
+    stage_probabilities = {}
+    for stage_ref in {opp.get("current_stage_id") for opp in open_opportunities}:
+        stage_code = describe_opportunity_stage(stage_ref, stage_map)["stage_code"]
+        stage_probabilities[stage_ref] = win_probabilities.get(stage_code, {}).get("win_probability", FORECAST_DEFAULT_PRIOR)
+    
+    revenues = np.array([float(opp.get("expected_revenue") or 0) for opp in open_opportunities], dtype=np.float64)
+    probabilities = np.array([stage_probabilities[opp.get("current_stage_id")] for opp in open_opportunities], dtype=np.float64)
+    quarter_labels, bucket_index = np.unique(
+        np.array([closure_quarter(opp.get("expected_closure_date")) for opp in open_opportunities], dtype=str),
+        return_inverse=True
+    )
+    
+    draws = simulate_pipeline_outcomes(revenues, probabilities, bucket_index, quarter_labels.size)
+    expected = revenues * probabilities
+    
+    quarters = []
+    for position, label in enumerate(quarter_labels):
+        in_quarter = bucket_index == position
+        quarters.append({
+            "quarter": str(label),
+            "opportunities": int(in_quarter.sum()),
+            "pipeline_value": round(float(revenues[in_quarter].sum()), 2),
+            "expected_revenue": round(float(expected[in_quarter].sum()), 2),
+            **percentile_summary(draws[position])
+        })
+    
+    return {
+        "win_probabilities": win_probabilities,
+        "quarters": quarters,
+        "total": {
+            "opportunities": int(revenues.size),
+            "pipeline_value": round(float(revenues.sum()), 2),
+            "expected_revenue": round(float(expected.sum()), 2),
+            **percentile_summary(draws.sum(axis=0))
+        },
+        "simulations": FORECAST_SIMULATIONS
+    }
+
+# ===== COMPETITOR ANALYTICS =====
+
+COMPETITOR_CACHE_TTL_SECONDS = 3600
+
+# Grouped encounter rows per window, keyed by (start, end):
+# {"start", "end", "expires_at", "groups": {(competitor_id, stage_id): {"encounters", "revenue"}}}
+_competitor_analytics_cache: Dict[tuple, Dict[str, Any]] = {}
+
+async def load_competitor_encounter_groups(start_date_obj: datetime, end_date_obj: datetime) -> Dict[tuple, Dict[str, float]]:
+    """Group lead competitors joined through leads to opportunities by competitor and current stage"""
+    pipeline = [
+        {"$match": {
+            "is_deleted": False,
+            "created_at": {"$gte": start_date_obj, "$lte": end_date_obj}
+        }},
+        {"$lookup": {
+            "from": "opportunities",
+            "let": {"lead_id": "$lead_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$lead_id", "$$lead_id"]}, "is_deleted": False}},
+                {"$project": {"_id": 0, "current_stage_id": 1, "expected_revenue": 1}}
+            ],
+            "as": "opportunity"
+        }},
+        {"$unwind": {"path": "$opportunity", "preserveNullAndEmptyArrays": True}},
+        {"$group": {
+            "_id": {"competitor_id": "$competitor_id", "stage_id": "$opportunity.current_stage_id"},
+            "encounters": {"$sum": 1},
+            "revenue": {"$sum": {"$ifNull": [{"$toDouble": "$opportunity.expected_revenue"}, 0]}}
+        }}
+    ]
+    rows = await db.lead_competitors.aggregate(pipeline).to_list(None)
+    return {
+        (row["_id"].get("competitor_id"), row["_id"].get("stage_id")): {"encounters": row["encounters"], "revenue": row["revenue"]}
+        for row in rows
+    }
+
+def adjust_competitor_group(groups: Dict[tuple, Dict[str, float]], key: tuple, encounters: int, revenue: float):
+    """Add (or with negative values, remove) encounters from a cached competitor group"""
+    group = groups.setdefault(key, {"encounters": 0, "revenue": 0.0})
+    group["encounters"] += encounters
+    group["revenue"] += revenue
+    if group["encounters"] <= 0:
+        groups.pop(key, None)
+
+def cached_competitor_windows(created_at) -> List[Dict[str, Any]]:
+    """Live cache windows that contain a lead competitor created at the given time"""
+    now = datetime.now(timezone.utc)
+    if isinstance(created_at, datetime) and created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    windows = []
+    for window in _competitor_analytics_cache.values():
+        if window["expires_at"] <= now:
+            continue
+        start = window["start"] if window["start"].tzinfo else window["start"].replace(tzinfo=timezone.utc)
+        end = window["end"] if window["end"].tzinfo else window["end"].replace(tzinfo=timezone.utc)
+        if isinstance(created_at, datetime) and start <= created_at <= end:
+            windows.append(window)
+    return windows
+
+async def apply_competitor_analytics_delta(before: Optional[dict], after: Optional[dict], event_id: Optional[str] = None):
+    """Move cached competitor encounters when an opportunity is created or changes stage/revenue
+    
+    With an event_id each cached window remembers the event, so replaying it changes nothing.
+    """
+    if not _competitor_analytics_cache:
+        return
+    try:
+        opportunity = after or before
+        competitors = await db.lead_competitors.find(
+            {"lead_id": opportunity.get("lead_id"), "is_deleted": False},
+            {"_id": 0, "competitor_id": 1, "created_at": 1}
+        ).to_list(None)
         
-        analytics_data = {
-            "weighted_revenue": weighted_revenue,
-            "stage_breakdown": stage_breakdown,
-            "win_rate": round(win_rate, 1),
-            "total_opportunities": len(opportunities),
-            "competitor_analysis": competitor_analysis,
-            "forecast": {
-                "q1": weighted_revenue * 0.3,
-                "q2": weighted_revenue * 0.4,
-                "q3": weighted_revenue * 0.2,
-                "q4": weighted_revenue * 0.1
-            }
+        updated_windows = []
+        for competitor in competitors:
+            for window in cached_competitor_windows(competitor.get("created_at")):
+                if event_id in window.setdefault("applied_events", set()):
+                    continue
+                updated_windows.append(window)
+                groups = window["groups"]
+                if before is None:
+                    adjust_competitor_group(groups, (competitor["competitor_id"], None), -1, 0.0)
+                else:
+                    adjust_competitor_group(groups, (competitor["competitor_id"], before.get("current_stage_id")), -1, -float(before.get("expected_revenue") or 0))
+                if after is not None and not after.get("is_deleted"):
+                    adjust_competitor_group(groups, (competitor["competitor_id"], after.get("current_stage_id")), 1, float(after.get("expected_revenue") or 0))
+        if event_id:
+            for window in updated_windows:
+                window["applied_events"].add(event_id)
+    except Exception as e:
+        # Drop the cache rather than serve drifted numbers
+        _competitor_analytics_cache.clear()
+        print(f"Warning: Failed to update competitor analytics cache: {str(e)}")
+
+async def apply_lead_competitor_added(lead_competitor: dict):
+    """Add a newly recorded lead competitor to the cached competitor analytics"""
+    if not _competitor_analytics_cache:
+        return
+    opportunity = await db.opportunities.find_one(
+        {"lead_id": lead_competitor["lead_id"], "is_deleted": False},
+        {"_id": 0, "current_stage_id": 1, "expected_revenue": 1}
+    )
+    stage_id = opportunity.get("current_stage_id") if opportunity else None
+    revenue = float(opportunity.get("expected_revenue") or 0) if opportunity else 0.0
+    for window in cached_competitor_windows(lead_competitor.get("created_at")):
+        adjust_competitor_group(window["groups"], (lead_competitor["competitor_id"], stage_id), 1, revenue)
+
+async def compute_competitor_analytics(start_date_obj: datetime, end_date_obj: datetime) -> List[Dict[str, Any]]:
+    """Per-competitor encounters, our win rate against them and revenue at stake"""
+    cache_key = (start_date_obj.isoformat(), end_date_obj.isoformat())
+    now = datetime.now(timezone.utc)
+    window = _competitor_analytics_cache.get(cache_key)
+    if not window or window["expires_at"] <= now:
+        window = {
+            "start": start_date_obj,
+            "end": end_date_obj,
+            "expires_at": now + timedelta(seconds=COMPETITOR_CACHE_TTL_SECONDS),
+            "groups": await load_competitor_encounter_groups(start_date_obj, end_date_obj)
         }
+        _competitor_analytics_cache[cache_key] = window
+    
+    stage_map = await get_opportunity_stage_map()
+    competitors = {}
+    for (competitor_id, stage_id), group in window["groups"].items():
+        summary = competitors.setdefault(competitor_id, {
+            "competitor_id": competitor_id,
+            "lead_encounters": 0,
+            "opportunities": 0,
+            "won": 0,
+            "lost": 0,
+            "open": 0,
+            "won_revenue": 0.0,
+            "lost_revenue": 0.0,
+            "revenue_at_stake": 0.0
+        })
+        summary["lead_encounters"] += group["encounters"]
+        if stage_id is None:
+            continue
+        summary["opportunities"] += group["encounters"]
+        outcome = describe_opportunity_stage(stage_id, stage_map)["outcome"]
+        summary[outcome] += group["encounters"]
+        if outcome == "won":
+            summary["won_revenue"] += group["revenue"]
+        elif outcome == "lost":
+            summary["lost_revenue"] += group["revenue"]
+        else:
+            summary["revenue_at_stake"] += group["revenue"]
+    
+    # Competitor names with a single master lookup
+    masters = await db.competitor_master.find(
+        {"id": {"$in": list(competitors.keys())}},
+        {"_id": 0, "id": 1, "competitor_name": 1}
+    ).to_list(None)
+    names = {master["id"]: master["competitor_name"] for master in masters}
+    
+    results = []
+    for competitor_id, summary in competitors.items():
+        closed = summary["won"] + summary["lost"]
+        summary["name"] = names.get(competitor_id, "Unknown")
+        summary["win_rate"] = round((summary["won"] / closed * 100) if closed > 0 else 0, 1)
+        for field in ["won_revenue", "lost_revenue", "revenue_at_stake"]:
+            summary[field] = round(summary[field], 2)
+        results.append(summary)
+    
+    results.sort(key=lambda summary: (summary["opportunities"], summary["lead_encounters"]), reverse=True)
+    return results
+
+@api_router.get("/opportunities/competitor-analytics", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def get_competitor_analytics(
+    start_date: str = None,
+    end_date: str = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get competitor encounter counts, win rate against each competitor and revenue at stake"""
+    try:
+        start_date_obj, end_date_obj = resolve_cached_analytics_window(start_date, end_date)
+        competitor_analysis = await compute_competitor_analytics(start_date_obj, end_date_obj)
         
-        return APIResponse(success=True, message="Enhanced analytics retrieved successfully", data=analytics_data)
+        return APIResponse(success=True, message="Competitor analytics generated successfully", data={
+            "period_start": start_date_obj.isoformat(),
+            "period_end": end_date_obj.isoformat(),
+            "competitors": competitor_analysis
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Present stored display fields the way the former $lookup enrichment did
+OPPORTUNITY_DISPLAY_STAGES = [
+    {"$addFields": {"current_stage_name": {"$ifNull": ["$current_stage_display_name", "$current_stage_name"]}}},
+    {"$project": {"_id": 0, "current_stage_display_name": 0, "display_fields_version": 0}}
+]
+
+def opportunity_detail_pipeline(opportunity_id: str) -> List[dict]:
+    """Aggregation returning a single opportunity enriched like the list view"""
+    return [{"$match": {"id": opportunity_id, "is_deleted": False}}, *OPPORTUNITY_DISPLAY_STAGES]
+
 @api_router.get("/opportunities/{opportunity_id}", response_model=APIResponse)
 @require_permission("/opportunities", "view")
 async def get_opportunity(opportunity_id: str, current_user: User = Depends(get_current_user)):
     """Get specific opportunity with all related data"""
     try:
-        # Get opportunity with enriched data (same pipeline as get_opportunities)
-        pipeline = [
-            {"$match": {"id": opportunity_id, "is_deleted": False}},
-            {"$lookup": {
-                "from": "companies",
-                "localField": "company_id",
-                "foreignField": "company_id",
-                "as": "company"
-            }},
-            {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "opportunity_stages",
-                "localField": "current_stage_id",
-                "foreignField": "id",
-                "as": "current_stage"
-            }},
-            {"$unwind": {"path": "$current_stage", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "opportunity_owner_id",
-                "foreignField": "id",
-                "as": "owner"
-            }},
-            {"$unwind": {"path": "$owner", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "leads",
-                "localField": "lead_id",
-                "foreignField": "id",
-                "as": "linked_lead"
-            }},
-            {"$unwind": {"path": "$linked_lead", "preserveNullAndEmptyArrays": True}},
-            {"$addFields": {
-                "company_name": "$company.company_name",
-                "current_stage_name": "$current_stage.stage_name",
-                "current_stage_code": "$current_stage.stage_code",
-                "owner_name": "$owner.name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
-                "linked_lead_id": "$linked_lead.lead_id"
-            }}
-        ]
-        
-        opportunities_cursor = db.opportunities.aggregate(pipeline)
-        opportunities = await opportunities_cursor.to_list(1)
+        # Get opportunity with enriched data (same fields as get_opportunities)
+        opportunities = await db.opportunities.aggregate(opportunity_detail_pipeline(opportunity_id)).to_list(1)
         
         if not opportunities:
             raise HTTPException(status_code=404, detail="Opportunity not found")
         
-        opportunity = opportunities[0]
-        opportunity.pop("_id", None)
-        opportunity.pop("company", None)
-        opportunity.pop("current_stage", None)
-        opportunity.pop("owner", None)
-        opportunity.pop("currency", None)
-        opportunity.pop("linked_lead", None)
-        
-        return APIResponse(success=True, message="Opportunity retrieved successfully", data=opportunity)
+        return APIResponse(success=True, message="Opportunity retrieved successfully", data=opportunities[0])
         
     except HTTPException:
         raise
@@ -8886,6 +11002,11 @@ async def update_qualification_compliance(
             user_id=current_user.id, 
             action=f"Updated qualification rule {rule['rule_code']} for opportunity {opportunity['opportunity_id']}: {compliance_status}"
         ))
+        await record_opportunity_audit(
+            opportunity_id, "qualify", current_user.id, f"Qualification rule {rule['rule_code']}: {compliance_status}",
+            subject_type="qualification", subject_id=rule_id,
+            before=existing_qualification or {}, after=update_data
+        )
         
         return APIResponse(success=True, message="Qualification compliance updated successfully")
         
@@ -8894,6 +11015,246 @@ async def update_qualification_compliance(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Compiled qualification rules
+QUALIFICATION_RULE_CACHE_TTL_SECONDS = 600
+QUALIFIED_COMPLIANCE_STATUSES = ["compliant", "exempted"]
+
+class QualificationRuleEvaluator:
+    """A mandatory qualification rule with its validation_logic JSON parsed once"""
+    
+    def __init__(self, rule: dict):
+        self.rule_id = rule["id"]
+        self.rule_code = rule["rule_code"]
+        self.rule_name = rule["rule_name"]
+        try:
+            self.logic = json.loads(rule.get("validation_logic") or "{}")
+        except (TypeError, ValueError):
+            self.logic = {}
+        if not isinstance(self.logic, dict):
+            self.logic = {}
+        self.logic_type = self.logic.get("type")
+        self.field = self.logic.get("field")
+        self.pattern = None
+        if self.logic_type == "regex" and self.logic.get("pattern"):
+            try:
+                self.pattern = re.compile(self.logic["pattern"])
+            except (TypeError, re.error) as e:
+                # Leave the rule to manual review rather than failing every check
+                print(f"Warning: Skipping invalid pattern for qualification rule {self.rule_code}: {str(e)}")
+    
+    def auto_check(self, opportunity: dict) -> Optional[bool]:
+        """Check field-level logic against the opportunity, None when it cannot be checked automatically"""
+        if self.logic_type == "text_validation":
+            title = opportunity.get("opportunity_title") or ""
+            return self.logic.get("min_length", 0) <= len(title.strip()) <= self.logic.get("max_length", 255)
+        
+        value = opportunity.get(self.field) if self.field else None
+        if value is None:
+            value = (opportunity.get("stage_form_data") or {}).get(self.field) if self.field else None
+        if value is None:
+            return None
+        if self.pattern is not None:
+            return bool(self.pattern.match(str(value)))
+        if self.logic_type == "text_required":
+            return len(str(value).strip()) >= self.logic.get("min_length", 1)
+        return None
+    
+    def evaluate(self, opportunity: dict, compliance: Optional[dict]) -> Dict[str, Any]:
+        """Resolve the compliance status of this rule for one opportunity"""
+        status = compliance.get("compliance_status", "pending") if compliance else "pending"
+        if status in QUALIFIED_COMPLIANCE_STATUSES:
+            return {"status": "compliant"}
+        
+        result = {"status": "non_compliant" if status == "non_compliant" else "pending"}
+        if result["status"] == "non_compliant":
+            result["compliance_notes"] = compliance.get("compliance_notes", "")
+        auto_check = self.auto_check(opportunity)
+        if auto_check is not None:
+            result["auto_check_passed"] = auto_check
+        return result
+
+# Evaluators per opportunity type -> (expires_at, [QualificationRuleEvaluator])
+_qualification_rule_cache: Dict[str, tuple] = {}
+
+async def get_qualification_evaluators(opportunity_type: str) -> List[QualificationRuleEvaluator]:
+    """Get compiled mandatory rules for an opportunity type, loading them at most once per TTL"""
+    cached = _qualification_rule_cache.get(opportunity_type)
+    now = datetime.now(timezone.utc)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    rules = await db.qualification_rules.find({
+        "$or": [
+            {"opportunity_type": opportunity_type},
+            {"opportunity_type": "Both"}
+        ],
+        "is_mandatory": True,
+        "is_active": True,
+        "is_deleted": False
+    }, {"_id": 0}).sort("sequence_order", 1).to_list(None)
+    
+    evaluators = [QualificationRuleEvaluator(rule) for rule in rules]
+    _qualification_rule_cache[opportunity_type] = (now + timedelta(seconds=QUALIFICATION_RULE_CACHE_TTL_SECONDS), evaluators)
+    return evaluators
+
+def evaluate_qualifications(opportunities: List[dict], evaluators_by_type: Dict[str, List[QualificationRuleEvaluator]],
+                            compliance_rows: List[dict]) -> Dict[str, Dict[str, Any]]:
+    """Score qualification completion for many opportunities without touching the database"""
+    compliance_by_key = {(row["opportunity_id"], row["rule_id"]): row for row in compliance_rows}
+    
+    results = {}
+    for opportunity in opportunities:
+        evaluators = evaluators_by_type.get(opportunity.get("opportunity_type"), [])
+        compliant_count = 0
+        pending_rules = []
+        non_compliant_rules = []
+        
+        for evaluator in evaluators:
+            outcome = evaluator.evaluate(opportunity, compliance_by_key.get((opportunity["id"], evaluator.rule_id)))
+            if outcome["status"] == "compliant":
+                compliant_count += 1
+                continue
+            entry = {"rule_code": evaluator.rule_code, "rule_name": evaluator.rule_name}
+            entry.update({key: value for key, value in outcome.items() if key != "status"})
+            if outcome["status"] == "non_compliant":
+                non_compliant_rules.append(entry)
+            else:
+                pending_rules.append(entry)
+        
+        total_mandatory = len(evaluators)
+        completion_percentage = (compliant_count / total_mandatory) * 100 if total_mandatory > 0 else 100
+        results[opportunity["id"]] = {
+            "qualification_complete": completion_percentage == 100,
+            "completion_percentage": round(completion_percentage, 2),
+            "compliant_rules": compliant_count,
+            "total_mandatory_rules": total_mandatory,
+            "pending_rules": pending_rules,
+            "non_compliant_rules": non_compliant_rules
+        }
+    return results
+
+async def evaluate_qualification_batch(opportunities: List[dict]) -> Dict[str, Dict[str, Any]]:
+    """Load cached rules and all compliance rows in one query, then score the opportunities"""
+    evaluators_by_type = {}
+    for opportunity_type in {opportunity.get("opportunity_type") for opportunity in opportunities}:
+        evaluators_by_type[opportunity_type] = await get_qualification_evaluators(opportunity_type)
+    
+    rule_ids = list({evaluator.rule_id for evaluators in evaluators_by_type.values() for evaluator in evaluators})
+    compliance_rows = []
+    if opportunities and rule_ids:
+        # One grouped aggregation returns every opportunity's compliance rows
+        grouped = await db.opportunity_qualifications.aggregate([
+            {"$match": {
+                "opportunity_id": {"$in": [opportunity["id"] for opportunity in opportunities]},
+                "rule_id": {"$in": rule_ids},
+                "is_active": True
+            }},
+            {"$sort": {"updated_at": 1}},
+            {"$group": {
+                "_id": "$opportunity_id",
+                "rules": {"$push": {
+                    "rule_id": "$rule_id",
+                    "compliance_status": "$compliance_status",
+                    "compliance_notes": "$compliance_notes"
+                }}
+            }}
+        ]).to_list(None)
+        compliance_rows = [
+            {"opportunity_id": group["_id"], **row}
+            for group in grouped for row in group["rules"]
+        ]
+    
+    return evaluate_qualifications(opportunities, evaluators_by_type, compliance_rows)
+
+def qualification_completion_update(opportunity: dict, qualification: Dict[str, Any], user_id: str) -> Optional[dict]:
+    """Fields marking qualification as completed, or None when it is incomplete or already recorded"""
+    if (qualification["total_mandatory_rules"] > 0 and qualification["qualification_complete"]
+            and opportunity.get("qualification_status") != "completed"):
+        return {
+            "qualification_status": "completed",
+            "qualification_completed_at": datetime.now(timezone.utc),
+            "qualification_completed_by": user_id,
+            "updated_by": user_id,
+            "updated_at": datetime.now(timezone.utc)
+        }
+    return None
+
+async def record_qualification_completion(opportunity: dict, qualification: Dict[str, Any], user_id: str):
+    """Mark an opportunity's qualification as completed once every mandatory rule is met"""
+    update_data = qualification_completion_update(opportunity, qualification, user_id)
+    if update_data:
+        await db.opportunities.update_one({"id": opportunity["id"]}, {"$set": update_data})
+        publish_live_update("opportunities", opportunity["id"], "update", list(update_data))
+        await record_opportunity_audit(
+            opportunity["id"], "qualify", user_id, "Qualification completed",
+            before=opportunity, after=update_data
+        )
+
+# Bulk qualification status for pipeline boards
+BULK_QUALIFICATION_LIMIT = 1000
+BULK_QUALIFICATION_FILTER_FIELDS = ["opportunity_type", "current_stage_id", "opportunity_owner_id", "state", "company_id"]
+
+@api_router.post("/opportunities/qualification-status/bulk", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def bulk_check_qualification_status(request_data: dict, current_user: User = Depends(get_current_user)):
+    """Check qualification completion for many opportunities by id list or filter"""
+    try:
+        opportunity_ids = request_data.get("opportunity_ids")
+        filters = request_data.get("filter") or {}
+        
+        query = {"is_deleted": False}
+        if opportunity_ids:
+            if not isinstance(opportunity_ids, list):
+                raise HTTPException(status_code=400, detail="opportunity_ids must be a list")
+            if len(opportunity_ids) > BULK_QUALIFICATION_LIMIT:
+                raise HTTPException(status_code=400, detail=f"At most {BULK_QUALIFICATION_LIMIT} opportunities per request")
+            query["id"] = {"$in": opportunity_ids}
+        elif filters:
+            if not isinstance(filters, dict):
+                raise HTTPException(status_code=400, detail="filter must be an object")
+            unknown_fields = set(filters) - set(BULK_QUALIFICATION_FILTER_FIELDS)
+            if unknown_fields:
+                raise HTTPException(status_code=400, detail=f"Unsupported filter fields: {', '.join(sorted(unknown_fields))}")
+            for field, value in filters.items():
+                # Plain values or lists of plain values only; operator objects never reach the query
+                values = value if isinstance(value, list) else [value]
+                if any(isinstance(item, (dict, list)) for item in values):
+                    raise HTTPException(status_code=400, detail=f"Filter {field} must be a value or a list of values")
+                query[field] = {"$in": value} if isinstance(value, list) else value
+            
+            # Filter results are paged by opportunity id
+            cursor = request_data.get("cursor")
+            if cursor is not None:
+                if not isinstance(cursor, str):
+                    raise HTTPException(status_code=400, detail="cursor must be a string")
+                query["id"] = {"$gt": cursor}
+        else:
+            raise HTTPException(status_code=400, detail="Either opportunity_ids or filter is required")
+        
+        opportunities = await db.opportunities.find(query, {"_id": 0}).sort("id", 1).to_list(BULK_QUALIFICATION_LIMIT + 1)
+        truncated = len(opportunities) > BULK_QUALIFICATION_LIMIT
+        opportunities = opportunities[:BULK_QUALIFICATION_LIMIT]
+        qualifications = await evaluate_qualification_batch(opportunities)
+        
+        data = [
+            {"opportunity_id": opportunity["id"], **qualifications[opportunity["id"]]}
+            for opportunity in opportunities
+        ]
+        found_ids = {opportunity["id"] for opportunity in opportunities}
+        missing_ids = [opportunity_id for opportunity_id in (opportunity_ids or []) if opportunity_id not in found_ids]
+        
+        return APIResponse(success=True, message="Qualification status checked successfully", data={
+            "results": data,
+            "missing_opportunity_ids": missing_ids,
+            "truncated": truncated,
+            "next_cursor": opportunities[-1]["id"] if truncated else None
+        })
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Check qualification completion status
 @api_router.get("/opportunities/{opportunity_id}/qualification-status", response_model=APIResponse)
 @require_permission("/opportunities", "view")
@@ -8905,93 +11266,100 @@ async def check_qualification_status(opportunity_id: str, current_user: User = D
         if not opportunity:
             raise HTTPException(status_code=404, detail="Opportunity not found")
         
-        # Get all applicable rules
-        rules_cursor = db.qualification_rules.find({
-            "$or": [
-                {"opportunity_type": opportunity["opportunity_type"]},
-                {"opportunity_type": "Both"}
-            ],
-            "is_mandatory": True,
-            "is_active": True,
-            "is_deleted": False
-        })
-        
-        mandatory_rules = await rules_cursor.to_list(100)
-        total_mandatory = len(mandatory_rules)
-        
-        if total_mandatory == 0:
-            return APIResponse(success=True, message="No mandatory qualification rules", data={
-                "qualification_complete": True,
-                "completion_percentage": 100,
-                "compliant_rules": 0,
-                "total_mandatory_rules": 0,
-                "pending_rules": [],
-                "non_compliant_rules": []
-            })
-        
-        # Check compliance status for each mandatory rule
-        compliant_count = 0
-        pending_rules = []
-        non_compliant_rules = []
-        
-        for rule in mandatory_rules:
-            compliance = await db.opportunity_qualifications.find_one({
-                "opportunity_id": opportunity_id,
-                "rule_id": rule["id"],
-                "is_active": True
-            })
-            
-            if compliance:
-                status = compliance.get("compliance_status", "pending")
-                if status in ["compliant", "exempted"]:
-                    compliant_count += 1
-                elif status == "non_compliant":
-                    non_compliant_rules.append({
-                        "rule_code": rule["rule_code"],
-                        "rule_name": rule["rule_name"],
-                        "compliance_notes": compliance.get("compliance_notes", "")
-                    })
-                else:
-                    pending_rules.append({
-                        "rule_code": rule["rule_code"],
-                        "rule_name": rule["rule_name"]
-                    })
-            else:
-                pending_rules.append({
-                    "rule_code": rule["rule_code"],
-                    "rule_name": rule["rule_name"]
-                })
+        qualification = (await evaluate_qualification_batch([opportunity]))[opportunity_id]
         
-        completion_percentage = (compliant_count / total_mandatory) * 100 if total_mandatory > 0 else 100
-        qualification_complete = completion_percentage == 100
+        if qualification["total_mandatory_rules"] == 0:
+            return APIResponse(success=True, message="No mandatory qualification rules", data=qualification)
         
         # Update opportunity qualification status
-        if qualification_complete and opportunity.get("qualification_status") != "completed":
-            await db.opportunities.update_one(
-                {"id": opportunity_id},
-                {"$set": {
-                    "qualification_status": "completed",
-                    "qualification_completed_at": datetime.now(timezone.utc),
-                    "qualification_completed_by": current_user.id,
-                    "updated_by": current_user.id,
-                    "updated_at": datetime.now(timezone.utc)
-                }}
-            )
+        await record_qualification_completion(opportunity, qualification, current_user.id)
         
-        return APIResponse(success=True, message="Qualification status checked successfully", data={
-            "qualification_complete": qualification_complete,
-            "completion_percentage": round(completion_percentage, 2),
-            "compliant_rules": compliant_count,
-            "total_mandatory_rules": total_mandatory,
-            "pending_rules": pending_rules,
-            "non_compliant_rules": non_compliant_rules
-        })
+        return APIResponse(success=True, message="Qualification status checked successfully", data=qualification)
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def is_won_stage(stage: dict) -> bool:
+    return stage["stage_code"] in ["L6", "L5"] and stage["stage_name"] == "Won"
+
+def opportunity_version_query(opportunity: dict) -> dict:
+    """Match the opportunity only while it is unchanged since it was loaded for validation"""
+    return {
+        "id": opportunity["id"],
+        "is_deleted": False,
+        "current_stage_id": opportunity.get("current_stage_id"),
+        "updated_at": opportunity.get("updated_at")
+    }
+
+def stage_transition_events(opportunity: dict, target_stage: dict, update_data: dict, transition_data: dict, user_id: str,
+                            qualification_update: Optional[dict] = None, executive_override: bool = False,
+                            verb: str = "Transitioned") -> List[dict]:
+    """Outbox events for a validated stage transition; the single and bulk paths share them"""
+    opportunity_id = opportunity["id"]
+    events = []
+    
+    if executive_override:
+        events.append(build_outbox_event("opportunity.executive_override", opportunity_id, {
+            "activity_log": ActivityLog(
+                user_id=user_id,
+                action=f"Executive override for stage transition: {opportunity['opportunity_id']} - Qualification incomplete but overridden"
+            ).dict()
+        }, ["activity_log"]))
+    
+    if qualification_update:
+        events.append(build_outbox_event("opportunity.qualified", opportunity_id, {
+            "audit_event": build_opportunity_audit_event(
+                opportunity_id, "qualify", user_id, "Qualification completed",
+                before=opportunity, after=qualification_update
+            )
+        }, ["audit"]))
+    
+    stage_history = OpportunityStageHistory(
+        opportunity_id=opportunity_id,
+        from_stage_id=opportunity.get("current_stage_id"),
+        to_stage_id=target_stage["id"],
+        stage_name=target_stage["stage_name"],
+        transitioned_by=user_id,
+        transition_comments=transition_data.get("comments", ""),
+        pretender_lead_id=transition_data.get("pretender_lead_id"),
+        tender_lead_id=transition_data.get("tender_lead_id")
+    )
+    
+    stage_transition_msg = f"{verb} opportunity {opportunity['opportunity_id']} to {target_stage['stage_name']} ({target_stage['stage_code']})"
+    if transition_data.get("executive_override"):
+        stage_transition_msg += " [Executive Override]"
+    
+    # History, activity log and analytics updates run from the outbox; Won also initiates Service Delivery
+    handlers = ["stage_history", "activity_log", "audit", "kpi_snapshot", "competitor_analytics"]
+    if is_won_stage(target_stage):
+        handlers.append("service_delivery")
+    events.append(build_outbox_event("opportunity.stage_changed", opportunity_id, {
+        "before": outbox_opportunity_state(opportunity),
+        "after": outbox_opportunity_state({**opportunity, **update_data}),
+        "stage_history": stage_history.dict(),
+        "activity_log": ActivityLog(user_id=user_id, action=stage_transition_msg).dict(),
+        "audit_event": build_opportunity_audit_event(
+            opportunity_id, "transition", user_id, stage_transition_msg,
+            before=opportunity, after=update_data
+        ),
+        "user_id": user_id
+    }, handlers))
+    return events
+
+async def lock_won_opportunity_contacts(opportunity_ids: List[str], user_id: str, session=None):
+    # Contacts are locked in the same transaction as the move to Won
+    await db.opportunity_contacts.update_many(
+        {"opportunity_id": {"$in": opportunity_ids}, "is_deleted": False},
+        {"$set": {
+            "is_locked": True,
+            "locked_at": datetime.now(timezone.utc),
+            "locked_by": user_id
+        }},
+        session=session
+    )
+
 # Stage transition endpoint
 @api_router.put("/opportunities/{opportunity_id}/transition-stage", response_model=APIResponse)
 @require_permission("/opportunities", "edit")
@@ -9028,22 +11396,22 @@ async def transition_opportunity_stage(
             if not transition_data.get("force_backward", False):
                 raise HTTPException(status_code=400, detail="Backward stage transition not allowed without force flag")
         
+        # Side effects below are collected and written together with the stage change
+        qualification_update = None
+        executive_override = False
+        
         # 2. Check qualification completion for progression beyond L2/L1
         if target_stage["sequence_order"] > 2:  # Beyond initial qualification stages
-            qualification_status = await check_qualification_status(opportunity_id, current_user)
-            if not qualification_status.data["qualification_complete"]:
+            qualification = (await evaluate_qualification_batch([opportunity]))[opportunity_id]
+            qualification_update = qualification_completion_update(opportunity, qualification, current_user.id)
+            if not qualification["qualification_complete"]:
                 # Check for executive committee override
                 if not transition_data.get("executive_override", False):
                     raise HTTPException(
                         status_code=400, 
-                        detail=f"Qualification not complete ({qualification_status.data['completion_percentage']}%). Executive committee override required."
+                        detail=f"Qualification not complete ({qualification['completion_percentage']}%). Executive committee override required."
                     )
-                
-                # Log executive override
-                await log_activity(ActivityLog(
-                    user_id=current_user.id,
-                    action=f"Executive override for stage transition: {opportunity['opportunity_id']} - Qualification incomplete but overridden"
-                ))
+                executive_override = True
         
         # 3. Tender-specific validations for L5 (Commercial Evaluation)
         if (target_stage["stage_code"] == "L5" and 
@@ -9081,49 +11449,230 @@ async def transition_opportunity_stage(
                     detail="Minimum 2 decision makers required for Proposal/Commercial stages"
                 )
         
-        # 5. Lock contacts post-Won stage
-        if target_stage["stage_code"] in ["L6", "L5"] and target_stage["stage_name"] == "Won":
-            # Mark contacts as locked
-            await db.opportunity_contacts.update_many(
-                {"opportunity_id": opportunity_id, "is_deleted": False},
-                {"$set": {
-                    "is_locked": True,
-                    "locked_at": datetime.now(timezone.utc),
-                    "locked_by": current_user.id
-                }}
-            )
-        
         # Update opportunity stage
         update_data = {
             "current_stage_id": target_stage_id,
+            "current_stage_display_name": target_stage["stage_name"],
+            "current_stage_code": target_stage["stage_code"],
             "updated_by": current_user.id,
             "updated_at": datetime.now(timezone.utc)
         }
+        if qualification_update:
+            update_data.update(qualification_update)
+        events = stage_transition_events(
+            opportunity, target_stage, update_data, transition_data, current_user.id,
+            qualification_update=qualification_update, executive_override=executive_override
+        )
         
-        await db.opportunities.update_one({"id": opportunity_id}, {"$set": update_data})
+        # 5. Lock contacts post-Won stage
+        async def lock_opportunity_contacts(session):
+            await lock_won_opportunity_contacts([opportunity_id], current_user.id, session)
         
-        # Create stage history record
-        stage_history = OpportunityStageHistory(
-            opportunity_id=opportunity_id,
-            from_stage_id=opportunity.get("current_stage_id"),
-            to_stage_id=target_stage_id,
-            stage_name=target_stage["stage_name"],
-            transitioned_by=current_user.id,
-            transition_comments=transition_data.get("comments", ""),
-            pretender_lead_id=transition_data.get("pretender_lead_id"),
-            tender_lead_id=transition_data.get("tender_lead_id")
-        )
+        # Refuse to apply the transition over a concurrent change to the validated opportunity
+        if not await write_with_outbox(
+            db.opportunities, opportunity_version_query(opportunity), {"$set": update_data}, events,
+            related_writes=lock_opportunity_contacts if is_won_stage(target_stage) else None
+        ):
+            raise HTTPException(status_code=409, detail="Opportunity was modified concurrently, please reload and retry")
         
-        await db.opportunity_stage_history.insert_one(stage_history.dict())
+        return APIResponse(success=True, message=f"Opportunity transitioned to {target_stage['stage_name']} successfully")
         
-        # Log activity
-        stage_transition_msg = f"Transitioned opportunity {opportunity['opportunity_id']} to {target_stage['stage_name']} ({target_stage['stage_code']})"
-        if transition_data.get("executive_override"):
-            stage_transition_msg += " [Executive Override]"
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Bulk stage transitions and owner reassignment
+BULK_OPERATION_LIMIT = 500
+BULK_OPERATION_ACTIONS = ["transition", "reassign_owner"]
+
+@api_router.post("/opportunities/bulk-operations", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def bulk_opportunity_operations(request_data: dict, current_user: User = Depends(get_current_user)):
+    """Validate and apply a batch of stage transitions and owner reassignments"""
+    try:
+        operations = request_data.get("operations")
+        if not isinstance(operations, list) or not operations:
+            raise HTTPException(status_code=400, detail="operations must be a non-empty list")
+        if len(operations) > BULK_OPERATION_LIMIT:
+            raise HTTPException(status_code=400, detail=f"At most {BULK_OPERATION_LIMIT} operations per request")
+        if not all(isinstance(operation, dict) for operation in operations):
+            raise HTTPException(status_code=400, detail="Each operation must be an object")
+        
+        results = [
+            {"index": index, "opportunity_id": operation.get("opportunity_id"), "action": operation.get("action"), "success": False}
+            for index, operation in enumerate(operations)
+        ]
         
-        await log_activity(ActivityLog(user_id=current_user.id, action=stage_transition_msg))
+        # Load every referenced opportunity, stage, user and decision-maker count up front
+        opportunity_ids = list({operation.get("opportunity_id") for operation in operations if operation.get("opportunity_id")})
+        opportunities = await db.opportunities.find({"id": {"$in": opportunity_ids}, "is_deleted": False}, {"_id": 0}).to_list(None)
+        opportunities_by_id = {opportunity["id"]: opportunity for opportunity in opportunities}
+        
+        stage_map = await get_opportunity_stage_map()
+        if any(operation.get("target_stage_id") not in stage_map for operation in operations if operation.get("action") == "transition"):
+            stage_map = await get_opportunity_stage_map(refresh=True)
+        
+        referenced_user_ids = set()
+        for operation in operations:
+            for field in ["new_owner_id", "pretender_lead_id", "tender_lead_id"]:
+                if operation.get(field):
+                    referenced_user_ids.add(operation[field])
+        existing_users = await db.users.find({"id": {"$in": list(referenced_user_ids)}, "is_deleted": False}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+        existing_user_names = {user["id"]: user.get("name") for user in existing_users}
+        existing_user_ids = set(existing_user_names)
+        
+        decision_maker_counts = {
+            row["_id"]: row["count"]
+            for row in await db.opportunity_contacts.aggregate([
+                {"$match": {"opportunity_id": {"$in": opportunity_ids}, "is_decision_maker": True, "is_active": True, "is_deleted": False}},
+                {"$group": {"_id": "$opportunity_id", "count": {"$sum": 1}}}
+            ]).to_list(None)
+        }
         
-        return APIResponse(success=True, message=f"Opportunity transitioned to {target_stage['stage_name']} successfully")
+        qualification_candidates = [
+            opportunities_by_id[operation["opportunity_id"]] for operation in operations
+            if operation.get("action") == "transition"
+            and operation.get("opportunity_id") in opportunities_by_id
+            and stage_map.get(operation.get("target_stage_id"), {}).get("sequence_order", 0) > 2
+        ]
+        qualifications = await evaluate_qualification_batch(list({opp["id"]: opp for opp in qualification_candidates}.values()))
+        
+        # Validate each operation against the preloaded data
+        now = datetime.now(timezone.utc)
+        seen_opportunity_ids = set()
+        accepted = []
+        for result, operation in zip(results, operations):
+            opportunity = opportunities_by_id.get(operation.get("opportunity_id"))
+            action = operation.get("action")
+            
+            if action not in BULK_OPERATION_ACTIONS:
+                result["message"] = f"Unsupported action. Use one of: {', '.join(BULK_OPERATION_ACTIONS)}"
+                continue
+            if not opportunity:
+                result["message"] = "Opportunity not found"
+                continue
+            if opportunity["id"] in seen_opportunity_ids:
+                result["message"] = "Opportunity already has an operation in this batch"
+                continue
+            
+            if action == "reassign_owner":
+                new_owner_id = operation.get("new_owner_id")
+                if not new_owner_id or new_owner_id not in existing_user_ids:
+                    result["message"] = "New owner not found"
+                    continue
+                update_data = {
+                    "opportunity_owner_id": new_owner_id,
+                    "owner_name": existing_user_names[new_owner_id],
+                    "updated_by": current_user.id,
+                    "updated_at": now
+                }
+                action_msg = f"Bulk reassigned opportunity {opportunity['opportunity_id']} to owner {new_owner_id}"
+                events = [build_outbox_event("opportunity.owner_changed", opportunity["id"], {
+                    "before": outbox_opportunity_state(opportunity),
+                    "after": outbox_opportunity_state({**opportunity, **update_data}),
+                    "activity_log": ActivityLog(user_id=current_user.id, action=action_msg).dict(),
+                    "audit_event": build_opportunity_audit_event(
+                        opportunity["id"], "reassign", current_user.id, action_msg,
+                        before=opportunity, after=update_data
+                    )
+                }, ["activity_log", "audit", "kpi_snapshot", "competitor_analytics"])]
+                result["message"] = "Opportunity owner reassigned successfully"
+                accepted.append((result, opportunity, update_data, events, False))
+                seen_opportunity_ids.add(opportunity["id"])
+                continue
+            
+            # Stage transition rules mirror transition_opportunity_stage
+            if opportunity.get("state") == "Closed":
+                result["message"] = "Cannot transition closed opportunity"
+                continue
+            target_stage = stage_map.get(operation.get("target_stage_id"))
+            if not target_stage:
+                result["message"] = "Target stage not found"
+                continue
+            current_stage = stage_map.get(opportunity.get("current_stage_id"))
+            if current_stage and target_stage["sequence_order"] < current_stage["sequence_order"] and not operation.get("force_backward", False):
+                result["message"] = "Backward stage transition not allowed without force flag"
+                continue
+            
+            update_data = {
+                "current_stage_id": target_stage["id"],
+                "current_stage_display_name": target_stage["stage_name"],
+                "current_stage_code": target_stage["stage_code"],
+                "updated_by": current_user.id,
+                "updated_at": now
+            }
+            qualification = qualifications.get(opportunity["id"])
+            qualification_update = None
+            executive_override = False
+            if target_stage["sequence_order"] > 2 and qualification:
+                qualification_update = qualification_completion_update(opportunity, qualification, current_user.id)
+                if not qualification["qualification_complete"]:
+                    if not operation.get("executive_override", False):
+                        result["message"] = f"Qualification not complete ({qualification['completion_percentage']}%). Executive committee override required."
+                        continue
+                    executive_override = True
+            
+            if target_stage["stage_code"] == "L5" and opportunity["opportunity_type"] == "Tender":
+                if not operation.get("pretender_lead_id") or not operation.get("tender_lead_id"):
+                    result["message"] = "Pretender Lead and Tender Lead assignment required for Tender L5 stage"
+                    continue
+                if operation["pretender_lead_id"] not in existing_user_ids or operation["tender_lead_id"] not in existing_user_ids:
+                    result["message"] = "Invalid Pretender Lead or Tender Lead user"
+                    continue
+            
+            if target_stage["stage_code"] in ["L4", "L5"] and decision_maker_counts.get(opportunity["id"], 0) < 2:
+                result["message"] = "Minimum 2 decision makers required for Proposal/Commercial stages"
+                continue
+            
+            if qualification_update:
+                update_data.update(qualification_update)
+            events = stage_transition_events(
+                opportunity, target_stage, update_data, operation, current_user.id,
+                qualification_update=qualification_update, executive_override=executive_override, verb="Bulk transitioned"
+            )
+            result["message"] = f"Opportunity transitioned to {target_stage['stage_name']} successfully"
+            accepted.append((result, opportunity, update_data, events, is_won_stage(target_stage)))
+            seen_opportunity_ids.add(opportunity["id"])
+        
+        # Apply accepted operations with their outbox events in one transaction; each update is
+        # guarded by the version it was validated against so a concurrent change is not overwritten
+        async def apply_operations(session):
+            applied = []
+            for entry in accepted:
+                _, opportunity, update_data, _, _ = entry
+                update_result = await db.opportunities.update_one(
+                    opportunity_version_query(opportunity), {"$set": update_data}, session=session
+                )
+                if update_result.matched_count:
+                    applied.append(entry)
+            
+            won_opportunity_ids = [opportunity["id"] for _, opportunity, _, _, won in applied if won]
+            if won_opportunity_ids:
+                await lock_won_opportunity_contacts(won_opportunity_ids, current_user.id, session)
+            events = [event for _, _, _, operation_events, _ in applied for event in operation_events]
+            if events:
+                await db.outbox_events.insert_many(events, session=session)
+            return applied
+        
+        if accepted:
+            applied = await run_in_transaction(apply_operations)
+            applied_ids = {opportunity["id"] for _, opportunity, _, _, _ in applied}
+            for result, opportunity, update_data, _, _ in accepted:
+                if opportunity["id"] in applied_ids:
+                    result["success"] = True
+                    publish_live_update("opportunities", opportunity["id"], "update", list(update_data))
+                else:
+                    result["message"] = "Opportunity was modified concurrently, please reload and retry"
+            if applied:
+                _outbox_wakeup.set()
+        
+        succeeded = sum(1 for result in results if result["success"])
+        return APIResponse(
+            success=True,
+            message=f"Bulk operations completed: {succeeded} succeeded, {len(results) - succeeded} failed",
+            data={"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+        )
         
     except HTTPException:
         raise
@@ -9224,6 +11773,10 @@ async def create_opportunity_document(opportunity_id: str, document_data: dict,
         
         # Insert document
         await db.opportunity_documents.insert_one(document.dict())
+        await record_opportunity_audit(
+            opportunity_id, "create", current_user.id, f"Created document '{document.document_name}'",
+            subject_type="document", subject_id=document.id
+        )
         
         # Log activity
         await log_activity(ActivityLog(
@@ -9266,6 +11819,10 @@ async def update_opportunity_document(opportunity_id: str, document_id: str, doc
         
         # Update document
         await db.opportunity_documents.update_one({"id": document_id}, {"$set": document_data})
+        await record_opportunity_audit(
+            opportunity_id, "update", current_user.id, f"Updated document '{existing_doc['document_name']}'",
+            subject_type="document", subject_id=document_id, before=existing_doc, after=document_data
+        )
         
         # Log activity
         await log_activity(ActivityLog(
@@ -9360,6 +11917,10 @@ async def create_opportunity_clause(opportunity_id: str, clause_data: dict, curr
         
         # Insert clause
         await db.opportunity_clauses.insert_one(clause.dict())
+        await record_opportunity_audit(
+            opportunity_id, "create", current_user.id, f"Added {clause.clause_type} clause",
+            subject_type="clause", subject_id=clause.id
+        )
         
         # Log activity
         await log_activity(ActivityLog(
@@ -9442,6 +12003,10 @@ async def create_opportunity_important_date(opportunity_id: str, date_data: dict
         
         # Insert important date
         await db.opportunity_important_dates.insert_one(important_date.dict())
+        await record_opportunity_audit(
+            opportunity_id, "create", current_user.id, f"Added {important_date.date_type} date",
+            subject_type="important_date", subject_id=important_date.id
+        )
         
         # Log activity
         await log_activity(ActivityLog(
@@ -9564,6 +12129,10 @@ async def create_opportunity_won_details(opportunity_id: str, won_data: dict, cu
         
         # Insert won details
         await db.opportunity_won_details.insert_one(won_details.dict())
+        await record_opportunity_audit(
+            opportunity_id, "create", current_user.id, "Recorded won details",
+            subject_type="won_details", subject_id=won_details.id
+        )
         
         # Log activity
         await log_activity(ActivityLog(
@@ -9684,6 +12253,10 @@ async def create_opportunity_order_analysis(opportunity_id: str, analysis_data:
         
         # Insert order analysis
         await db.opportunity_order_analysis.insert_one(order_analysis.dict())
+        await record_opportunity_audit(
+            opportunity_id, "create", current_user.id, "Created order analysis",
+            subject_type="order_analysis", subject_id=order_analysis.id
+        )
         
         # Log activity
         await log_activity(ActivityLog(
@@ -9768,6 +12341,10 @@ async def create_sl_process_activity(opportunity_id: str, activity_data: dict, c
         
         # Insert SL activity
         await db.sl_process_tracking.insert_one(sl_activity.dict())
+        await record_opportunity_audit(
+            opportunity_id, "create", current_user.id, f"Added SL activity '{sl_activity.activity_name}'",
+            subject_type="sl_activity", subject_id=sl_activity.id
+        )
         
         # Log activity
         await log_activity(ActivityLog(
@@ -9784,64 +12361,103 @@ async def create_sl_process_activity(opportunity_id: str, activity_data: dict, c
 
 # ===== PHASE 4: GOVERNANCE & REPORTING APIs =====
 
+# ===== AUDIT TRAIL =====
+
+AUDIT_IGNORED_FIELDS = {"_id", "updated_at", "updated_by", "modified_by"}
+AUDIT_PAGE_SIZE = 50
+
+def audit_field_changes(before: Optional[dict], after: Optional[dict]) -> List[List[Any]]:
+    """Compact [field, old, new] diff of the fields written by an update"""
+    if not before or not after:
+        return []
+    return [
+        [field, before.get(field), value]
+        for field, value in after.items()
+        if field not in AUDIT_IGNORED_FIELDS and before.get(field) != value
+    ]
+
+def build_opportunity_audit_event(opportunity_id: str, action: str, user_id: str, summary: str,
+                                  subject_type: str = "opportunity", subject_id: Optional[str] = None,
+                                  before: Optional[dict] = None, after: Optional[dict] = None) -> dict:
+    return AuditEvent(
+        entity_type="opportunity",
+        entity_id=opportunity_id,
+        action=action,
+        subject_type=subject_type,
+        subject_id=subject_id or opportunity_id,
+        summary=summary,
+        changes=audit_field_changes(before, after),
+        user_id=user_id
+    ).dict()
+
+async def insert_new_opportunity(opportunity: dict, user_id: str, summary: str):
+    """Insert an opportunity and run every creation hook: live update, KPI snapshots, competitor analytics and audit"""
+    await db.opportunities.insert_one(await with_display_fields("opportunities", dict(opportunity)))
+    publish_live_update("opportunities", opportunity["id"], "insert")
+    await update_opportunity_kpi_snapshot(None, opportunity)
+    await apply_competitor_analytics_delta(None, opportunity)
+    await record_opportunity_audit(opportunity["id"], "create", user_id, summary)
+
+async def record_opportunity_audit(opportunity_id: str, action: str, user_id: str, summary: str, **kwargs):
+    """Append an event to the opportunity's audit stream"""
+    await db.audit_events.insert_one(build_opportunity_audit_event(opportunity_id, action, user_id, summary, **kwargs))
+
+def encode_audit_cursor(event: dict) -> str:
+    return base64.urlsafe_b64encode(f"{event['timestamp'].isoformat()}|{event['id']}".encode()).decode()
+
+def decode_audit_cursor(cursor: str):
+    try:
+        timestamp, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), event_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 # Enhanced Audit Trail
 @api_router.get("/opportunities/{opportunity_id}/audit-log", response_model=APIResponse)
 @require_permission("/opportunities", "view")
-async def get_opportunity_audit_log(opportunity_id: str, current_user: User = Depends(get_current_user)):
-    """Get comprehensive audit log for an opportunity"""
-    try:
-        # Verify opportunity exists
-        opportunity = await db.opportunities.find_one({"id": opportunity_id, "is_deleted": False})
-        if not opportunity:
-            raise HTTPException(status_code=404, detail="Opportunity not found")
-        
-        # Get audit logs with user enrichment
-        pipeline = [
-            {"$match": {"opportunity_id": opportunity_id}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "user_id",
-                "foreignField": "id",
-                "as": "user"
-            }},
-            {"$unwind": {"path": "$user", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "approved_by",
-                "foreignField": "id",
-                "as": "approver"
-            }},
-            {"$unwind": {"path": "$approver", "preserveNullAndEmptyArrays": True}},
-            {"$addFields": {
-                "user_name": "$user.name",
-                "user_email": "$user.email",
-                "approver_name": "$approver.name"
-            }},
-            {"$sort": {"action_timestamp": -1}}
-        ]
+async def get_opportunity_audit_log(
+    opportunity_id: str,
+    cursor: Optional[str] = None,
+    limit: int = AUDIT_PAGE_SIZE,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the audit stream for an opportunity, newest first, with cursor pagination"""
+    try:
+        # Verify opportunity exists
+        opportunity = await db.opportunities.find_one({"id": opportunity_id, "is_deleted": False}, {"opportunity_id": 1})
+        if not opportunity:
+            raise HTTPException(status_code=404, detail="Opportunity not found")
         
-        audit_cursor = db.opportunity_audit_log.aggregate(pipeline)
-        audit_logs = await audit_cursor.to_list(1000)
+        limit = max(1, min(limit, 200))
+        query = {"entity_type": "opportunity", "entity_id": opportunity_id}
+        if cursor:
+            timestamp, event_id = decode_audit_cursor(cursor)
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "id": {"$lt": event_id}}
+            ]
         
-        for log in audit_logs:
-            log.pop("_id", None)
-            log.pop("user", None)
-            log.pop("approver", None)
+        # Single range scan over the (entity_type, entity_id, timestamp, id) index
+        events = await db.audit_events.find(query, {"_id": 0}).sort(
+            [("timestamp", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
         
-        # Also get activity logs (existing system)
-        activity_logs = await db.activity_logs.find({
-            "action": {"$regex": opportunity.get("opportunity_id", ""), "$options": "i"}
-        }).sort("created_at", -1).to_list(100)
+        next_cursor = encode_audit_cursor(events[limit - 1]) if len(events) > limit else None
+        events = events[:limit]
         
-        for log in activity_logs:
-            log.pop("_id", None)
+        user_ids = list({event["user_id"] for event in events})
+        user_names = {}
+        if user_ids:
+            async for user in db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1}):
+                user_names[user["id"]] = user.get("name")
+        for event in events:
+            event["user_name"] = user_names.get(event["user_id"])
         
         audit_data = {
             "opportunity_id": opportunity_id,
             "opportunity_code": opportunity.get("opportunity_id"),
-            "detailed_audit_logs": audit_logs,
-            "activity_logs": activity_logs,
-            "total_audit_entries": len(audit_logs) + len(activity_logs)
+            "events": events,
+            "next_cursor": next_cursor
         }
         
         return APIResponse(success=True, message="Audit log retrieved successfully", data=audit_data)
@@ -9873,28 +12489,7 @@ async def get_opportunity_compliance(opportunity_id: str, current_user: User = D
         for record in compliance_records:
             record.pop("_id", None)
         
-        # Calculate compliance summary
-        total_rules = len(compliance_records)
-        compliant_rules = len([r for r in compliance_records if r.get("compliance_status") == "compliant"])
-        non_compliant_rules = len([r for r in compliance_records if r.get("compliance_status") == "non_compliant"])
-        pending_rules = len([r for r in compliance_records if r.get("compliance_status") == "pending"])
-        
-        compliance_score = (compliant_rules / total_rules * 100) if total_rules > 0 else 100
-        
-        # Identify high-risk areas
-        high_risk_items = [r for r in compliance_records if r.get("risk_level") in ["high", "critical"]]
-        
-        compliance_summary = {
-            "opportunity_id": opportunity_id,
-            "total_compliance_rules": total_rules,
-            "compliant_rules": compliant_rules,
-            "non_compliant_rules": non_compliant_rules,
-            "pending_rules": pending_rules,
-            "overall_compliance_score": round(compliance_score, 2),
-            "high_risk_items": len(high_risk_items),
-            "compliance_records": compliance_records,
-            "high_risk_details": high_risk_items
-        }
+        compliance_summary = summarize_opportunity_compliance(opportunity_id, compliance_records)
         
         return APIResponse(success=True, message="Compliance status retrieved successfully", data=compliance_summary)
         
@@ -9903,6 +12498,30 @@ async def get_opportunity_compliance(opportunity_id: str, current_user: User = D
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def summarize_opportunity_compliance(opportunity_id: str, compliance_records: List[dict]) -> Dict[str, Any]:
+    """Build the compliance summary returned for an opportunity"""
+    total_rules = len(compliance_records)
+    compliant_rules = len([r for r in compliance_records if r.get("compliance_status") == "compliant"])
+    non_compliant_rules = len([r for r in compliance_records if r.get("compliance_status") == "non_compliant"])
+    pending_rules = len([r for r in compliance_records if r.get("compliance_status") == "pending"])
+    
+    compliance_score = (compliant_rules / total_rules * 100) if total_rules > 0 else 100
+    
+    # Identify high-risk areas
+    high_risk_items = [r for r in compliance_records if r.get("risk_level") in ["high", "critical"]]
+    
+    return {
+        "opportunity_id": opportunity_id,
+        "total_compliance_rules": total_rules,
+        "compliant_rules": compliant_rules,
+        "non_compliant_rules": non_compliant_rules,
+        "pending_rules": pending_rules,
+        "overall_compliance_score": round(compliance_score, 2),
+        "high_risk_items": len(high_risk_items),
+        "compliance_records": compliance_records,
+        "high_risk_details": high_risk_items
+    }
+
 # Digital Signature Management
 @api_router.get("/opportunities/{opportunity_id}/digital-signatures", response_model=APIResponse)
 @require_permission("/opportunities", "view")
@@ -9946,18 +12565,7 @@ async def get_opportunity_digital_signatures(opportunity_id: str, current_user:
             signature.pop("signer", None)
             signature.pop("verifier", None)
         
-        # Summary statistics
-        total_signatures = len(signatures)
-        verified_signatures = len([s for s in signatures if s.get("is_verified")])
-        pending_verification = total_signatures - verified_signatures
-        
-        signature_summary = {
-            "opportunity_id": opportunity_id,
-            "total_signatures": total_signatures,
-            "verified_signatures": verified_signatures,
-            "pending_verification": pending_verification,
-            "signatures": signatures
-        }
+        signature_summary = summarize_digital_signatures(opportunity_id, signatures)
         
         return APIResponse(success=True, message="Digital signatures retrieved successfully", data=signature_summary)
         
@@ -9966,6 +12574,19 @@ async def get_opportunity_digital_signatures(opportunity_id: str, current_user:
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def summarize_digital_signatures(opportunity_id: str, signatures: List[dict]) -> Dict[str, Any]:
+    """Build the digital signature summary returned for an opportunity"""
+    total_signatures = len(signatures)
+    verified_signatures = len([s for s in signatures if s.get("is_verified")])
+    
+    return {
+        "opportunity_id": opportunity_id,
+        "total_signatures": total_signatures,
+        "verified_signatures": verified_signatures,
+        "pending_verification": total_signatures - verified_signatures,
+        "signatures": signatures
+    }
+
 @api_router.post("/opportunities/{opportunity_id}/digital-signatures", response_model=APIResponse)
 @require_permission("/opportunities", "edit")
 async def create_digital_signature(opportunity_id: str, signature_data: dict, current_user: User = Depends(get_current_user)):
@@ -9984,6 +12605,10 @@ async def create_digital_signature(opportunity_id: str, signature_data: dict, cu
         
         # Insert signature record
         await db.opportunity_digital_signatures.insert_one(digital_signature.dict())
+        await record_opportunity_audit(
+            opportunity_id, "create", current_user.id, "Recorded digital signature",
+            subject_type="digital_signature", subject_id=digital_signature.id
+        )
         
         # Log activity
         await log_activity(ActivityLog(
@@ -10029,6 +12654,10 @@ async def request_stage_approval(
         }
         
         result = await db.opportunity_approvals.insert_one(approval_request)
+        await record_opportunity_audit(
+            opportunity_id, "approval_request", current_user.id, f"Requested approval for stage {approval_request['requested_stage']}",
+            subject_type="approval", subject_id=approval_request["id"]
+        )
         
         # Send notification to managers (mock implementation)
         # In real implementation, this would send email/SMS notifications
@@ -10083,34 +12712,37 @@ async def update_opportunity_stage(
             update_data["final_value"] = form_data.get("final_value")
         elif stage_id in ["L7", "L8"]:  # Lost or Dropped
             update_data["state"] = "Closed"
+        update_data.update(await display_field_updates("opportunities", update_data))
         
-        await db.opportunities.update_one(
-            {"id": opportunity_id},
-            {"$set": update_data}
-        )
-        
-        # Record stage history
+        # Stage history
         stage_history = {
             "id": str(uuid.uuid4()),
             "opportunity_id": opportunity_id,
             "from_stage_id": opportunity.get("current_stage_id"),
             "to_stage_id": stage_id,
             "stage_name": stage_id,
-            "transition_date": datetime.now(timezone.utc),
+            "transition_date": update_data["updated_at"],
             "transitioned_by": current_user.id,
             "transition_comments": form_data.get("comments", ""),
             "form_data": form_data
         }
         
-        await db.opportunity_stage_history.insert_one(stage_history)
-        
-        # Auto-initiate Service Delivery if opportunity reaches L6 (Won)
+        # Side effects run from the outbox; Service Delivery is auto-initiated when reaching L6 (Won)
+        handlers = ["stage_history", "audit", "kpi_snapshot", "competitor_analytics"]
         if stage_id == "L6":
-            try:
-                await auto_initiate_service_delivery(opportunity_id, current_user.id)
-            except Exception as e:
-                # Log error but don't fail the stage update
-                print(f"Warning: Failed to auto-initiate Service Delivery for opportunity {opportunity_id}: {str(e)}")
+            handlers.append("service_delivery")
+        event = build_outbox_event("opportunity.stage_changed", opportunity_id, {
+            "before": outbox_opportunity_state(opportunity),
+            "after": outbox_opportunity_state({**opportunity, **update_data}),
+            "stage_history": stage_history,
+            "audit_event": build_opportunity_audit_event(
+                opportunity_id, "transition", current_user.id, f"Stage updated to {stage_id}",
+                before=opportunity, after=update_data
+            ),
+            "user_id": current_user.id
+        }, handlers)
+        
+        await write_with_outbox(db.opportunities, {"id": opportunity_id}, {"$set": update_data}, [event])
         
         return APIResponse(success=True, message="Stage updated successfully", data=update_data)
         
@@ -10300,6 +12932,184 @@ async def check_internal_cost_access(current_user: User = Depends(get_current_us
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ===== OPPORTUNITY 360 =====
+
+async def load_opportunity_360_stages(opportunity: dict) -> List[dict]:
+    return await db.opportunity_stages.find(
+        {"$or": [{"opportunity_type": opportunity["opportunity_type"]}, {"opportunity_type": "Shared"}], "is_deleted": False},
+        {"_id": 0}
+    ).sort("sequence_order", 1).to_list(100)
+
+async def load_opportunity_360_stage_history(opportunity: dict) -> List[dict]:
+    return await db.opportunity_stage_history.find(
+        {"opportunity_id": opportunity["id"], "is_active": True}, {"_id": 0}
+    ).sort("transition_date", 1).to_list(100)
+
+async def load_opportunity_360_documents(opportunity: dict) -> List[dict]:
+    return await db.opportunity_documents.aggregate([
+        {"$match": {"opportunity_id": opportunity["id"], "is_deleted": False}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": 100},
+        {"$lookup": {
+            "from": "master_document_types",
+            "localField": "document_type_id",
+            "foreignField": "document_type_id",
+            "as": "document_type"
+        }},
+        {"$unwind": {"path": "$document_type", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {"document_type_name": "$document_type.document_type_name"}},
+        {"$project": {"_id": 0, "document_type": 0}}
+    ]).to_list(100)
+
+async def load_opportunity_360_clauses(opportunity: dict) -> List[dict]:
+    return await db.opportunity_clauses.aggregate([
+        {"$match": {"opportunity_id": opportunity["id"], "is_deleted": False}},
+        {"$sort": {"created_at": 1}},
+        {"$limit": 100},
+        {"$lookup": {
+            "from": "opportunity_documents",
+            "localField": "evidence_document_id",
+            "foreignField": "id",
+            "as": "evidence_document"
+        }},
+        {"$unwind": {"path": "$evidence_document", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {"evidence_document_name": "$evidence_document.document_name"}},
+        {"$project": {"_id": 0, "evidence_document": 0}}
+    ]).to_list(100)
+
+async def load_opportunity_360_important_dates(opportunity: dict) -> List[dict]:
+    return await db.opportunity_important_dates.find(
+        {"opportunity_id": opportunity["id"], "is_deleted": False}, {"_id": 0}
+    ).sort("date_value", 1).to_list(100)
+
+async def load_opportunity_360_won_details(opportunity: dict) -> Optional[dict]:
+    won_details = await db.opportunity_won_details.aggregate([
+        {"$match": {"opportunity_id": opportunity["id"], "is_deleted": False}},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "master_currencies",
+            "localField": "currency_id",
+            "foreignField": "currency_id",
+            "as": "currency"
+        }},
+        {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {"currency_code": "$currency.currency_code", "currency_symbol": "$currency.symbol"}},
+        {"$project": {"_id": 0, "currency": 0}}
+    ]).to_list(1)
+    return won_details[0] if won_details else None
+
+async def load_opportunity_360_order_analysis(opportunity: dict) -> Optional[dict]:
+    return await db.opportunity_order_analysis.find_one(
+        {"opportunity_id": opportunity["id"], "is_deleted": False}, {"_id": 0}
+    )
+
+async def load_opportunity_360_sl_tracking(opportunity: dict) -> List[dict]:
+    return await db.sl_process_tracking.aggregate([
+        {"$match": {"opportunity_id": opportunity["id"], "is_deleted": False}},
+        {"$sort": {"created_at": 1}},
+        {"$limit": 100},
+        {"$lookup": {
+            "from": "opportunity_stages",
+            "localField": "stage_id",
+            "foreignField": "id",
+            "as": "stage"
+        }},
+        {"$unwind": {"path": "$stage", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {"stage_name": "$stage.stage_name", "stage_code": "$stage.stage_code"}},
+        {"$project": {"_id": 0, "stage": 0}}
+    ]).to_list(100)
+
+async def load_opportunity_360_compliance(opportunity: dict) -> Dict[str, Any]:
+    compliance_records = await db.opportunity_compliance.find(
+        {"opportunity_id": opportunity["id"], "is_deleted": False}, {"_id": 0}
+    ).sort("created_at", -1).to_list(100)
+    return summarize_opportunity_compliance(opportunity["id"], compliance_records)
+
+async def load_opportunity_360_digital_signatures(opportunity: dict) -> Dict[str, Any]:
+    signatures = await db.opportunity_digital_signatures.find(
+        {"opportunity_id": opportunity["id"], "is_active": True}, {"_id": 0}
+    ).sort("signed_at", -1).to_list(100)
+    return summarize_digital_signatures(opportunity["id"], signatures)
+
+async def load_opportunity_360_quotations(opportunity: dict) -> List[dict]:
+    quotations = await db.quotations.find(
+        {"opportunity_id": opportunity["id"], "is_deleted": False}
+    ).sort("created_at", -1).to_list(1000)
+    attach_quotation_calculated_totals(quotations)
+    return quotations
+
+# Sub-resource -> (loader, records key inside summary objects, [(user id field, name field)])
+OPPORTUNITY_360_RESOURCES = {
+    "stages": (load_opportunity_360_stages, None, []),
+    "stage_history": (load_opportunity_360_stage_history, None, [("transitioned_by", "transitioned_by_name")]),
+    "documents": (load_opportunity_360_documents, None, [("created_by", "created_by_name"), ("approved_by", "approved_by_name")]),
+    "clauses": (load_opportunity_360_clauses, None, [("reviewed_by", "reviewed_by_name")]),
+    "important_dates": (load_opportunity_360_important_dates, None, [("created_by", "created_by_name")]),
+    "won_details": (load_opportunity_360_won_details, None, [("signed_by", "signed_by_name"), ("approved_by", "approved_by_name")]),
+    "order_analysis": (load_opportunity_360_order_analysis, None, [
+        ("reviewed_by_sales_ops", "sales_ops_reviewer_name"),
+        ("reviewed_by_sales_manager", "sales_manager_reviewer_name"),
+        ("approved_by_sales_head", "sales_head_approver_name"),
+        ("final_approved_by", "final_approver_name")
+    ]),
+    "sl_tracking": (load_opportunity_360_sl_tracking, None, [("assigned_to", "assigned_to_name")]),
+    "compliance": (load_opportunity_360_compliance, None, []),
+    "digital_signatures": (load_opportunity_360_digital_signatures, "signatures", [("signer_id", "signer_full_name"), ("verified_by", "verifier_name")]),
+    "quotations": (load_opportunity_360_quotations, None, [])
+}
+
+def opportunity_360_records(value: Any, records_key: Optional[str]) -> List[dict]:
+    """Flatten a loaded sub-resource into the records that need user names"""
+    if value is None:
+        return []
+    if records_key:
+        return value.get(records_key, [])
+    return value if isinstance(value, list) else [value]
+
+@api_router.get("/opportunities/{opportunity_id}/360", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def get_opportunity_360(opportunity_id: str, include: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Get an opportunity together with the selected sub-resources in one call.
+    
+    `include` is a comma-separated list of sub-resources (all when omitted). The opportunity
+    is verified once, sub-resources load concurrently and user names are resolved in one query.
+    """
+    try:
+        selected = [name.strip() for name in include.split(",") if name.strip()] if include else list(OPPORTUNITY_360_RESOURCES)
+        unknown = [name for name in selected if name not in OPPORTUNITY_360_RESOURCES]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown include values: {', '.join(unknown)}")
+        
+        opportunities = await db.opportunities.aggregate(opportunity_detail_pipeline(opportunity_id)).to_list(1)
+        if not opportunities:
+            raise HTTPException(status_code=404, detail="Opportunity not found")
+        opportunity = opportunities[0]
+        
+        loaded = await asyncio.gather(*(OPPORTUNITY_360_RESOURCES[name][0](opportunity) for name in selected))
+        result = dict(zip(selected, loaded))
+        
+        # Resolve every referenced user name with a single query
+        name_targets = []
+        for name in selected:
+            _, records_key, user_fields = OPPORTUNITY_360_RESOURCES[name]
+            for record in opportunity_360_records(result[name], records_key):
+                name_targets.extend((record, id_field, name_field) for id_field, name_field in user_fields)
+        
+        user_ids = {record.get(id_field) for record, id_field, _ in name_targets if record.get(id_field)}
+        user_names = {}
+        if user_ids:
+            async for user in db.users.find({"id": {"$in": list(user_ids)}}, {"_id": 0, "id": 1, "name": 1}):
+                user_names[user["id"]] = user.get("name")
+        for record, id_field, name_field in name_targets:
+            record[name_field] = user_names.get(record.get(id_field))
+        
+        return APIResponse(success=True, message="Opportunity 360 retrieved successfully", data={"opportunity": opportunity, **result})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ===== SERVICE DELIVERY (SD) MODULE APIs =====
 
 # Auto-initiation trigger for L6 opportunities
@@ -10336,7 +13146,20 @@ async def auto_initiate_service_delivery(opportunity_id: str, user_id: str):
             created_by=user_id
         )
         
-        await db.service_delivery_requests.insert_one(sdr.dict())
+        # Upsert on the open SDR of the opportunity so a replayed event cannot create a second one
+        document = await with_display_fields("service_delivery_requests", {**sdr.dict(), "company_id": opportunity.get("company_id")})
+        document.pop("opportunity_id")
+        document.pop("is_deleted")
+        try:
+            result = await db.service_delivery_requests.update_one(
+                {"opportunity_id": opportunity_id, "is_deleted": False}, {"$setOnInsert": document}, upsert=True
+            )
+        except DuplicateKeyError:
+            result = None
+        if result is None or result.upserted_id is None:
+            existing_sdr = await db.service_delivery_requests.find_one({"opportunity_id": opportunity_id, "is_deleted": False})
+            return {"message": "Service Delivery Request already exists", "sdr_id": existing_sdr["id"] if existing_sdr else None}
+        publish_live_update("service_delivery_requests", sdr.id, "insert")
         
         # Log the auto-initiation
         log_entry = ServiceDeliveryLog(
@@ -10370,118 +13193,10 @@ async def auto_initiate_service_delivery(opportunity_id: str, user_id: str):
 async def get_upcoming_projects(current_user: User = Depends(get_current_user)):
     """Get all opportunities from enhanced-opportunities data source for service delivery pipeline"""
     try:
-        # Use the same data source as enhanced-opportunities
-        opportunities = await db.opportunities.find({
-            "is_deleted": False
-        }).sort("created_at", -1).to_list(1000)
-        
-        enriched_items = []
-        
-        for opportunity in opportunities:
-            # Check if there's an existing SDR for this opportunity
-            existing_sdr = await db.service_delivery_requests.find_one({
-                "opportunity_id": opportunity["id"],
-                "is_deleted": False
-            })
-            
-            # Get sales owner data using the same field names as enhanced-opportunities
-            sales_owner = None
-            if opportunity.get("opportunity_owner_id"):
-                sales_owner = await db.users.find_one({"id": opportunity["opportunity_owner_id"], "is_deleted": False})
-            
-            # Get latest quotation (approved if available, otherwise latest)
-            approved_quotation = await db.quotations.find_one({
-                "opportunity_id": opportunity["id"],
-                "status": "Approved",
-                "is_deleted": False
-            })
-            
-            if not approved_quotation:
-                # Get latest quotation regardless of status
-                latest_quotation = await db.quotations.find_one({
-                    "opportunity_id": opportunity["id"],
-                    "is_deleted": False
-                }, sort=[("created_at", -1)])
-                approved_quotation = latest_quotation
-            
-            # Determine item type and status
-            if existing_sdr:
-                item_type = "service_delivery_request"
-                item_status = existing_sdr.get("project_status", "Upcoming")
-                approval_status = existing_sdr.get("approval_status", "Pending")
-                sdr_id = existing_sdr["id"]
-                sd_request_id = existing_sdr.get("sd_request_id", "")
-            else:
-                item_type = "sales_opportunity"
-                item_status = "In Sales Process"
-                approval_status = "N/A"
-                sdr_id = None
-                sd_request_id = ""
-            
-            # Use the same stage mapping as enhanced-opportunities
-            stage_id = opportunity.get("current_stage_name", "L1")  # Enhanced opportunities uses current_stage_name
-            
-            # Pipeline stages mapping (same as enhanced-opportunities)
-            pipeline_stages = {
-                'L1': {'name': 'Prospect', 'probability': 10},
-                'L2': {'name': 'Qualification', 'probability': 25},
-                'L3': {'name': 'Proposal/Bid', 'probability': 40},
-                'L4': {'name': 'Technical Qualification', 'probability': 60},
-                'L5': {'name': 'Commercial Negotiations', 'probability': 75},
-                'L6': {'name': 'Won', 'probability': 100},
-                'L7': {'name': 'Lost', 'probability': 0},
-                'L8': {'name': 'Dropped', 'probability': 0}
-            }
-            
-            stage_info = pipeline_stages.get(stage_id, {'name': 'Prospect', 'probability': 10})
-            stage_name = stage_info['name']
-            probability = stage_info['probability']
-            
-            # Calculate estimated delivery date based on stage
-            estimated_delivery_date = None
-            if stage_id in ["L6", "L7", "L8"]:
-                # For won/lost/dropped opportunities, estimate based on close date
-                close_date = opportunity.get("expected_closure_date")  # Enhanced opportunities uses expected_closure_date
-                if close_date:
-                    from datetime import datetime, timedelta
-                    try:
-                        close_dt = datetime.fromisoformat(close_date.replace('Z', '+00:00'))
-                        estimated_delivery_date = (close_dt + timedelta(days=30)).strftime('%Y-%m-%d')
-                    except:
-                        pass
-            
-            # Use the same field names as enhanced-opportunities
-            enriched_item = {
-                "id": sdr_id or opportunity["id"],
-                "sd_request_id": sd_request_id,
-                "opportunity_id": opportunity["id"],
-                "opportunity_title": opportunity.get("opportunity_title", ""),
-                "opportunity_value": opportunity.get("expected_revenue", 0),  # Enhanced opportunities uses expected_revenue
-                "client_name": opportunity.get("company_name", ""),
-                "sales_owner_name": sales_owner.get("name", "Unassigned") if sales_owner else "Unassigned",
-                "sales_owner_id": opportunity.get("opportunity_owner_id"),
-                "quotation_id": approved_quotation.get("quotation_number", "") if approved_quotation else "",
-                "quotation_total": approved_quotation.get("grand_total", 0) if approved_quotation else 0,
-                "quotation_status": approved_quotation.get("status", "") if approved_quotation else "",
-                "current_stage_id": stage_id,
-                "current_stage_name": stage_name,
-                "probability": probability,
-                "opportunity_type": opportunity.get("opportunity_type", ""),
-                "state": opportunity.get("state", "Open"),
-                "item_type": item_type,
-                "project_status": item_status,
-                "approval_status": approval_status,
-                "estimated_delivery_date": estimated_delivery_date,
-                "expected_close_date": opportunity.get("expected_closure_date"),
-                "created_at": existing_sdr.get("created_at") if existing_sdr else opportunity.get("created_at"),
-                "priority": "High" if stage_id in ["L5", "L6"] else "Medium" if stage_id in ["L3", "L4"] else "Low"
-            }
-            
-            enriched_items.append(enriched_item)
-        
-        # Sort by priority and stage progression (same as enhanced-opportunities logic)
-        stage_order = {"L6": 1, "L5": 2, "L4": 3, "L3": 4, "L2": 5, "L1": 6, "L7": 7, "L8": 8}
-        enriched_items.sort(key=lambda x: (stage_order.get(x["current_stage_id"], 99), x["created_at"]))
+        # Served from the sd_upcoming_view read model, sorted by priority and stage progression
+        enriched_items = await db.sd_upcoming_view.find(
+            {}, {"_id": 0, "projected_at": 0, "stage_rank": 0}
+        ).sort([("stage_rank", 1), ("created_at", 1)]).to_list(1000)
         
         return APIResponse(
             success=True,
@@ -10522,35 +13237,9 @@ async def get_project_review_details(sdr_id: str, current_user: User = Depends(g
         # Get quotation details (phases, groups, items)
         quotation_details = None
         if approved_quotation:
-            phases = await db.quotation_phases.find({
-                "quotation_id": approved_quotation["id"],
-                "is_deleted": False
-            }).to_list(100)
-            
-            for phase in phases:
-                phase.pop("_id", None)
-                groups = await db.quotation_groups.find({
-                    "phase_id": phase["id"],
-                    "is_deleted": False
-                }).to_list(100)
-                
-                for group in groups:
-                    group.pop("_id", None)
-                    items = await db.quotation_items.find({
-                        "group_id": group["id"],
-                        "is_deleted": False
-                    }).to_list(100)
-                    
-                    for item in items:
-                        item.pop("_id", None)
-                    
-                    group["items"] = items
-                
-                phase["groups"] = groups
-            
             quotation_details = {
                 **approved_quotation,
-                "phases": phases
+                "phases": await load_quotation_hierarchy(approved_quotation["id"])
             }
             quotation_details.pop("_id", None)
         
@@ -10616,6 +13305,7 @@ async def convert_to_project(sdr_id: str, current_user: User = Depends(get_curre
             {"id": sdr_id},
             {"$set": update_data}
         )
+        publish_live_update("service_delivery_requests", sdr_id, "update", list(update_data))
         
         # Create approval record
         approval = ServiceDeliveryApproval(
@@ -10678,6 +13368,7 @@ async def reject_opportunity(sdr_id: str, rejection_data: dict, current_user: Us
             {"id": sdr_id},
             {"$set": update_data}
         )
+        publish_live_update("service_delivery_requests", sdr_id, "update", list(update_data))
         
         # Create rejection record
         approval = ServiceDeliveryApproval(
@@ -10729,15 +13420,10 @@ async def get_active_projects(current_user: User = Depends(get_current_user)):
             # Enrich with opportunity data
             opportunity = await db.opportunities.find_one({"id": project["opportunity_id"], "is_deleted": False})
             
-            # Enrich with delivery owner
-            delivery_owner = None
-            if project.get("delivery_owner_id"):
-                delivery_owner = await db.users.find_one({"id": project["delivery_owner_id"], "is_deleted": False})
-            
             enriched_project = {
                 **project,
                 "opportunity_title": opportunity.get("opportunity_title", "") if opportunity else "",
-                "delivery_owner_name": delivery_owner.get("name", "Unassigned") if delivery_owner else "Unassigned"
+                "delivery_owner_name": project.get("delivery_owner_name") or "Unassigned"
             }
             
             enriched_project.pop("_id", None)
@@ -12022,6 +14708,42 @@ async def calculate_what_if_analysis(
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to calculate what-if analysis. Try again.")
 
+PNL_EXPORT_COLUMNS = [
+    ("sr_no", "Sr No"), ("phase", "Phase"), ("product_name", "Product"), ("sku_code", "SKU"), ("qty", "Qty"),
+    ("unit", "Unit"), ("cost_per_unit", "Cost / Unit"), ("total_cost", "Total Cost"),
+    ("price_list_per_unit", "List Price / Unit"), ("selling_rate_per_unit", "Selling Rate / Unit"),
+    ("discount_percentage", "Discount %"), ("total_selling_price", "Total Selling Price")
+]
+
+def write_pnl_workbook(path: str, opportunity: dict, analysis: dict):
+    """Write a profitability analysis as an Excel workbook (line items, phase totals and summary)"""
+    workbook = Workbook()
+    bold = Font(bold=True)
+    
+    items = workbook.active
+    items.title = "PnL"
+    items.append([f"{opportunity.get('opportunity_id', '')} - {opportunity.get('opportunity_title', '')}"])
+    items["A1"].font = Font(bold=True, size=14)
+    items.append([])
+    items.append([label for _, label in PNL_EXPORT_COLUMNS])
+    for cell in items[3]:
+        cell.font = bold
+    for item in analysis["items"]:
+        items.append([item.get(field) for field, _ in PNL_EXPORT_COLUMNS])
+    items.append([None] * (len(PNL_EXPORT_COLUMNS) - 2) + ["Grand Total", analysis["grand_total"]])
+    items.cell(row=items.max_row, column=len(PNL_EXPORT_COLUMNS) - 1).font = bold
+    
+    summary = workbook.create_sheet("Summary")
+    for field, value in analysis["summary"].items():
+        summary.append([field.replace("_", " ").title(), value])
+    summary.append([])
+    summary.append(["Phase", "Total Selling Price"])
+    for phase, total in analysis["phase_totals"].items():
+        summary.append([phase, total])
+    summary.column_dimensions["A"].width = 32
+    
+    workbook.save(path)
+
 # Export PnL template
 @api_router.get("/opportunities/{opportunity_id}/profitability/export", response_model=APIResponse)
 @require_permission("/opportunities", "view")
@@ -12135,6 +14857,77 @@ async def get_quotations(current_user: User = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def load_quotation_hierarchy(quotation_id: str) -> List[dict]:
+    """Load a quotation's phases with nested groups and items using one query per level"""
+    phases = await db.quotation_phases.find(
+        {"quotation_id": quotation_id, "is_deleted": False}, {"_id": 0}
+    ).sort("phase_order", 1).to_list(None)
+    
+    groups = await db.quotation_groups.find(
+        {"phase_id": {"$in": [phase["id"] for phase in phases]}, "is_deleted": False}, {"_id": 0}
+    ).sort("group_order", 1).to_list(None) if phases else []
+    
+    items = await db.quotation_items.find(
+        {"group_id": {"$in": [group["id"] for group in groups]}, "is_deleted": False}, {"_id": 0}
+    ).sort("item_order", 1).to_list(None) if groups else []
+    
+    # Results are already ordered, so appending preserves order within each parent
+    items_by_group: Dict[str, List[dict]] = {}
+    for item in items:
+        items_by_group.setdefault(item["group_id"], []).append(item)
+    groups_by_phase: Dict[str, List[dict]] = {}
+    for group in groups:
+        group["items"] = items_by_group.get(group["id"], [])
+        groups_by_phase.setdefault(group["phase_id"], []).append(group)
+    for phase in phases:
+        phase["groups"] = groups_by_phase.get(phase["id"], [])
+    return phases
+
+# Parent collection -> child collections and the field holding the parent id
+SOFT_DELETE_HIERARCHY: Dict[str, List[tuple]] = {
+    "quotations": [
+        ("quotation_phases", "quotation_id"),
+        ("quotation_attachments", "quotation_id"),
+        ("quotation_approvals", "quotation_id"),
+        ("customer_quotation_access", "quotation_id")
+    ],
+    "quotation_phases": [("quotation_groups", "phase_id")],
+    "quotation_groups": [("quotation_items", "group_id")],
+    "quotation_items": [("quotation_item_yearly", "item_id")]
+}
+
+async def cascade_soft_delete(collection_name: str, ids: List[str], deleted_by: str) -> Dict[str, int]:
+    """Soft delete records and every descendant with one update_many per collection.
+    
+    Descendant ids are resolved level by level (one distinct per parent level) before
+    anything is written, then all updates run in a single transaction where available.
+    Rows that were already deleted keep their original deletion metadata.
+    """
+    active = {"is_deleted": {"$ne": True}}
+    targets = [(collection_name, "id", list(ids))]
+    frontier = [(collection_name, list(ids))]
+    while frontier:
+        parent_name, parent_ids = frontier.pop(0)
+        for child_name, parent_field in SOFT_DELETE_HIERARCHY.get(parent_name, []):
+            targets.append((child_name, parent_field, parent_ids))
+            if child_name in SOFT_DELETE_HIERARCHY and parent_ids:
+                child_ids = await db[child_name].distinct("id", {parent_field: {"$in": parent_ids}, **active})
+                frontier.append((child_name, child_ids))
+    
+    now = datetime.now(timezone.utc)
+    update = {"$set": {"is_deleted": True, "deleted_by": deleted_by, "deleted_at": now, "updated_at": now}}
+    
+    async def apply(session):
+        counts: Dict[str, int] = {}
+        for target_name, field, target_ids in targets:
+            if not target_ids:
+                continue
+            result = await db[target_name].update_many({field: {"$in": target_ids}, **active}, update, session=session)
+            counts[target_name] = counts.get(target_name, 0) + result.modified_count
+        return counts
+    
+    return await run_in_transaction(apply)
+
 @api_router.get("/quotations/{quotation_id}", response_model=APIResponse)
 @require_permission("/opportunities", "view")
 async def get_quotation(quotation_id: str, current_user: User = Depends(get_current_user)):
@@ -12145,32 +14938,8 @@ async def get_quotation(quotation_id: str, current_user: User = Depends(get_curr
         if not quotation:
             raise HTTPException(status_code=404, detail="Quotation not found")
         
-        # Get phases
-        phases = await db.quotation_phases.find({"quotation_id": quotation_id, "is_deleted": False}).to_list(100)
-        
-        for phase in phases:
-            # Get groups for each phase
-            groups = await db.quotation_groups.find({"phase_id": phase["id"], "is_deleted": False}).to_list(100)
-            
-            for group in groups:
-                # Get items for each group
-                items = await db.quotation_items.find({"group_id": group["id"], "is_deleted": False}).to_list(100)
-                # Remove MongoDB _id from items
-                for item in items:
-                    item.pop("_id", None)
-                group["items"] = items
-            
-            # Remove MongoDB _id from groups
-            for group in groups:
-                group.pop("_id", None)
-            phase["groups"] = groups
-        
-        # Remove MongoDB _id from phases
-        for phase in phases:
-            phase.pop("_id", None)
-        
-        # Add phases to quotation
-        quotation["phases"] = phases
+        # Add phases, groups and items to quotation
+        quotation["phases"] = await load_quotation_hierarchy(quotation_id)
         quotation.pop("_id", None)
         
         return APIResponse(success=True, message="Quotation retrieved successfully", data=quotation)
@@ -12196,34 +14965,7 @@ async def get_opportunity_quotations(opportunity_id: str, current_user: User = D
             "is_deleted": False
         }).sort("created_at", -1).to_list(1000)
         
-        # Calculate totals for each quotation
-        for quotation in quotations:
-            # Calculate totals from phases
-            phases = await db.quotation_phases.find({
-                "quotation_id": quotation["id"], 
-                "is_deleted": False
-            }).to_list(100)
-            
-            total_otp = sum(phase.get("phase_total_otp", 0) for phase in phases)
-            total_recurring = sum(phase.get("phase_total_year1", 0) for phase in phases)
-            total_tenure_recurring = sum(
-                phase.get("phase_total_year1", 0) + phase.get("phase_total_year2", 0) + 
-                phase.get("phase_total_year3", 0) + phase.get("phase_total_year4", 0) +
-                phase.get("phase_total_year5", 0) + phase.get("phase_total_year6", 0) +
-                phase.get("phase_total_year7", 0) + phase.get("phase_total_year8", 0) +
-                phase.get("phase_total_year9", 0) + phase.get("phase_total_year10", 0)
-                for phase in phases
-            )
-            grand_total = total_otp + total_tenure_recurring
-            
-            # Add calculated totals to quotation
-            quotation["calculated_otp"] = total_otp
-            quotation["calculated_recurring"] = total_recurring
-            quotation["calculated_tenure_recurring"] = total_tenure_recurring
-            quotation["calculated_grand_total"] = grand_total
-            
-            # Remove MongoDB _id field
-            quotation.pop("_id", None)
+        attach_quotation_calculated_totals(quotations)
         
         return APIResponse(
             success=True, 
@@ -12235,6 +14977,262 @@ async def get_opportunity_quotations(opportunity_id: str, current_user: User = D
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def attach_quotation_calculated_totals(quotations: List[dict]):
+    """Expose the rolled-up header totals under the calculated_* names the UI reads"""
+    for quotation in quotations:
+        yearly_totals = [quotation.get(f"total_year{year}") or 0 for year in range(1, QUOTATION_YEARS + 1)]
+        quotation["calculated_otp"] = quotation.get("total_otp") or 0
+        quotation["calculated_recurring"] = yearly_totals[0]
+        quotation["calculated_tenure_recurring"] = sum(yearly_totals)
+        quotation["calculated_grand_total"] = quotation.get("grand_total") or 0
+        
+        # Remove MongoDB _id field
+        quotation.pop("_id", None)
+
+# Quotation totals engine: OTP plus ten contract years, rolled up item -> group -> phase -> quotation
+QUOTATION_YEARS = 10
+QUOTATION_TOTAL_COLUMNS = ["otp"] + [f"year{year}" for year in range(1, QUOTATION_YEARS + 1)]
+QUOTATION_ITEM_TOTAL_FIELDS = [
+    "id", "group_id", "quantity", "base_otp", "base_recurring", "discount_type", "discount_value",
+    "contract_duration_months", "net_otp", "net_recurring", "line_total_otp", "line_total_recurring",
+    "yearly_allocations"
+]
+# Totals owned by the engine; clients cannot write them directly
+QUOTATION_COMPUTED_FIELDS = {
+    "phase": [f"phase_total_{column}" for column in QUOTATION_TOTAL_COLUMNS] + ["phase_grand_total"],
+    "group": [f"group_total_{column}" for column in QUOTATION_TOTAL_COLUMNS] + ["group_grand_total"],
+    "item": ["net_otp", "net_recurring", "line_total_otp", "line_total_recurring", "yearly_allocations"]
+}
+QUOTATION_BULK_ITEM_LIMIT = 5000
+QUOTATION_YEARLY_MIGRATION_BATCH_SIZE = 500
+
+def discount_factors(discount_types: List[Optional[str]], discount_values: List[Optional[float]], gross_totals: np.ndarray) -> np.ndarray:
+    """Multipliers for percentage or absolute discounts; absolute amounts are spread pro rata"""
+    types = np.array(discount_types, dtype=object)
+    values = np.array([value or 0 for value in discount_values], dtype=np.float64)
+    factors = np.ones(len(values))
+    percentage = types == "percentage"
+    factors[percentage] = 1 - values[percentage] / 100
+    absolute = (types == "absolute") & (gross_totals > 0)
+    factors[absolute] = 1 - values[absolute] / gross_totals[absolute]
+    return np.clip(factors, 0, 1)
+
+def compute_quotation_totals(quotation: dict, phases: List[dict], groups: List[dict], items: List[dict]) -> Dict[str, Any]:
+    """Roll item prices up to group, phase and quotation totals as OTP + Y1-Y10 matrices"""
+    phase_positions = {phase["id"]: position for position, phase in enumerate(phases)}
+    groups = [group for group in groups if group["phase_id"] in phase_positions]
+    group_positions = {group["id"]: position for position, group in enumerate(groups)}
+    items = [item for item in items if item["group_id"] in group_positions]
+    
+    item_groups = np.array([group_positions[item["group_id"]] for item in items], dtype=np.int64)
+    group_phases = np.array([phase_positions[group["phase_id"]] for group in groups], dtype=np.int64)
+    quantities = np.array([item.get("quantity") or 0 for item in items], dtype=np.float64)
+    unit_prices = np.array(
+        [[item.get("base_otp") or 0, item.get("base_recurring") or 0] for item in items], dtype=np.float64
+    ).reshape(-1, 2)
+    months = np.array([item.get("contract_duration_months") or 12 for item in items], dtype=np.float64)
+    
+    # Share of each contract year covered by the item's term (a partial final year is prorated)
+    proration = np.clip((months[:, None] - 12 * np.arange(QUOTATION_YEARS)) / 12, 0, 1)
+    line_prices = quantities[:, None] * unit_prices
+    gross = np.column_stack([line_prices[:, 0], line_prices[:, 1:2] * proration])
+    
+    item_factors = discount_factors(
+        [item.get("discount_type") for item in items], [item.get("discount_value") for item in items], gross.sum(axis=1)
+    )
+    net_prices = line_prices * item_factors[:, None]
+    item_matrix = gross * item_factors[:, None]
+    
+    group_matrix = np.zeros((len(groups), len(QUOTATION_TOTAL_COLUMNS)))
+    np.add.at(group_matrix, item_groups, item_matrix)
+    group_factors = discount_factors(
+        [group.get("discount_type") for group in groups], [group.get("discount_value") for group in groups], group_matrix.sum(axis=1)
+    )
+    group_matrix *= group_factors[:, None]
+    item_matrix *= group_factors[item_groups][:, None]
+    
+    phase_matrix = np.zeros((len(phases), len(QUOTATION_TOTAL_COLUMNS)))
+    np.add.at(phase_matrix, group_phases, group_matrix)
+    
+    return {
+        "items": items, "net_prices": net_prices, "proration": proration, "item_matrix": item_matrix,
+        "groups": groups, "group_matrix": group_matrix,
+        "phases": phases, "phase_matrix": phase_matrix,
+        "quotation_row": quotation_header_row(quotation, phase_matrix)
+    }
+
+def quotation_header_row(quotation: dict, phase_matrix: np.ndarray) -> np.ndarray:
+    """Sum phase totals and apply the quotation's overall discount"""
+    quotation_row = phase_matrix.sum(axis=0)
+    return quotation_row * discount_factors(
+        [quotation.get("overall_discount_type")], [quotation.get("overall_discount_value")], np.array([quotation_row.sum()])
+    )[0]
+
+def stored_total_row(document: dict, prefix: str) -> np.ndarray:
+    return np.array([document.get(f"{prefix}_{column}") or 0 for column in QUOTATION_TOTAL_COLUMNS], dtype=np.float64)
+
+def quotation_total_fields(prefix: str, grand_total_field: str, row: np.ndarray) -> Dict[str, float]:
+    fields = {f"{prefix}_{column}": round(float(value), 2) for column, value in zip(QUOTATION_TOTAL_COLUMNS, row)}
+    fields[grand_total_field] = round(float(row.sum()), 2)
+    return fields
+
+def item_total_fields(net_prices: np.ndarray, proration_row: np.ndarray, line_row: np.ndarray) -> Dict[str, Any]:
+    """net_* carry the item discount only; line totals and yearly allocations also carry the group discount"""
+    yearly_otp = np.zeros(QUOTATION_YEARS)
+    yearly_otp[0] = line_row[0]
+    yearly_recurring = line_row[1:]
+    return {
+        "net_otp": round(float(net_prices[0]), 2),
+        "net_recurring": round(float(net_prices[1]), 2),
+        "line_total_otp": round(float(line_row[0]), 2),
+        "line_total_recurring": round(float(line_row[1:].sum()), 2),
+        "yearly_allocations": [
+            {
+                "year_no": year,
+                "allocated_otp": round(float(otp), 2),
+                "allocated_recurring": round(float(recurring), 2),
+                "year_total": round(float(otp + recurring), 2),
+                "proration_factor": round(float(factor), 4)
+            }
+            for year, (otp, recurring, factor) in enumerate(zip(yearly_otp, yearly_recurring, proration_row), start=1)
+        ]
+    }
+
+def item_total_updates(totals: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        item_total_fields(net_prices, proration_row, line_row)
+        for net_prices, proration_row, line_row in zip(totals["net_prices"], totals["proration"], totals["item_matrix"])
+    ]
+
+def changed_total_operations(documents: List[dict], updates: List[Dict[str, Any]]) -> List[UpdateOne]:
+    """UpdateOne operations for the documents whose stored totals differ from the new ones"""
+    return [
+        UpdateOne({"id": document["id"]}, {"$set": update})
+        for document, update in zip(documents, updates)
+        if any(document.get(field) != value for field, value in update.items())
+    ]
+
+async def recalculate_quotation_totals(quotation_id: str) -> Dict[str, float]:
+    """Recompute and persist every total in a quotation's hierarchy, returning the header totals"""
+    quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False}, {"_id": 0})
+    if not quotation:
+        raise HTTPException(status_code=404, detail="Quotation not found")
+    header_fields = [f"total_{column}" for column in QUOTATION_TOTAL_COLUMNS] + ["grand_total"]
+    
+    phases = await db.quotation_phases.find({"quotation_id": quotation_id, "is_deleted": False}, {"_id": 0}).to_list(None)
+    if not phases:
+        # Quotations saved without a stored hierarchy keep the totals they were saved with
+        return {field: quotation.get(field, 0) for field in header_fields}
+    groups = await db.quotation_groups.find(
+        {"phase_id": {"$in": [phase["id"] for phase in phases]}, "is_deleted": False}, {"_id": 0}
+    ).to_list(None)
+    items = await db.quotation_items.find(
+        {"group_id": {"$in": [group["id"] for group in groups]}, "is_deleted": False},
+        {"_id": 0, **{field: 1 for field in QUOTATION_ITEM_TOTAL_FIELDS}}
+    ).to_list(None) if groups else []
+    
+    totals = compute_quotation_totals(quotation, phases, groups, items)
+    
+    item_operations = changed_total_operations(totals["items"], item_total_updates(totals))
+    group_operations = changed_total_operations(totals["groups"], [
+        quotation_total_fields("group_total", "group_grand_total", row) for row in totals["group_matrix"]
+    ])
+    phase_operations = changed_total_operations(totals["phases"], [
+        quotation_total_fields("phase_total", "phase_grand_total", row) for row in totals["phase_matrix"]
+    ])
+    return await persist_quotation_totals(quotation, item_operations, group_operations, phase_operations, totals["quotation_row"])
+
+async def persist_quotation_totals(quotation: dict, item_operations: List[UpdateOne], group_operations: List[UpdateOne],
+                                   phase_operations: List[UpdateOne], quotation_row: np.ndarray) -> Dict[str, float]:
+    if item_operations:
+        await db.quotation_items.bulk_write(item_operations, ordered=False)
+    if group_operations:
+        await db.quotation_groups.bulk_write(group_operations, ordered=False)
+    if phase_operations:
+        await db.quotation_phases.bulk_write(phase_operations, ordered=False)
+    
+    header_totals = quotation_total_fields("total", "grand_total", quotation_row)
+    if any(quotation.get(field) != value for field, value in header_totals.items()):
+        await db.quotations.update_one({"id": quotation["id"]}, {"$set": header_totals})
+        publish_live_update("quotations", quotation["id"], "update", list(header_totals))
+    return header_totals
+
+async def recalculate_quotation_group_path(quotation_id: str, group_id: str) -> Dict[str, float]:
+    """Re-aggregate only the dirty path of an item change: its group, that group's phase and the header"""
+    quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False}, {"_id": 0})
+    if not quotation:
+        raise HTTPException(status_code=404, detail="Quotation not found")
+    group = await db.quotation_groups.find_one({"id": group_id, "is_deleted": False}, {"_id": 0})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    phase = await db.quotation_phases.find_one(
+        {"id": group["phase_id"], "quotation_id": quotation_id, "is_deleted": False}, {"_id": 0, "id": 1}
+    )
+    if not phase:
+        raise HTTPException(status_code=404, detail="Group not found in this quotation")
+    items = await db.quotation_items.find(
+        {"group_id": group_id, "is_deleted": False}, {"_id": 0, **{field: 1 for field in QUOTATION_ITEM_TOTAL_FIELDS}}
+    ).to_list(None)
+    
+    totals = compute_quotation_totals(quotation, [phase], [group], items)
+    item_operations = changed_total_operations(totals["items"], item_total_updates(totals))
+    if item_operations:
+        await db.quotation_items.bulk_write(item_operations, ordered=False)
+    
+    # Swap in the group totals and move the phase by exactly what was replaced, so concurrent
+    # edits to other groups of the same phase accumulate instead of overwriting each other
+    group_totals = quotation_total_fields("group_total", "group_grand_total", totals["group_matrix"][0])
+    previous_group = await db.quotation_groups.find_one_and_update(
+        {"id": group_id}, {"$set": group_totals}, {"_id": 0, "id": 1, **{field: 1 for field in group_totals}},
+        return_document=ReturnDocument.BEFORE
+    )
+    phase_delta = {
+        field.replace("group_", "phase_", 1): round(value - ((previous_group or {}).get(field) or 0), 2)
+        for field, value in group_totals.items()
+    }
+    if any(phase_delta.values()):
+        await db.quotation_phases.update_one({"id": phase["id"]}, {"$inc": phase_delta})
+    
+    # The header is derived from the persisted phase totals
+    phases = await db.quotation_phases.find(
+        {"quotation_id": quotation_id, "is_deleted": False},
+        {"_id": 0, **{f"phase_total_{column}": 1 for column in QUOTATION_TOTAL_COLUMNS}}
+    ).to_list(None)
+    phase_matrix = np.array([stored_total_row(stored_phase, "phase_total") for stored_phase in phases]).reshape(-1, len(QUOTATION_TOTAL_COLUMNS))
+    return await persist_quotation_totals(quotation, [], [], [], quotation_header_row(quotation, phase_matrix))
+
+async def migrate_quotation_item_yearly():
+    """Fold legacy quotation_item_yearly documents into the yearly_allocations array on each item"""
+    allocation_fields = list(QuotationItemYearly.__fields__)
+    try:
+        await db.quotation_item_yearly.create_index([("item_id", 1), ("year_no", 1)])
+        last_item_id = ""
+        while True:
+            # Walk item ids in index order a page at a time instead of grouping the whole collection
+            rows = await db.quotation_item_yearly.find(
+                {"item_id": {"$gt": last_item_id}}, {"_id": 0, "item_id": 1}
+            ).sort("item_id", 1).limit(QUOTATION_YEARLY_MIGRATION_BATCH_SIZE * QUOTATION_YEARS).to_list(None)
+            if not rows:
+                break
+            item_ids = list(dict.fromkeys(row["item_id"] for row in rows))
+            last_item_id = item_ids[-1]
+            
+            years = await db.quotation_item_yearly.find(
+                {"item_id": {"$in": item_ids}}, {"_id": 0, "item_id": 1, **{field: 1 for field in allocation_fields}}
+            ).sort([("item_id", 1), ("year_no", 1)]).to_list(None)
+            allocations = {}
+            for year in years:
+                allocations.setdefault(year.pop("item_id"), []).append(year)
+            
+            # Items already recomputed by the totals engine keep their fresher allocations
+            await db.quotation_items.bulk_write([
+                UpdateOne({"id": item_id, "yearly_allocations": {"$in": [None, []]}}, {"$set": {"yearly_allocations": item_years}})
+                for item_id, item_years in allocations.items()
+            ], ordered=False)
+            await db.quotation_item_yearly.delete_many({"item_id": {"$in": item_ids}})
+    except Exception as e:
+        print(f"Warning: Failed to migrate quotation item yearly allocations: {str(e)}")
+
 @api_router.post("/quotations", response_model=APIResponse)
 @require_permission("/opportunities", "create")
 async def create_quotation(quotation_data: dict, current_user: User = Depends(get_current_user)):
@@ -12249,7 +15247,8 @@ async def create_quotation(quotation_data: dict, current_user: User = Depends(ge
         quotation_data["created_by"] = current_user.id
         quotation = Quotation(**quotation_data)
         
-        result = await db.quotations.insert_one(quotation.dict())
+        result = await db.quotations.insert_one(await with_display_fields("quotations", quotation.dict()))
+        publish_live_update("quotations", quotation.id, "insert")
         
         # Log audit trail
         audit_log = QuotationAuditLog(
@@ -12292,104 +15291,502 @@ async def update_quotation(quotation_id: str, quotation_data: dict, current_user
         quotation_data["modified_by"] = current_user.id
         quotation_data["updated_at"] = datetime.now(timezone.utc)
         
-        await db.quotations.update_one(
-            {"id": quotation_id},
-            {"$set": quotation_data}
-        )
+        await db.quotations.update_one(
+            {"id": quotation_id},
+            {"$set": quotation_data}
+        )
+        publish_live_update("quotations", quotation_id, "update", list(quotation_data))
+        if {"overall_discount_type", "overall_discount_value"} & set(quotation_data):
+            await recalculate_quotation_totals(quotation_id)
+        
+        # Log audit trail
+        audit_log = QuotationAuditLog(
+            quotation_id=quotation_id,
+            table_name="quotations",
+            record_id=quotation_id,
+            action="update",
+            user_id=current_user.id,
+            user_role="user"
+        )
+        await db.quotation_audit_log.insert_one(audit_log.dict())
+        
+        return APIResponse(success=True, message="Quotation updated successfully")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 2. Quotation Phases
+@api_router.post("/quotations/{quotation_id}/phases", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def create_quotation_phase(quotation_id: str, phase_data: dict, current_user: User = Depends(get_current_user)):
+    """Create a new phase in a quotation"""
+    try:
+        # Verify quotation exists
+        quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False})
+        if not quotation:
+            raise HTTPException(status_code=404, detail="Quotation not found")
+        
+        phase_data["quotation_id"] = quotation_id
+        phase_data["created_by"] = current_user.id
+        phase = QuotationPhase(**phase_data)
+        
+        await db.quotation_phases.insert_one(phase.dict())
+        
+        return APIResponse(success=True, message="Phase created successfully", data={"phase_id": phase.id})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 3. Quotation Groups
+@api_router.post("/quotations/{quotation_id}/phases/{phase_id}/groups", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def create_quotation_group(quotation_id: str, phase_id: str, group_data: dict, current_user: User = Depends(get_current_user)):
+    """Create a new group in a phase"""
+    try:
+        # Verify phase exists
+        phase = await db.quotation_phases.find_one({"id": phase_id, "quotation_id": quotation_id, "is_deleted": False})
+        if not phase:
+            raise HTTPException(status_code=404, detail="Phase not found")
+        
+        group_data["phase_id"] = phase_id
+        group_data["created_by"] = current_user.id
+        group = QuotationGroup(**group_data)
+        
+        await db.quotation_groups.insert_one(group.dict())
+        
+        return APIResponse(success=True, message="Group created successfully", data={"group_id": group.id})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 4. Quotation Items
+@api_router.post("/quotations/{quotation_id}/groups/{group_id}/items", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def create_quotation_item(quotation_id: str, group_id: str, item_data: dict, current_user: User = Depends(get_current_user)):
+    """Create a new item in a group"""
+    try:
+        # Verify the quotation is editable and the group belongs to it before inserting
+        await find_editable_quotation(quotation_id)
+        if not await quotation_group_in_quotation(quotation_id, group_id):
+            raise HTTPException(status_code=404, detail="Group not found")
+        
+        item_data["group_id"] = group_id
+        item_data["created_by"] = current_user.id
+        item = QuotationItem(**item_data)
+        
+        await db.quotation_items.insert_one(item.dict())
+        
+        # Yearly allocations (Y1-Y10) are filled in by the totals recalculation
+        totals = await recalculate_quotation_group_path(quotation_id, group_id)
+        
+        return APIResponse(success=True, message="Item created successfully", data={"item_id": item.id, "quotation_totals": totals})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+QUOTATION_ITEM_PROTECTED_FIELDS = ["id", "group_id", "created_by", "created_at", "is_deleted"] + QUOTATION_COMPUTED_FIELDS["item"]
+
+@api_router.post("/quotations/{quotation_id}/items/bulk", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def bulk_create_quotation_items(quotation_id: str, request_data: dict, current_user: User = Depends(get_current_user)):
+    """Create many line items, across any groups of the quotation, in one request"""
+    try:
+        items_data = request_data.get("items")
+        if not isinstance(items_data, list) or not items_data:
+            raise HTTPException(status_code=400, detail="items must be a non-empty list")
+        if len(items_data) > QUOTATION_BULK_ITEM_LIMIT:
+            raise HTTPException(status_code=400, detail=f"At most {QUOTATION_BULK_ITEM_LIMIT} items per request")
+        
+        quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False})
+        if not quotation:
+            raise HTTPException(status_code=404, detail="Quotation not found")
+        if quotation["status"] == "Approved":
+            raise HTTPException(status_code=400, detail="Approved quotations cannot be edited")
+        
+        # Every target group must belong to this quotation
+        group_ids = {item_data.get("group_id") for item_data in items_data}
+        phase_ids = await db.quotation_phases.distinct("id", {"quotation_id": quotation_id, "is_deleted": False})
+        valid_group_ids = set(await db.quotation_groups.distinct(
+            "id", {"id": {"$in": list(group_ids)}, "phase_id": {"$in": phase_ids}, "is_deleted": False}
+        ))
+        unknown_groups = group_ids - valid_group_ids
+        if unknown_groups:
+            raise HTTPException(status_code=400, detail=f"Groups not found in this quotation: {', '.join(sorted(map(str, unknown_groups)))}")
+        
+        items = []
+        for position, item_data in enumerate(items_data):
+            try:
+                items.append(QuotationItem(**{
+                    field: value for field, value in item_data.items()
+                    if field not in QUOTATION_ITEM_PROTECTED_FIELDS or field == "group_id"
+                }, created_by=current_user.id))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Item {position}: {str(e)}")
+        
+        await db.quotation_items.insert_many([item.dict() for item in items], ordered=False)
+        
+        if len(group_ids) == 1:
+            totals = await recalculate_quotation_group_path(quotation_id, group_ids.pop())
+        else:
+            totals = await recalculate_quotation_totals(quotation_id)
+        
+        await db.quotation_audit_log.insert_one(QuotationAuditLog(
+            quotation_id=quotation_id,
+            table_name="quotation_items",
+            record_id=quotation_id,
+            action="create",
+            change_reason=f"Bulk created {len(items)} items",
+            user_id=current_user.id,
+            user_role="user"
+        ).dict())
+        
+        return APIResponse(success=True, message=f"{len(items)} items created successfully", data={
+            "item_ids": [item.id for item in items],
+            "quotation_totals": totals
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def find_editable_quotation(quotation_id: str) -> dict:
+    """Load a quotation that may still be edited"""
+    quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False})
+    if not quotation:
+        raise HTTPException(status_code=404, detail="Quotation not found")
+    if quotation["status"] == "Approved":
+        raise HTTPException(status_code=400, detail="Approved quotations cannot be edited")
+    return quotation
+
+async def quotation_group_in_quotation(quotation_id: str, group_id: Optional[str]) -> Optional[dict]:
+    """Get a group only when its phase belongs to the quotation"""
+    group = group_id and await db.quotation_groups.find_one({"id": group_id, "is_deleted": False})
+    phase = group and await db.quotation_phases.find_one({"id": group["phase_id"], "quotation_id": quotation_id, "is_deleted": False})
+    return group if phase else None
+
+async def find_editable_quotation_item(quotation_id: str, item_id: str) -> dict:
+    """Load an item of an editable quotation, checking it belongs to that quotation"""
+    await find_editable_quotation(quotation_id)
+    
+    item = await db.quotation_items.find_one({"id": item_id, "is_deleted": False}, {"_id": 0})
+    if not item or not await quotation_group_in_quotation(quotation_id, item["group_id"]):
+        raise HTTPException(status_code=404, detail="Item not found")
+    return item
+
+@api_router.put("/quotations/{quotation_id}/items/{item_id}", response_model=APIResponse)
+@require_permission("/opportunities", "edit")
+async def update_quotation_item(quotation_id: str, item_id: str, item_data: dict, current_user: User = Depends(get_current_user)):
+    """Update a line item and re-aggregate its group, phase and quotation totals"""
+    try:
+        item = await find_editable_quotation_item(quotation_id, item_id)
+        
+        update_data = {field: value for field, value in item_data.items() if field not in QUOTATION_ITEM_PROTECTED_FIELDS}
+        QuotationItem(**{**item, **update_data})
+        update_data["modified_by"] = current_user.id
+        update_data["updated_at"] = datetime.now(timezone.utc)
+        await db.quotation_items.update_one({"id": item_id}, {"$set": update_data})
         
-        # Log audit trail
-        audit_log = QuotationAuditLog(
+        totals = await recalculate_quotation_group_path(quotation_id, item["group_id"])
+        
+        await db.quotation_audit_log.insert_one(QuotationAuditLog(
             quotation_id=quotation_id,
-            table_name="quotations",
-            record_id=quotation_id,
+            table_name="quotation_items",
+            record_id=item_id,
             action="update",
             user_id=current_user.id,
             user_role="user"
-        )
-        await db.quotation_audit_log.insert_one(audit_log.dict())
+        ).dict())
         
-        return APIResponse(success=True, message="Quotation updated successfully")
+        return APIResponse(success=True, message="Item updated successfully", data={"item_id": item_id, "quotation_totals": totals})
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 2. Quotation Phases
-@api_router.post("/quotations/{quotation_id}/phases", response_model=APIResponse)
+@api_router.delete("/quotations/{quotation_id}/items/{item_id}", response_model=APIResponse)
 @require_permission("/opportunities", "edit")
-async def create_quotation_phase(quotation_id: str, phase_data: dict, current_user: User = Depends(get_current_user)):
-    """Create a new phase in a quotation"""
+async def delete_quotation_item(quotation_id: str, item_id: str, current_user: User = Depends(get_current_user)):
+    """Remove a line item and re-aggregate its group, phase and quotation totals"""
     try:
-        # Verify quotation exists
-        quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False})
-        if not quotation:
-            raise HTTPException(status_code=404, detail="Quotation not found")
+        item = await find_editable_quotation_item(quotation_id, item_id)
         
-        phase_data["quotation_id"] = quotation_id
-        phase_data["created_by"] = current_user.id
-        phase = QuotationPhase(**phase_data)
+        await db.quotation_items.update_one({"id": item_id}, {"$set": {
+            "is_deleted": True,
+            "modified_by": current_user.id,
+            "updated_at": datetime.now(timezone.utc)
+        }})
         
-        await db.quotation_phases.insert_one(phase.dict())
+        totals = await recalculate_quotation_group_path(quotation_id, item["group_id"])
         
-        return APIResponse(success=True, message="Phase created successfully", data={"phase_id": phase.id})
+        await db.quotation_audit_log.insert_one(QuotationAuditLog(
+            quotation_id=quotation_id,
+            table_name="quotation_items",
+            record_id=item_id,
+            action="delete",
+            user_id=current_user.id,
+            user_role="user"
+        ).dict())
+        
+        return APIResponse(success=True, message="Item deleted successfully", data={"item_id": item_id, "quotation_totals": totals})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 3. Quotation Groups
-@api_router.post("/quotations/{quotation_id}/phases/{phase_id}/groups", response_model=APIResponse)
+# Catalog data used to validate quotation line items (small tables, cached per process)
+QUOTATION_CATALOG_CACHE_TTL_SECONDS = 300
+_quotation_catalog_cache: Dict[str, tuple] = {}
+
+async def get_quotation_catalog() -> Dict[str, Dict[str, Any]]:
+    """Active core products and pricing models (with list prices) keyed by id, loaded at most once per TTL"""
+    cached = _quotation_catalog_cache.get("catalog")
+    now = datetime.now(timezone.utc)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    catalog = {
+        "products": {
+            product["id"]: product for product in await db.core_product_model.find(
+                {"is_active": True, "is_deleted": False},
+                {"_id": 0, "id": 1, "core_product_name": 1, "skucode": 1, "unit_of_measure": 1, "primary_category": 1}
+            ).to_list(None)
+        },
+        "pricing_models": {
+            pricing["id"]: pricing for pricing in await db.pricing_models.find(
+                {"is_active": True, "is_deleted": False},
+                {"_id": 0, "id": 1, "core_product_id": 1, "pricing_list_id": 1, "selling_price": 1, "recurring_selling_price": 1}
+            ).to_list(None)
+        }
+    }
+    catalog["product_pricing_lists"] = {}
+    for pricing in catalog["pricing_models"].values():
+        catalog["product_pricing_lists"].setdefault(pricing["core_product_id"], set()).add(pricing.get("pricing_list_id", "default"))
+    _quotation_catalog_cache["catalog"] = (now + timedelta(seconds=QUOTATION_CATALOG_CACHE_TTL_SECONDS), catalog)
+    return catalog
+
+# Item base price -> pricing model list price it may not undercut
+QUOTATION_ITEM_LIST_PRICE_FIELDS = {"base_otp": "selling_price", "base_recurring": "recurring_selling_price"}
+
+def validate_quotation_item_catalog(item: dict, catalog: Dict[str, Dict[str, Any]], pricing_list_id: Optional[str] = None):
+    """Check an item's product, pricing model and prices, filling product details and prices the client left out"""
+    product = catalog["products"].get(item.get("core_product_id"))
+    if not product:
+        raise ValueError(f"Unknown or inactive product: {item.get('core_product_id')}")
+    pricing = catalog["pricing_models"].get(item.get("pricing_model_id"))
+    if not pricing or pricing["core_product_id"] != product["id"]:
+        raise ValueError(f"Pricing model {item.get('pricing_model_id')} does not belong to product {product['id']}")
+    # Like the product pricing lookup, products not priced on the quotation's list may use any active pricing
+    if (pricing_list_id and pricing_list_id in catalog["product_pricing_lists"].get(product["id"], set())
+            and pricing.get("pricing_list_id", "default") != pricing_list_id):
+        raise ValueError(f"Pricing model {pricing['id']} is not on the quotation's pricing list {pricing_list_id}")
+    
+    # Prices start from the list price; reductions go through the discount fields
+    for field, list_field in QUOTATION_ITEM_LIST_PRICE_FIELDS.items():
+        list_price = float(pricing.get(list_field) or 0)
+        if not item.get(field):
+            item[field] = list_price
+        elif float(item[field]) < list_price:
+            raise ValueError(f"{field} {item[field]} is below the list price {list_price}; apply a discount instead")
+    item["product_name"] = item.get("product_name") or product.get("core_product_name")
+    item["sku_code"] = item.get("sku_code") or product.get("skucode")
+
+# Quotation patch: entity -> (model, collection, parent field, child entity, nested child key)
+QUOTATION_PATCH_ENTITIES = {
+    "phase": (QuotationPhase, "quotation_phases", "quotation_id", "group", "groups"),
+    "group": (QuotationGroup, "quotation_groups", "phase_id", "item", "items"),
+    "item": (QuotationItem, "quotation_items", "group_id", None, None)
+}
+QUOTATION_PATCH_PARENTS = {"group": "phase", "item": "group"}
+QUOTATION_PATCH_OPERATIONS = ["create", "update", "upsert", "delete"]
+QUOTATION_PATCH_OPERATION_LIMIT = 10000
+
+def flatten_quotation_patch(nodes: List[dict], entity: str, parent_ref: Optional[str] = None) -> List[dict]:
+    """Turn nested phases -> groups -> items into flat upsert operations"""
+    _, _, parent_field, child_entity, child_key = QUOTATION_PATCH_ENTITIES[entity]
+    if not isinstance(nodes, list) or not all(isinstance(node, dict) for node in nodes):
+        raise HTTPException(status_code=400, detail=f"Nested {entity} entries must be a list of objects")
+    operations = []
+    for node in nodes:
+        data = {field: value for field, value in node.items() if field not in ["id", child_key]}
+        node_ref = node.get("id") or str(uuid.uuid4())
+        if parent_ref:
+            data[parent_field] = parent_ref
+        operations.append({"op": "upsert", "entity": entity, "id": node_ref, "data": data})
+        if child_key:
+            operations.extend(flatten_quotation_patch(node.get(child_key) or [], child_entity, node_ref))
+    return operations
+
+async def apply_quotation_patch(quotation_id: str, operations: List[dict], user_id: str,
+                                pricing_list_id: Optional[str] = None) -> Dict[str, Any]:
+    """Validate a batch of phase/group/item operations, then write them with one bulk_write per collection"""
+    # Live parent links of the quotation's existing nodes
+    parents: Dict[str, Dict[str, str]] = {"phase": {}, "group": {}, "item": {}}
+    parents["phase"] = {phase_id: quotation_id for phase_id in await db.quotation_phases.distinct(
+        "id", {"quotation_id": quotation_id, "is_deleted": False}
+    )}
+    async for group in db.quotation_groups.find({"phase_id": {"$in": list(parents["phase"])}, "is_deleted": False}, {"_id": 0, "id": 1, "phase_id": 1}):
+        parents["group"][group["id"]] = group["phase_id"]
+    async for item in db.quotation_items.find({"group_id": {"$in": list(parents["group"])}, "is_deleted": False}, {"_id": 0, "id": 1, "group_id": 1}):
+        parents["item"][item["id"]] = item["group_id"]
+    
+    # Full documents are only needed for existing nodes being updated
+    existing: Dict[str, Dict[str, dict]] = {}
+    for entity, (_, collection_name, _, _, _) in QUOTATION_PATCH_ENTITIES.items():
+        target_ids = [operation.get("id") for operation in operations
+                      if operation.get("entity") == entity and operation.get("id") in parents[entity]]
+        existing[entity] = {document["id"]: document for document in await db[collection_name].find(
+            {"id": {"$in": target_ids}}, {"_id": 0}
+        ).to_list(None)} if target_ids else {}
+    
+    catalog = await get_quotation_catalog()
+    refs: Dict[str, str] = {}
+    created: Dict[str, Dict[str, dict]] = {entity: {} for entity in QUOTATION_PATCH_ENTITIES}
+    updated: Dict[str, Dict[str, dict]] = {entity: {} for entity in QUOTATION_PATCH_ENTITIES}
+    deleted: Dict[str, set] = {entity: set() for entity in QUOTATION_PATCH_ENTITIES}
+    now = datetime.now(timezone.utc)
+    
+    for position, operation in enumerate(operations):
+        try:
+            op, entity = operation.get("op"), operation.get("entity")
+            if op not in QUOTATION_PATCH_OPERATIONS:
+                raise ValueError(f"op must be one of {', '.join(QUOTATION_PATCH_OPERATIONS)}")
+            if entity not in QUOTATION_PATCH_ENTITIES:
+                raise ValueError(f"entity must be one of {', '.join(QUOTATION_PATCH_ENTITIES)}")
+            model, _, parent_field, _, _ = QUOTATION_PATCH_ENTITIES[entity]
+            node_id = refs.get(operation.get("id"), operation.get("id"))
+            if op == "upsert":
+                op = "update" if node_id in parents[entity] else "create"
+            
+            if op == "delete":
+                if node_id not in parents[entity]:
+                    raise ValueError(f"{entity} {operation.get('id')} not found in this quotation")
+                # Removing a node removes everything below it
+                doomed = {entity: {node_id}}
+                level = entity
+                while QUOTATION_PATCH_ENTITIES[level][3]:
+                    child_level = QUOTATION_PATCH_ENTITIES[level][3]
+                    doomed[child_level] = {child for child, parent in parents[child_level].items() if parent in doomed[level]}
+                    level = child_level
+                for doomed_entity, doomed_ids in doomed.items():
+                    for doomed_id in doomed_ids:
+                        parents[doomed_entity].pop(doomed_id, None)
+                        updated[doomed_entity].pop(doomed_id, None)
+                        if created[doomed_entity].pop(doomed_id, None) is None:
+                            deleted[doomed_entity].add(doomed_id)
+                continue
+            
+            if not isinstance(operation.get("data") or {}, dict):
+                raise ValueError("data must be an object")
+            data = {
+                field: value for field, value in (operation.get("data") or {}).items()
+                if field not in ["id", "created_by", "created_at", "is_deleted"] + QUOTATION_COMPUTED_FIELDS[entity]
+            }
+            if entity == "phase":
+                data[parent_field] = quotation_id
+            elif parent_field in data:
+                data[parent_field] = refs.get(data[parent_field], data[parent_field])
+                if data[parent_field] not in parents[QUOTATION_PATCH_PARENTS[entity]]:
+                    raise ValueError(f"{parent_field} {data[parent_field]} not found in this quotation")
+            
+            if op == "create":
+                if node_id in parents[entity]:
+                    raise ValueError(f"{entity} {node_id} already exists")
+                document = model(**data, created_by=user_id).dict()
+                if operation.get("id"):
+                    refs[operation["id"]] = document["id"]
+                node_id = document["id"]
+            elif node_id in created[entity]:
+                document = model(**{**created[entity][node_id], **data}).dict()
+            elif node_id in parents[entity]:
+                changes = {**updated[entity].get(node_id, {}), **data, "modified_by": user_id, "updated_at": now}
+                model(**{**existing[entity][node_id], **changes})
+                document = {**existing[entity][node_id], **changes}
+                updated[entity][node_id] = changes
+            else:
+                raise ValueError(f"{entity} {operation.get('id')} not found in this quotation")
+            
+            if entity == "item" and ({"core_product_id", "pricing_model_id", *QUOTATION_ITEM_LIST_PRICE_FIELDS} & set(data) or op == "create"):
+                validate_quotation_item_catalog(document, catalog, pricing_list_id)
+                if node_id in updated[entity]:
+                    updated[entity][node_id].update({
+                        field: document[field] for field in ["product_name", "sku_code", *QUOTATION_ITEM_LIST_PRICE_FIELDS]
+                    })
+            if op == "create" or node_id in created[entity]:
+                created[entity][node_id] = document
+            parents[entity][node_id] = document[parent_field]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Operation {position}: {str(e)}")
+    
+    for entity, (_, collection_name, _, _, _) in QUOTATION_PATCH_ENTITIES.items():
+        writes = [InsertOne(document) for document in created[entity].values()]
+        writes += [UpdateOne({"id": node_id}, {"$set": changes}) for node_id, changes in updated[entity].items()]
+        if deleted[entity]:
+            writes.append(UpdateMany({"id": {"$in": list(deleted[entity])}}, {"$set": {
+                "is_deleted": True, "modified_by": user_id, "updated_at": now
+            }}))
+        if writes:
+            await db[collection_name].bulk_write(writes, ordered=False)
+    
+    return {
+        "created_ids": refs,
+        "created": {entity: len(documents) for entity, documents in created.items()},
+        "updated": {entity: len(changes) for entity, changes in updated.items()},
+        "deleted": {entity: len(ids) for entity, ids in deleted.items()},
+        "quotation_totals": await recalculate_quotation_totals(quotation_id)
+    }
+
+@api_router.post("/quotations/{quotation_id}/patch", response_model=APIResponse)
 @require_permission("/opportunities", "edit")
-async def create_quotation_group(quotation_id: str, phase_id: str, group_data: dict, current_user: User = Depends(get_current_user)):
-    """Create a new group in a phase"""
+async def patch_quotation(quotation_id: str, request_data: dict, current_user: User = Depends(get_current_user)):
+    """Apply create/update/delete operations for phases, groups and items in one request"""
     try:
-        # Verify phase exists
-        phase = await db.quotation_phases.find_one({"id": phase_id, "quotation_id": quotation_id, "is_deleted": False})
-        if not phase:
-            raise HTTPException(status_code=404, detail="Phase not found")
-        
-        group_data["phase_id"] = phase_id
-        group_data["created_by"] = current_user.id
-        group = QuotationGroup(**group_data)
-        
-        await db.quotation_groups.insert_one(group.dict())
+        quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False})
+        if not quotation:
+            raise HTTPException(status_code=404, detail="Quotation not found")
+        if quotation["status"] == "Approved":
+            raise HTTPException(status_code=400, detail="Approved quotations cannot be edited")
+        
+        # Nested phases -> groups -> items are flattened ahead of any flat operations
+        flat_operations = request_data.get("operations") or []
+        if not isinstance(flat_operations, list) or not all(isinstance(operation, dict) for operation in flat_operations):
+            raise HTTPException(status_code=400, detail="operations must be a list of objects")
+        operations = flatten_quotation_patch(request_data.get("phases") or [], "phase") + flat_operations
+        if not operations:
+            raise HTTPException(status_code=400, detail="Provide phases or operations")
+        if len(operations) > QUOTATION_PATCH_OPERATION_LIMIT:
+            raise HTTPException(status_code=400, detail=f"At most {QUOTATION_PATCH_OPERATION_LIMIT} operations per request")
+        
+        result = await apply_quotation_patch(quotation_id, operations, current_user.id, quotation.get("pricing_list_id"))
+        
+        await db.quotation_audit_log.insert_one(QuotationAuditLog(
+            quotation_id=quotation_id,
+            table_name="quotations",
+            record_id=quotation_id,
+            action="update",
+            change_reason=f"Applied patch with {len(operations)} operations",
+            user_id=current_user.id,
+            user_role="user"
+        ).dict())
         
-        return APIResponse(success=True, message="Group created successfully", data={"group_id": group.id})
+        return APIResponse(success=True, message="Quotation patch applied successfully", data=result)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 4. Quotation Items
-@api_router.post("/quotations/{quotation_id}/groups/{group_id}/items", response_model=APIResponse)
+@api_router.post("/quotations/{quotation_id}/recalculate", response_model=APIResponse)
 @require_permission("/opportunities", "edit")
-async def create_quotation_item(quotation_id: str, group_id: str, item_data: dict, current_user: User = Depends(get_current_user)):
-    """Create a new item in a group"""
+async def recalculate_quotation(quotation_id: str, current_user: User = Depends(get_current_user)):
+    """Recompute item, group, phase and quotation totals from line item prices"""
     try:
-        # Verify group exists
-        group = await db.quotation_groups.find_one({"id": group_id, "is_deleted": False})
-        if not group:
-            raise HTTPException(status_code=404, detail="Group not found")
-        
-        item_data["group_id"] = group_id
-        item_data["created_by"] = current_user.id
-        item = QuotationItem(**item_data)
-        
-        await db.quotation_items.insert_one(item.dict())
-        
-        # Create yearly allocations (Y1-Y10)
-        if item_data.get("create_yearly_allocations", True):
-            for year in range(1, 11):
-                yearly_data = QuotationItemYearly(
-                    item_id=item.id,
-                    year_no=year,
-                    allocated_otp=item.net_otp if year == 1 else 0.0,
-                    allocated_recurring=item.net_recurring if year > 1 else 0.0,
-                    year_total=item.net_otp if year == 1 else item.net_recurring
-                )
-                await db.quotation_item_yearly.insert_one(yearly_data.dict())
-        
-        return APIResponse(success=True, message="Item created successfully", data={"item_id": item.id})
+        totals = await recalculate_quotation_totals(quotation_id)
+        return APIResponse(success=True, message="Quotation totals recalculated successfully", data=totals)
     except HTTPException:
         raise
     except Exception as e:
@@ -12409,9 +15806,9 @@ async def submit_quotation(quotation_id: str, current_user: User = Depends(get_c
         if quotation["status"] != "Draft":
             raise HTTPException(status_code=400, detail="Only Draft quotations can be submitted")
         
-        # Update status to Unapproved
-        await db.quotations.update_one(
-            {"id": quotation_id},
+        # Claim the Draft -> Unapproved transition so concurrent submissions record one version
+        result = await db.quotations.update_one(
+            {"id": quotation_id, "is_deleted": False, "status": "Draft"},
             {"$set": {
                 "status": "Unapproved",
                 "submitted_by": current_user.id,
@@ -12420,17 +15817,12 @@ async def submit_quotation(quotation_id: str, current_user: User = Depends(get_c
                 "updated_at": datetime.now(timezone.utc)
             }}
         )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=400, detail="Only Draft quotations can be submitted")
+        publish_live_update("quotations", quotation_id, "update", ["status", "submitted_by", "submitted_at", "modified_by", "updated_at"])
         
         # Create version snapshot
-        quotation_snapshot = await get_quotation(quotation_id, current_user)
-        version = QuotationVersion(
-            quotation_id=quotation_id,
-            version_number=1,
-            version_name="Initial Submission",
-            snapshot_data=str(quotation_snapshot.data),
-            created_by=current_user.id
-        )
-        await db.quotation_versions.insert_one(version.dict())
+        await record_quotation_version(quotation_id, "Submission", current_user.id)
         
         # Log audit trail
         audit_log = QuotationAuditLog(
@@ -12490,6 +15882,7 @@ async def approve_quotation(quotation_id: str, current_user: User = Depends(get_
                 "updated_at": datetime.now(timezone.utc)
             }}
         )
+        publish_live_update("quotations", quotation_id, "update", ["status", "approved_by", "approved_at", "modified_by", "updated_at"])
         
         # Log audit trail
         audit_log = QuotationAuditLog(
@@ -12549,6 +15942,7 @@ async def reject_quotation(quotation_id: str, current_user: User = Depends(get_c
                 "updated_at": datetime.now(timezone.utc)
             }}
         )
+        publish_live_update("quotations", quotation_id, "update", ["status", "rejected_by", "rejected_at", "modified_by", "updated_at"])
         
         # Log audit trail
         audit_log = QuotationAuditLog(
@@ -12584,44 +15978,9 @@ async def delete_quotation(quotation_id: str, current_user: User = Depends(get_c
                 detail="Only Draft or Unapproved quotations can be deleted"
             )
         
-        # Soft delete the quotation and related data
-        await db.quotations.update_one(
-            {"id": quotation_id},
-            {"$set": {
-                "is_deleted": True,
-                "deleted_by": current_user.id,
-                "deleted_at": datetime.now(timezone.utc),
-                "updated_at": datetime.now(timezone.utc)
-            }}
-        )
-        
-        # Soft delete related phases, groups, and items
-        await db.quotation_phases.update_many(
-            {"quotation_id": quotation_id},
-            {"$set": {"is_deleted": True}}
-        )
-        
-        await db.quotation_groups.update_many(
-            {"phase_id": {"$in": [
-                phase["id"] for phase in await db.quotation_phases.find(
-                    {"quotation_id": quotation_id}
-                ).to_list(None)
-            ]}},
-            {"$set": {"is_deleted": True}}
-        )
-        
-        await db.quotation_items.update_many(
-            {"group_id": {"$in": [
-                group["id"] for group in await db.quotation_groups.find(
-                    {"phase_id": {"$in": [
-                        phase["id"] for phase in await db.quotation_phases.find(
-                            {"quotation_id": quotation_id}
-                        ).to_list(None)
-                    ]}}
-                ).to_list(None)
-            ]}},
-            {"$set": {"is_deleted": True}}
-        )
+        # Soft delete the quotation and its whole hierarchy in one pass
+        deleted_counts = await cascade_soft_delete("quotations", [quotation_id], current_user.id)
+        publish_live_update("quotations", quotation_id, "update", ["is_deleted", "deleted_by", "deleted_at", "updated_at"])
         
         # Log audit trail
         audit_log = QuotationAuditLog(
@@ -12629,73 +15988,888 @@ async def delete_quotation(quotation_id: str, current_user: User = Depends(get_c
             table_name="quotations",
             record_id=quotation_id,
             action="delete",
+            new_value=json.dumps(deleted_counts, sort_keys=True),
             user_id=current_user.id,
             user_role="user"
         )
         await db.quotation_audit_log.insert_one(audit_log.dict())
         
-        return APIResponse(success=True, message="Quotation deleted successfully")
+        return APIResponse(success=True, message="Quotation deleted successfully", data={"deleted": deleted_counts})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 6. Quotation Export
-@api_router.get("/quotations/{quotation_id}/export/{format}", response_model=APIResponse)
+# 6. Quotation Versions
+# Versions form chains: a full snapshot followed by structural diffs against the previous version
+QUOTATION_VERSION_FULL_INTERVAL = 20
+QUOTATION_VERSION_INSERT_ATTEMPTS = 5  # Retries when a concurrent writer takes the next version number
+QUOTATION_VERSION_CACHE_SIZE = 256
+_quotation_version_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+
+def canonical_snapshot_json(snapshot: Any) -> bytes:
+    return json.dumps(
+        snapshot, sort_keys=True, separators=(",", ":"),
+        default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value)
+    ).encode("utf-8")
+
+def encode_snapshot_data(value: Any) -> bytes:
+    return zlib.compress(canonical_snapshot_json(value), 6)
+
+def decode_snapshot_data(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+def is_keyed_list(value: Any) -> bool:
+    """Lists of records with unique ids are diffed by id rather than by position"""
+    return (isinstance(value, list) and all(isinstance(element, dict) and "id" in element for element in value)
+            and len({str(element["id"]) for element in value}) == len(value))
+
+def snapshot_patch(old: Any, new: Any) -> Optional[dict]:
+    """Structural diff: {"r": value} replaces, {"d": ..., "x": ...} patches a dict, {"l": ...} patches a list keyed by id"""
+    if old == new:
+        return None
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = {}
+        for key, value in new.items():
+            patch = snapshot_patch(old[key], value) if key in old else {"r": value}
+            if patch is not None:
+                changes[key] = patch
+        return {"d": changes, "x": [key for key in old if key not in new]}
+    if is_keyed_list(old) and is_keyed_list(new):
+        old_by_id = {element["id"]: element for element in old}
+        new_ids = {element["id"] for element in new}
+        changes, added = {}, []
+        for element in new:
+            if element["id"] not in old_by_id:
+                added.append(element)
+            else:
+                patch = snapshot_patch(old_by_id[element["id"]], element)
+                if patch is not None:
+                    changes[element["id"]] = patch
+        list_patch = {"d": changes, "n": added, "x": [element_id for element_id in old_by_id if element_id not in new_ids]}
+        # Order is only stored when it is not "surviving elements in place, new ones appended"
+        new_order = [element["id"] for element in new]
+        if new_order != [element_id for element_id in old_by_id if element_id in new_ids] + [element["id"] for element in added]:
+            list_patch["order"] = new_order
+        return {"l": list_patch}
+    return {"r": new}
+
+def apply_snapshot_patch(old: Any, patch: Optional[dict]) -> Any:
+    """Rebuild a snapshot from its predecessor; unchanged subtrees are shared, not copied"""
+    if patch is None:
+        return old
+    if "r" in patch:
+        return patch["r"]
+    if "d" in patch:
+        result = {key: value for key, value in old.items() if key not in patch["x"]}
+        for key, change in patch["d"].items():
+            result[key] = apply_snapshot_patch(old.get(key), change)
+        return result
+    changes = patch["l"]
+    removed = set(changes["x"])
+    elements = [
+        apply_snapshot_patch(element, changes["d"].get(element["id"])) for element in old if element["id"] not in removed
+    ] + changes["n"]
+    if "order" not in changes:
+        return elements
+    elements_by_id = {element["id"]: element for element in elements}
+    return [elements_by_id[element_id] for element_id in changes["order"]]
+
+def describe_snapshot_patch(old: Any, patch: Optional[dict], path: str = "") -> List[Dict[str, Any]]:
+    """Flatten a structural diff into path-level added/removed/changed entries"""
+    if patch is None:
+        return []
+    if "r" in patch:
+        return [{"path": path, "change": "changed", "old": old, "new": patch["r"]}]
+    if "d" in patch:
+        entries = [{"path": f"{path}.{key}".lstrip("."), "change": "removed", "old": old[key]} for key in patch["x"]]
+        for key, change in patch["d"].items():
+            if key not in old:
+                entries.append({"path": f"{path}.{key}".lstrip("."), "change": "added", "new": change["r"]})
+            else:
+                entries.extend(describe_snapshot_patch(old[key], change, f"{path}.{key}".lstrip(".")))
+        return entries
+    changes = patch["l"]
+    old_by_id = {element["id"]: element for element in old}
+    entries = [{"path": f"{path}[{element_id}]", "change": "removed", "old": old_by_id[element_id]} for element_id in changes["x"]]
+    entries += [{"path": f"{path}[{element['id']}]", "change": "added", "new": element} for element in changes["n"]]
+    for element_id, change in changes["d"].items():
+        entries.extend(describe_snapshot_patch(old_by_id[element_id], change, f"{path}[{element_id}]"))
+    if "order" in changes:
+        entries.append({"path": path, "change": "reordered", "new": changes["order"]})
+    return entries
+
+def cache_quotation_version(quotation_id: str, version_number: int, snapshot: Any):
+    _quotation_version_cache[(quotation_id, version_number)] = snapshot
+    _quotation_version_cache.move_to_end((quotation_id, version_number))
+    while len(_quotation_version_cache) > QUOTATION_VERSION_CACHE_SIZE:
+        _quotation_version_cache.popitem(last=False)
+
+async def materialize_quotation_version(quotation_id: str, version_number: int) -> Any:
+    """Reconstruct a version's snapshot (shared with the LRU cache, so callers must not mutate it)"""
+    cached = _quotation_version_cache.get((quotation_id, version_number))
+    if cached is not None:
+        _quotation_version_cache.move_to_end((quotation_id, version_number))
+        return cached
+    
+    target = await db.quotation_versions.find_one(
+        {"quotation_id": quotation_id, "version_number": version_number}, {"_id": 0, "snapshot_data": 0}
+    )
+    if not target:
+        raise HTTPException(status_code=404, detail="Quotation version not found")
+    anchor = target.get("anchor_version", version_number)
+    
+    # Start from the newest materialized version in the chain, falling back to its full snapshot
+    start, snapshot = anchor, None
+    for candidate in range(version_number - 1, anchor - 1, -1):
+        if (quotation_id, candidate) in _quotation_version_cache:
+            start, snapshot = candidate + 1, _quotation_version_cache[(quotation_id, candidate)]
+            break
+    
+    async for version in db.quotation_versions.find(
+        {"quotation_id": quotation_id, "version_number": {"$gte": start, "$lte": version_number}}
+    ).sort("version_number", 1):
+        encoding = version.get("encoding", "legacy")
+        if encoding == "full":
+            snapshot = decode_snapshot_data(version["snapshot_data"])
+        elif encoding == "delta":
+            snapshot = apply_snapshot_patch(snapshot, decode_snapshot_data(version["snapshot_data"]))
+        else:
+            # Versions written before delta encoding hold an unparseable repr string
+            snapshot = {"legacy_snapshot": version["snapshot_data"]}
+        cache_quotation_version(quotation_id, version["version_number"], snapshot)
+    return snapshot
+
+async def record_quotation_version(quotation_id: str, version_name: str, user_id: str, change_summary: Optional[str] = None) -> QuotationVersion:
+    """Store the quotation's current hierarchy as the next version, delta-encoded against the previous one"""
+    quotation = await db.quotations.find_one({"id": quotation_id}, {"_id": 0})
+    quotation["phases"] = await load_quotation_hierarchy(quotation_id)
+    snapshot = json.loads(canonical_snapshot_json(quotation))
+    
+    for attempt in range(QUOTATION_VERSION_INSERT_ATTEMPTS):
+        latest = await db.quotation_versions.find_one(
+            {"quotation_id": quotation_id}, {"_id": 0, "snapshot_data": 0}, sort=[("version_number", -1)]
+        )
+        version_number = latest["version_number"] + 1 if latest else 1
+        anchor = latest.get("anchor_version") if latest else None
+        if anchor is None or latest.get("encoding") not in ["full", "delta"] or version_number - anchor >= QUOTATION_VERSION_FULL_INTERVAL:
+            encoding, anchor, data = "full", version_number, encode_snapshot_data(snapshot)
+        else:
+            previous = await materialize_quotation_version(quotation_id, latest["version_number"])
+            encoding, data = "delta", encode_snapshot_data(snapshot_patch(previous, snapshot))
+        
+        version = QuotationVersion(
+            quotation_id=quotation_id,
+            version_number=version_number,
+            version_name=version_name,
+            encoding=encoding,
+            anchor_version=anchor,
+            snapshot_data=data,
+            snapshot_size=len(data),
+            change_summary=change_summary,
+            created_by=user_id
+        )
+        try:
+            # The unique (quotation_id, version_number) index rejects a number taken concurrently
+            await db.quotation_versions.insert_one(version.dict())
+        except DuplicateKeyError:
+            if attempt == QUOTATION_VERSION_INSERT_ATTEMPTS - 1:
+                raise
+        else:
+            cache_quotation_version(quotation_id, version_number, snapshot)
+            return version
+
+@api_router.get("/quotations/{quotation_id}/versions", response_model=APIResponse)
 @require_permission("/opportunities", "view")
-async def export_quotation(quotation_id: str, format: str, current_user: User = Depends(get_current_user)):
-    """Export quotation in specified format (pdf, excel, word)"""
+async def get_quotation_versions(quotation_id: str, current_user: User = Depends(get_current_user)):
+    """List a quotation's versions without their snapshot payloads"""
     try:
-        if format not in ["pdf", "excel", "word"]:
-            raise HTTPException(status_code=400, detail="Invalid export format")
-        
-        # Get quotation data
-        quotation_response = await get_quotation(quotation_id, current_user)
-        quotation_data = quotation_response.data
-        
-        # Get export template
-        template = await db.export_templates.find_one({
-            "template_type": format,
-            "is_default": True,
-            "is_deleted": False
+        versions = await db.quotation_versions.find(
+            {"quotation_id": quotation_id}, {"_id": 0, "snapshot_data": 0}
+        ).sort("version_number", -1).to_list(None)
+        return APIResponse(success=True, message="Quotation versions retrieved successfully", data=versions)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/quotations/{quotation_id}/versions/{version_number}", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def get_quotation_version(quotation_id: str, version_number: int, current_user: User = Depends(get_current_user)):
+    """Get the full quotation snapshot as it was at a version"""
+    try:
+        snapshot = await materialize_quotation_version(quotation_id, version_number)
+        return APIResponse(success=True, message="Quotation version retrieved successfully", data={
+            "version_number": version_number,
+            "snapshot": snapshot
         })
-        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/quotations/{quotation_id}/versions/{from_version}/diff/{to_version}", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def diff_quotation_versions(quotation_id: str, from_version: int, to_version: int, current_user: User = Depends(get_current_user)):
+    """List field-level changes between two versions of a quotation"""
+    try:
+        old = await materialize_quotation_version(quotation_id, from_version)
+        new = await materialize_quotation_version(quotation_id, to_version)
+        changes = describe_snapshot_patch(old, snapshot_patch(old, new))
+        return APIResponse(success=True, message="Quotation version diff retrieved successfully", data={
+            "from_version": from_version,
+            "to_version": to_version,
+            "changes": changes
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 7. Quotation Export
+# Exports are rendered in a process pool and cached on disk by (quotation content hash, template, format)
+QUOTATION_EXPORT_DIR = Path(os.environ.get('QUOTATION_EXPORT_DIR', str(ROOT_DIR / 'quotation_exports')))
+QUOTATION_EXPORT_WORKER_COUNT = int(os.environ.get('QUOTATION_EXPORT_WORKER_COUNT', '2'))
+QUOTATION_EXPORT_RETENTION_DAYS = int(os.environ.get('QUOTATION_EXPORT_RETENTION_DAYS', '30'))
+FILE_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+QUOTATION_EXPORT_FORMATS = {
+    "pdf": ("pdf", "application/pdf"),
+    "excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "word": ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+}
+QUOTATION_EXPORT_TEMPLATE_FIELDS = [
+    "id", "template_name", "company_branding", "include_cover_page", "include_terms",
+    "include_yearly_breakdown", "include_category_grouping"
+]
+QUOTATION_EXPORT_LINE_COLUMNS = ["Product", "SKU", "Qty", "Unit", "Net OTP", "Net Recurring", "Line Total"]
+
+_quotation_export_executor: Optional[ProcessPoolExecutor] = None
+_quotation_export_renders: Dict[str, asyncio.Future] = {}
+
+def quotation_export_executor() -> ProcessPoolExecutor:
+    """Process pool that keeps document rendering off the event loop"""
+    global _quotation_export_executor
+    if _quotation_export_executor is None:
+        _quotation_export_executor = ProcessPoolExecutor(max_workers=QUOTATION_EXPORT_WORKER_COUNT)
+    return _quotation_export_executor
+
+def format_export_amount(value: Any) -> str:
+    return f"{float(value or 0):,.2f}"
+
+def quotation_export_document(quotation: dict, template: dict) -> Dict[str, Any]:
+    """Format-neutral layout of an export: cover details, line sections, yearly breakdown and terms"""
+    try:
+        branding = json.loads(template.get("company_branding") or "{}")
+    except ValueError:
+        branding = {}
+    if not isinstance(branding, dict):
+        branding = {}
+    
+    sections: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    for phase in quotation["phases"]:
+        for group in phase["groups"]:
+            for item in group["items"]:
+                if template.get("include_category_grouping"):
+                    title = item.get("category") or "Uncategorized"
+                else:
+                    title = f"{phase['phase_name']} / {group['group_name']}"
+                line_total = (item.get("line_total_otp") or 0) + (item.get("line_total_recurring") or 0)
+                section = sections.setdefault(title, {"title": title, "rows": [], "subtotal": 0.0})
+                section["rows"].append([
+                    item.get("product_name") or "", item.get("sku_code") or "", item.get("quantity") or 0,
+                    item.get("unit_of_measure") or "", item.get("net_otp") or 0, item.get("net_recurring") or 0, line_total
+                ])
+                section["subtotal"] += line_total
+    
+    document = {
+        "title": f"Quotation {quotation.get('quotation_number', '')}",
+        "company_name": branding.get("company_name"),
+        "include_cover_page": bool(template.get("include_cover_page")),
+        "details": [
+            ("Customer", quotation.get("customer_name") or ""),
+            ("Quotation Date", quotation.get("quotation_date") or ""),
+            ("Valid Until", quotation.get("validity_date") or ""),
+            ("Currency", quotation.get("currency_code") or ""),
+            ("Status", quotation.get("status") or "")
+        ],
+        "notes": quotation.get("external_notes"),
+        "sections": list(sections.values()),
+        "summary": [("Total OTP", quotation.get("total_otp") or 0)],
+        "breakdown": None,
+        "terms": quotation.get("terms_and_conditions") if template.get("include_terms") else None
+    }
+    if quotation.get("overall_discount_type") and quotation.get("overall_discount_value"):
+        suffix = "%" if quotation["overall_discount_type"] == "percentage" else ""
+        document["summary"].append(("Overall Discount", f"{quotation['overall_discount_value']}{suffix}"))
+    document["summary"].append(("Grand Total", quotation.get("grand_total") or 0))
+    
+    if template.get("include_yearly_breakdown"):
+        # Trailing years with nothing allocated are left out
+        years = max([
+            year for year in range(1, QUOTATION_YEARS + 1)
+            if quotation.get(f"total_year{year}") or any(phase.get(f"phase_total_year{year}") for phase in quotation["phases"])
+        ] or [1])
+        columns = ["otp"] + [f"year{year}" for year in range(1, years + 1)]
+        document["breakdown"] = {
+            "header": ["", "OTP"] + [f"Year {year}" for year in range(1, years + 1)] + ["Total"],
+            "rows": [
+                [phase["phase_name"]] + [phase.get(f"phase_total_{column}") or 0 for column in columns] + [phase.get("phase_grand_total") or 0]
+                for phase in quotation["phases"]
+            ] + [
+                ["Total"] + [quotation.get(f"total_{column}") or 0 for column in columns] + [quotation.get("grand_total") or 0]
+            ]
+        }
+    return document
+
+def render_quotation_pdf(path: str, document: Dict[str, Any]):
+    styles = getSampleStyleSheet()
+    breakdown_width = len(document["breakdown"]["header"]) if document["breakdown"] else 0
+    pagesize = landscape(A4) if breakdown_width > 8 else A4
+    table_style = TableStyle([
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+        ("ALIGN", (2, 1), (-1, -1), "RIGHT")
+    ])
+    story = []
+    
+    story.append(Paragraph(escape(document["title"]), styles["Title"]))
+    if document["company_name"]:
+        story.append(Paragraph(escape(document["company_name"]), styles["Heading2"]))
+    story.append(Table([[label, value] for label, value in document["details"]], hAlign="LEFT"))
+    if document["notes"]:
+        story += [Spacer(1, 12), Paragraph(escape(document["notes"]), styles["Normal"])]
+    story.append(PageBreak() if document["include_cover_page"] else Spacer(1, 18))
+    
+    for section in document["sections"]:
+        rows = [
+            [name, sku, f"{quantity:g}", unit, format_export_amount(otp), format_export_amount(recurring), format_export_amount(total)]
+            for name, sku, quantity, unit, otp, recurring, total in section["rows"]
+        ]
+        rows.append(["Subtotal", "", "", "", "", "", format_export_amount(section["subtotal"])])
+        story.append(Paragraph(escape(section["title"]), styles["Heading3"]))
+        story.append(Table([QUOTATION_EXPORT_LINE_COLUMNS] + rows, repeatRows=1, hAlign="LEFT", style=table_style))
+    
+    story.append(Spacer(1, 12))
+    story.append(Table(
+        [[label, format_export_amount(value) if isinstance(value, (int, float)) else value] for label, value in document["summary"]],
+        hAlign="RIGHT", style=TableStyle([("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold")])
+    ))
+    if document["breakdown"]:
+        rows = [[row[0]] + [format_export_amount(value) for value in row[1:]] for row in document["breakdown"]["rows"]]
+        story.append(Paragraph("Yearly Breakdown", styles["Heading3"]))
+        story.append(Table([document["breakdown"]["header"]] + rows, repeatRows=1, hAlign="LEFT", style=table_style))
+    if document["terms"]:
+        story.append(Paragraph("Terms and Conditions", styles["Heading3"]))
+        story += [Paragraph(escape(line), styles["Normal"]) for line in document["terms"].splitlines() if line.strip()]
+    
+    SimpleDocTemplate(path, pagesize=pagesize, title=document["title"]).build(story)
+
+def render_quotation_xlsx(path: str, document: Dict[str, Any]):
+    workbook = Workbook()
+    bold = Font(bold=True)
+    amount_format = "#,##0.00"
+    
+    summary = workbook.active
+    summary.title = "Summary"
+    summary.append([document["title"]])
+    summary["A1"].font = Font(bold=True, size=14)
+    if document["company_name"]:
+        summary.append([document["company_name"]])
+    summary.append([])
+    for label, value in document["details"] + document["summary"]:
+        summary.append([label, value])
+        summary.cell(row=summary.max_row, column=1).font = bold
+        summary.cell(row=summary.max_row, column=2).number_format = amount_format
+    if document["notes"]:
+        summary.append([])
+        summary.append(["Notes", document["notes"]])
+    if document["terms"]:
+        summary.append([])
+        summary.append(["Terms and Conditions", document["terms"]])
+    summary.column_dimensions["A"].width = 22
+    summary.column_dimensions["B"].width = 60
+    
+    lines = workbook.create_sheet("Line Items")
+    lines.append(["Section"] + QUOTATION_EXPORT_LINE_COLUMNS)
+    for section in document["sections"]:
+        for row in section["rows"]:
+            lines.append([section["title"]] + row)
+        lines.append([section["title"], "Subtotal", None, None, None, None, None, section["subtotal"]])
+        lines.cell(row=lines.max_row, column=2).font = bold
+    for column in "FGH":
+        for cell in lines[column][1:]:
+            cell.number_format = amount_format
+    for cell in lines[1]:
+        cell.font = bold
+    lines.freeze_panes = "A2"
+    lines.column_dimensions["A"].width = 30
+    lines.column_dimensions["B"].width = 40
+    
+    if document["breakdown"]:
+        breakdown = workbook.create_sheet("Yearly Breakdown")
+        breakdown.append(document["breakdown"]["header"])
+        for row in document["breakdown"]["rows"]:
+            breakdown.append(row)
+        for row in breakdown.iter_rows(min_row=2, min_col=2):
+            for cell in row:
+                cell.number_format = amount_format
+        for cell in breakdown[1] + breakdown[breakdown.max_row]:
+            cell.font = bold
+        breakdown.column_dimensions["A"].width = 30
+    
+    workbook.save(path)
+
+def render_quotation_docx(path: str, document: Dict[str, Any]):
+    docx = Document()
+    docx.add_heading(document["title"], level=0)
+    if document["company_name"]:
+        docx.add_heading(document["company_name"], level=2)
+    details = docx.add_table(rows=0, cols=2)
+    for label, value in document["details"]:
+        cells = details.add_row().cells
+        cells[0].text, cells[1].text = label, str(value)
+    if document["notes"]:
+        docx.add_paragraph(document["notes"])
+    if document["include_cover_page"]:
+        docx.add_page_break()
+    
+    def add_table(header: List[str], rows: List[List[str]]):
+        table = docx.add_table(rows=1, cols=len(header))
+        table.style = "Table Grid"
+        for cell, text in zip(table.rows[0].cells, header):
+            cell.text = text
+        for row in rows:
+            for cell, text in zip(table.add_row().cells, row):
+                cell.text = text
+    
+    for section in document["sections"]:
+        docx.add_heading(section["title"], level=3)
+        add_table(QUOTATION_EXPORT_LINE_COLUMNS, [
+            [name, sku, f"{quantity:g}", unit, format_export_amount(otp), format_export_amount(recurring), format_export_amount(total)]
+            for name, sku, quantity, unit, otp, recurring, total in section["rows"]
+        ] + [["Subtotal", "", "", "", "", "", format_export_amount(section["subtotal"])]])
+    
+    docx.add_heading("Summary", level=3)
+    add_table(["", ""], [
+        [label, format_export_amount(value) if isinstance(value, (int, float)) else value] for label, value in document["summary"]
+    ])
+    if document["breakdown"]:
+        docx.add_heading("Yearly Breakdown", level=3)
+        add_table(document["breakdown"]["header"], [
+            [row[0]] + [format_export_amount(value) for value in row[1:]] for row in document["breakdown"]["rows"]
+        ])
+    if document["terms"]:
+        docx.add_heading("Terms and Conditions", level=3)
+        docx.add_paragraph(document["terms"])
+    
+    docx.save(path)
+
+QUOTATION_EXPORT_RENDERERS = {"pdf": render_quotation_pdf, "excel": render_quotation_xlsx, "word": render_quotation_docx}
+
+def render_quotation_export(path: str, format: str, quotation: dict, template: dict):
+    """Render one export file (runs in the process pool), then prune stale files for the quotation"""
+    target = Path(path)
+    staging = target.with_name(f".{uuid.uuid4().hex}-{target.name}")
+    try:
+        QUOTATION_EXPORT_RENDERERS[format](str(staging), quotation_export_document(quotation, template))
+        os.replace(staging, target)
+    finally:
+        staging.unlink(missing_ok=True)
+    
+    expires = datetime.now().timestamp() - QUOTATION_EXPORT_RETENTION_DAYS * 86400
+    for cached in target.parent.iterdir():
+        try:
+            if cached.stat().st_mtime < expires:
+                cached.unlink()
+        except FileNotFoundError:
+            pass
+
+async def quotation_export_payload(quotation: dict) -> dict:
+    """The quotation hierarchy plus the lookups renderers need, normalized to plain JSON"""
+    quotation["phases"] = await load_quotation_hierarchy(quotation["id"])
+    currency = await db.master_currencies.find_one({"currency_id": quotation.get("currency_id")}, {"_id": 0, "currency_code": 1})
+    quotation["currency_code"] = currency["currency_code"] if currency else quotation.get("currency_id")
+    catalog = await get_quotation_catalog()
+    for phase in quotation["phases"]:
+        for group in phase["groups"]:
+            for item in group["items"]:
+                item["category"] = catalog["products"].get(item.get("core_product_id"), {}).get("primary_category")
+    return json.loads(canonical_snapshot_json(quotation))
+
+async def resolve_export_template(format: str, template_id: Optional[str]) -> dict:
+    if template_id:
+        template = await db.export_templates.find_one({"id": template_id, "is_deleted": False}, {"_id": 0})
         if not template:
-            template = await db.export_templates.find_one({
-                "template_type": format,
-                "is_deleted": False
-            })
-        
-        # Generate export file (mock implementation)
-        export_filename = f"quotation_{quotation_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
-        
-        # Log audit trail
-        audit_log = QuotationAuditLog(
-            quotation_id=quotation_id,
-            table_name="quotations",
-            record_id=quotation_id,
-            action="export",
-            user_id=current_user.id,
-            user_role="user",
-            new_value=f"Export format: {format}"
+            raise HTTPException(status_code=404, detail="Export template not found")
+        if template["template_type"] != format:
+            raise HTTPException(status_code=400, detail=f"Template is for {template['template_type']} exports")
+        return template
+    
+    template = await db.export_templates.find_one(
+        {"template_type": format, "is_active": True, "is_deleted": False}, {"_id": 0}, sort=[("is_default", -1)]
+    )
+    return template or ExportTemplate(id="default", template_name="Default", template_type=format).dict()
+
+async def ensure_quotation_export(path: Path, format: str, quotation: dict, template: dict) -> bool:
+    """Render the export unless it is cached; concurrent requests for one file share a render"""
+    if path.exists():
+        os.utime(path)
+        return True
+    
+    render = _quotation_export_renders.get(str(path))
+    if render is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        render = asyncio.get_running_loop().run_in_executor(
+            quotation_export_executor(), render_quotation_export, str(path), format, quotation, template
         )
-        await db.quotation_audit_log.insert_one(audit_log.dict())
-        
+        _quotation_export_renders[str(path)] = render
+        render.add_done_callback(lambda _: _quotation_export_renders.pop(str(path), None))
+    await asyncio.shield(render)
+    return False
+
+def byte_range(range_header: Optional[str], size: int) -> Optional[tuple]:
+    """Resolve a single `bytes=` range to (start, end); None means send the whole file"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (range_header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def stream_file_range(path: Path, start: int, end: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(FILE_DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def file_download_response(request: Request, path: Path, media_type: str, download_name: str, etag: str, cache_control: str):
+    """Serve a file as an attachment with ETag revalidation and single byte-range support"""
+    etag = f'"{etag}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": cache_control,
+        "Content-Disposition": f'attachment; filename="{re.sub(r"[^A-Za-z0-9._-]", "_", download_name)}"'
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    size = path.stat().st_size
+    if_range = request.headers.get("if-range")
+    requested = byte_range(request.headers.get("range"), size) if if_range in (None, etag) else None
+    if requested is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    
+    start, end = requested
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+    return StreamingResponse(stream_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+async def export_quotation_file(quotation_id: str, format: str, template_id: Optional[str], user_id: str) -> Dict[str, Any]:
+    """Render (or reuse) a quotation export and record it in the audit trail"""
+    if format not in QUOTATION_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid export format")
+    
+    quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False}, {"_id": 0})
+    if not quotation:
+        raise HTTPException(status_code=404, detail="Quotation not found")
+    template = await resolve_export_template(format, template_id)
+    template_settings = {field: template.get(field) for field in QUOTATION_EXPORT_TEMPLATE_FIELDS}
+    
+    payload = await quotation_export_payload(quotation)
+    version_hash = hashlib.sha256(canonical_snapshot_json(payload)).hexdigest()
+    export_key = hashlib.sha256(canonical_snapshot_json([version_hash, template_settings, format])).hexdigest()[:40]
+    extension, media_type = QUOTATION_EXPORT_FORMATS[format]
+    export_filename = f"{export_key}.{extension}"
+    path = QUOTATION_EXPORT_DIR / quotation_id / export_filename
+    cached = await ensure_quotation_export(path, format, payload, template_settings)
+    
+    # Log audit trail
+    audit_log = QuotationAuditLog(
+        quotation_id=quotation_id,
+        table_name="quotations",
+        record_id=quotation_id,
+        action="export",
+        user_id=user_id,
+        user_role="user",
+        new_value=f"Export format: {format}"
+    )
+    await db.quotation_audit_log.insert_one(audit_log.dict())
+    
+    return {
+        "path": path,
+        "media_type": media_type,
+        "filename": f"{quotation['quotation_number']}.{extension}",
+        "download_url": f"/api/quotations/{quotation_id}/exports/{export_filename}",
+        "version_hash": version_hash,
+        "cached": cached,
+        "template_used": template.get("template_name", "Default")
+    }
+
+@api_router.get("/quotations/{quotation_id}/export/{format}", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def export_quotation(quotation_id: str, format: str, template_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Export quotation in specified format (pdf, excel, word) and return its download URL"""
+    try:
+        export = await export_quotation_file(quotation_id, format, template_id, current_user.id)
         return APIResponse(
             success=True, 
             message=f"Quotation exported successfully",
-            data={
-                "filename": export_filename,
-                "quotation_data": quotation_data,
-                "template_used": template.get("template_name", "Default") if template else "Default"
-            }
+            data={key: value for key, value in export.items() if key not in ["path", "media_type"]}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/quotations/{quotation_id}/exports/{export_filename}")
+@require_permission("/opportunities", "view")
+async def download_quotation_export(quotation_id: str, export_filename: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Serve a rendered export; files are content-addressed, so they are immutable and support range requests"""
+    try:
+        match = re.fullmatch(r"([0-9a-f]{40})\.(pdf|xlsx|docx)", export_filename)
+        quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False}, {"_id": 0, "quotation_number": 1})
+        path = QUOTATION_EXPORT_DIR / quotation_id / export_filename
+        if not match or not quotation or not path.is_file():
+            raise HTTPException(status_code=404, detail="Export not found")
+        
+        media_type = next(media for extension, media in QUOTATION_EXPORT_FORMATS.values() if extension == match.group(2))
+        return file_download_response(
+            request, path, media_type, f"{quotation['quotation_number']}.{match.group(2)}", match.group(1),
+            "private, max-age=31536000, immutable"
         )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 7. Discount Rules Management
+# 8. Discount Rules Management
+# Active rules are compiled into per-product / per-category / unrestricted buckets, each sorted by
+# min_quantity, so a whole quotation is matched with a few vectorized interval tests per bucket
+DISCOUNT_RULE_TYPES = ["percentage", "absolute", "tiered"]
+DISCOUNT_RULE_LIST_FIELDS = ["applicable_categories", "applicable_products", "customer_segments"]
+DISCOUNT_RULE_CACHE_TTL_SECONDS = 300
+DISCOUNT_SEGMENT_FIELDS = ["company_type_id", "industry_id", "sub_industry_id"]
+
+_discount_rule_index_cache: Dict[str, tuple] = {}
+
+def parse_discount_rule_list(value: Optional[str]) -> List[str]:
+    """Rule scopes are stored as JSON arrays; plain comma-separated strings are accepted too"""
+    if not value:
+        return []
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        parsed = value.split(",")
+    if not isinstance(parsed, list):
+        parsed = [parsed]
+    return [str(entry).strip() for entry in parsed if str(entry).strip()]
+
+def validate_discount_rule(rule: DiscountRule):
+    if rule.discount_type not in DISCOUNT_RULE_TYPES:
+        raise HTTPException(status_code=400, detail=f"discount_type must be one of: {', '.join(DISCOUNT_RULE_TYPES)}")
+    if rule.discount_value < 0 or (rule.discount_type != "absolute" and rule.discount_value > 100):
+        raise HTTPException(status_code=400, detail="discount_value is out of range")
+    if rule.max_quantity is not None and rule.max_quantity <= rule.min_quantity:
+        raise HTTPException(status_code=400, detail="max_quantity must be greater than min_quantity")
+    if rule.max_value is not None and rule.max_value <= rule.min_value:
+        raise HTTPException(status_code=400, detail="max_value must be greater than min_value")
+    if rule.valid_from and rule.valid_to and rule.valid_to[:10] < rule.valid_from[:10]:
+        raise HTTPException(status_code=400, detail="valid_to must not be before valid_from")
+    for field in DISCOUNT_RULE_LIST_FIELDS:
+        entries = parse_discount_rule_list(getattr(rule, field))
+        setattr(rule, field, json.dumps(entries) if entries else None)
+
+def compile_discount_rules(rules: List[dict]) -> Dict[str, Any]:
+    """Index rules in priority order; a rule scoped to products is indexed by product (its categories
+    become an extra filter), otherwise by category, otherwise it is unrestricted"""
+    rules = sorted(rules, key=lambda rule: (rule.get("priority_order", 100), rule["id"]))
+    
+    def bounds(field: str, default: float) -> np.ndarray:
+        return np.array([default if rule.get(field) is None else float(rule[field]) for rule in rules], dtype=np.float64)
+    
+    index = {
+        "rules": rules,
+        "min_quantity": bounds("min_quantity", 0.0),
+        "max_quantity": bounds("max_quantity", np.inf),
+        "min_value": bounds("min_value", 0.0),
+        "max_value": bounds("max_value", np.inf),
+        "categories": [set(parse_discount_rule_list(rule.get("applicable_categories"))) or None for rule in rules],
+        "segments": [set(parse_discount_rule_list(rule.get("customer_segments"))) or None for rule in rules]
+    }
+    by_product: Dict[str, List[int]] = {}
+    by_category: Dict[str, List[int]] = {}
+    unrestricted: List[int] = []
+    for position, rule in enumerate(rules):
+        products = parse_discount_rule_list(rule.get("applicable_products"))
+        if products:
+            for product in products:
+                by_product.setdefault(product, []).append(position)
+        elif index["categories"][position]:
+            for category in index["categories"][position]:
+                by_category.setdefault(category, []).append(position)
+        else:
+            unrestricted.append(position)
+    
+    def bucket(positions: List[int]) -> np.ndarray:
+        return np.array(sorted(positions, key=lambda position: index["min_quantity"][position]), dtype=np.int64)
+    
+    index["by_product"] = {key: bucket(positions) for key, positions in by_product.items()}
+    index["by_category"] = {key: bucket(positions) for key, positions in by_category.items()}
+    index["unrestricted"] = bucket(unrestricted)
+    return index
+
+async def get_discount_rule_index() -> Dict[str, Any]:
+    """Compiled index of active rules, rebuilt when rules change or the TTL lapses"""
+    cached = _discount_rule_index_cache.get("index")
+    now = datetime.now(timezone.utc)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    rules = await db.discount_rules.find({"is_active": True, "is_deleted": False}, {"_id": 0}).to_list(None)
+    index = compile_discount_rules(rules)
+    _discount_rule_index_cache["index"] = (now + timedelta(seconds=DISCOUNT_RULE_CACHE_TTL_SECONDS), index)
+    return index
+
+def discount_evaluation_lines(items: List[dict], catalog: Dict[str, Dict[str, Any]]) -> List[dict]:
+    """Quantity, category and gross contract value (OTP plus prorated recurring) for each item"""
+    months = np.array([item.get("contract_duration_months") or 12 for item in items], dtype=np.float64)
+    terms = np.clip((months[:, None] - 12 * np.arange(QUOTATION_YEARS)) / 12, 0, 1).sum(axis=1)
+    lines = []
+    for item, term in zip(items, terms):
+        quantity = float(item.get("quantity") or 0)
+        product = catalog["products"].get(item.get("core_product_id"), {})
+        lines.append({
+            "id": item.get("id"),
+            "core_product_id": item.get("core_product_id"),
+            "sku_code": item.get("sku_code") or product.get("skucode"),
+            "category": item.get("category") or product.get("primary_category"),
+            "quantity": quantity,
+            "line_value": quantity * (float(item.get("base_otp") or 0) + float(item.get("base_recurring") or 0) * float(term))
+        })
+    return lines
+
+def apply_discount_rules(line: dict, positions: List[int], rules: List[dict]) -> Dict[str, Any]:
+    """The highest-priority match wins; when it is stackable every matching stackable rule applies,
+    each percentage taken on what is left after the previous ones"""
+    line_value = line["line_value"]
+    remaining, applied, approval_rules = line_value, [], []
+    if positions:
+        chosen = [position for position in positions if rules[position].get("stackable")] if rules[positions[0]].get("stackable") else positions[:1]
+        for position in chosen:
+            if remaining <= 0:
+                break
+            rule = rules[position]
+            if rule["discount_type"] == "absolute":
+                amount = float(rule["discount_value"])
+            else:
+                # Tiered rules express each tier as its own quantity/value band with a percentage
+                amount = remaining * float(rule["discount_value"]) / 100
+            capped = rule.get("max_discount_amount") is not None and amount > rule["max_discount_amount"]
+            amount = min(float(rule["max_discount_amount"]) if capped else amount, remaining)
+            remaining -= amount
+            applied.append({
+                "rule_id": rule["id"],
+                "rule_name": rule["rule_name"],
+                "discount_type": rule["discount_type"],
+                "discount_value": rule["discount_value"],
+                "discount_amount": round(amount, 2),
+                "capped": capped
+            })
+            if rule.get("requires_approval") and (rule.get("approval_threshold") is None or line_value >= rule["approval_threshold"]):
+                approval_rules.append(rule["id"])
+    
+    discount = line_value - remaining
+    return {
+        "item_id": line.get("id"),
+        "line_value": round(line_value, 2),
+        "discount_amount": round(discount, 2),
+        "discount_percentage": round(100 * discount / line_value, 4) if line_value else 0.0,
+        "net_value": round(remaining, 2),
+        "applied_rules": applied,
+        "requires_approval": bool(approval_rules),
+        "approval_rules": approval_rules
+    }
+
+def evaluate_discount_lines(index: Dict[str, Any], lines: List[dict], segments: set, as_of: str) -> List[Dict[str, Any]]:
+    """Match every line against the compiled rules in one batch, then resolve priority, stacking and caps"""
+    rules = index["rules"]
+    quantities = np.array([line["quantity"] for line in lines], dtype=np.float64)
+    values = np.array([line["line_value"] for line in lines], dtype=np.float64)
+    # Validity and customer segment are the same for every line, so they are resolved once per rule
+    eligible = np.array([
+        (not rule.get("valid_from") or rule["valid_from"][:10] <= as_of)
+        and (not rule.get("valid_to") or as_of <= rule["valid_to"][:10])
+        and (index["segments"][position] is None or bool(index["segments"][position] & segments))
+        for position, rule in enumerate(rules)
+    ], dtype=bool)
+    matches: List[set] = [set() for _ in lines]
+    
+    def match_bucket(positions: np.ndarray, line_indices: List[int], check_categories: bool):
+        if not len(positions) or not line_indices:
+            return
+        line_indices = np.array(line_indices, dtype=np.int64)
+        q, v = quantities[line_indices][:, None], values[line_indices][:, None]
+        # Buckets are sorted by min_quantity, so a line's candidates are the prefix with min_quantity <= q
+        candidates = np.searchsorted(index["min_quantity"][positions], q[:, 0], side="right")
+        mask = (
+            (np.arange(len(positions))[None, :] < candidates[:, None])
+            & (q < index["max_quantity"][positions][None, :])
+            & (v >= index["min_value"][positions][None, :])
+            & (v < index["max_value"][positions][None, :])
+            & eligible[positions][None, :]
+        )
+        for row, column in zip(*np.nonzero(mask)):
+            line_index, position = int(line_indices[row]), int(positions[column])
+            categories = index["categories"][position]
+            if check_categories and categories is not None and lines[line_index]["category"] not in categories:
+                continue
+            matches[line_index].add(position)
+    
+    product_lines: Dict[str, List[int]] = {}
+    category_lines: Dict[str, List[int]] = {}
+    for line_index, line in enumerate(lines):
+        for key in {line.get("core_product_id"), line.get("sku_code")} - {None, ""}:
+            product_lines.setdefault(key, []).append(line_index)
+        if line.get("category"):
+            category_lines.setdefault(line["category"], []).append(line_index)
+    for key, line_indices in product_lines.items():
+        if key in index["by_product"]:
+            match_bucket(index["by_product"][key], line_indices, True)
+    for key, line_indices in category_lines.items():
+        if key in index["by_category"]:
+            match_bucket(index["by_category"][key], line_indices, False)
+    match_bucket(index["unrestricted"], list(range(len(lines))), False)
+    
+    # Positions follow priority order, so sorting a line's matches ranks them
+    return [apply_discount_rules(line, sorted(found), rules) for line, found in zip(lines, matches)]
+
+def summarize_discount_evaluation(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "line_count": len(results),
+        "discounted_lines": sum(1 for result in results if result["applied_rules"]),
+        "lines_requiring_approval": sum(1 for result in results if result["requires_approval"]),
+        "total_value": round(sum(result["line_value"] for result in results), 2),
+        "total_discount": round(sum(result["discount_amount"] for result in results), 2)
+    }
+
+async def quotation_customer_segments(quotation: dict) -> set:
+    """Segment keys of the quotation's customer company (company type, industry, sub-industry)"""
+    opportunity = await db.opportunities.find_one({"id": quotation.get("opportunity_id")}, {"_id": 0, "company_id": 1})
+    if not opportunity or not opportunity.get("company_id"):
+        return set()
+    company = await db.companies.find_one({"company_id": opportunity["company_id"]}, {"_id": 0})
+    return {company[field] for field in DISCOUNT_SEGMENT_FIELDS if company and company.get(field)}
+
 @api_router.get("/discount-rules", response_model=APIResponse)
 @require_permission("/opportunities", "view")
 async def get_discount_rules(current_user: User = Depends(get_current_user)):
@@ -12710,7 +16884,120 @@ async def get_discount_rules(current_user: User = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 8. Customer Quotation Access
+@api_router.post("/discount-rules", response_model=APIResponse)
+@require_permission("/master-data", "create")
+async def create_discount_rule(rule_data: DiscountRule, current_user: User = Depends(get_current_user)):
+    """Create a discount rule"""
+    try:
+        validate_discount_rule(rule_data)
+        rule_data.created_by = current_user.id
+        rule_dict = rule_data.dict()
+        
+        await db.discount_rules.insert_one(rule_dict)
+        _discount_rule_index_cache.clear()
+        rule_dict.pop("_id", None)
+        
+        return APIResponse(success=True, message="Discount rule created successfully", data=rule_dict)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.put("/discount-rules/{rule_id}", response_model=APIResponse)
+@require_permission("/master-data", "edit")
+async def update_discount_rule(rule_id: str, rule_data: DiscountRule, current_user: User = Depends(get_current_user)):
+    """Update a discount rule"""
+    try:
+        existing = await db.discount_rules.find_one({"id": rule_id, "is_deleted": False})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Discount rule not found")
+        
+        validate_discount_rule(rule_data)
+        rule_data.modified_by = current_user.id
+        rule_data.updated_at = datetime.now(timezone.utc)
+        update_dict = rule_data.dict(exclude={"id", "created_by", "created_at", "is_deleted"})
+        
+        await db.discount_rules.update_one({"id": rule_id}, {"$set": update_dict})
+        _discount_rule_index_cache.clear()
+        
+        updated_rule = await db.discount_rules.find_one({"id": rule_id}, {"_id": 0})
+        return APIResponse(success=True, message="Discount rule updated successfully", data=updated_rule)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.delete("/discount-rules/{rule_id}", response_model=APIResponse)
+@require_permission("/master-data", "delete")
+async def delete_discount_rule(rule_id: str, current_user: User = Depends(get_current_user)):
+    """Soft delete a discount rule"""
+    try:
+        result = await db.discount_rules.update_one(
+            {"id": rule_id, "is_deleted": False},
+            {"$set": {"is_deleted": True, "modified_by": current_user.id, "updated_at": datetime.now(timezone.utc)}}
+        )
+        _discount_rule_index_cache.clear()
+        
+        if result.modified_count == 0:
+            raise HTTPException(status_code=404, detail="Discount rule not found")
+        
+        return APIResponse(success=True, message="Discount rule deleted successfully", data={"id": rule_id})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/discount-rules/evaluate", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def evaluate_discount_rules(request_data: dict, current_user: User = Depends(get_current_user)):
+    """Evaluate unsaved lines (core_product_id, quantity, base_otp, base_recurring, contract_duration_months)"""
+    try:
+        items = request_data.get("lines") or []
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise HTTPException(status_code=400, detail="lines must be a list of objects")
+        as_of = (request_data.get("as_of") or datetime.now(timezone.utc).strftime('%Y-%m-%d'))[:10]
+        segments = set(request_data.get("customer_segments") or [])
+        
+        lines = discount_evaluation_lines(items, await get_quotation_catalog())
+        results = evaluate_discount_lines(await get_discount_rule_index(), lines, segments, as_of)
+        return APIResponse(success=True, message="Discount rules evaluated successfully", data={
+            "as_of": as_of,
+            "lines": results,
+            "summary": summarize_discount_evaluation(results)
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/quotations/{quotation_id}/discounts/evaluate", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def evaluate_quotation_discounts(quotation_id: str, current_user: User = Depends(get_current_user)):
+    """Evaluate every item of a quotation against the discount rules in one batch"""
+    try:
+        quotation = await db.quotations.find_one({"id": quotation_id, "is_deleted": False}, {"_id": 0})
+        if not quotation:
+            raise HTTPException(status_code=404, detail="Quotation not found")
+        
+        items = [item for phase in await load_quotation_hierarchy(quotation_id) for group in phase["groups"] for item in group["items"]]
+        as_of = (quotation.get("quotation_date") or datetime.now(timezone.utc).strftime('%Y-%m-%d'))[:10]
+        segments = await quotation_customer_segments(quotation)
+        
+        lines = discount_evaluation_lines(items, await get_quotation_catalog())
+        results = evaluate_discount_lines(await get_discount_rule_index(), lines, segments, as_of)
+        return APIResponse(success=True, message="Quotation discounts evaluated successfully", data={
+            "quotation_id": quotation_id,
+            "as_of": as_of,
+            "customer_segments": sorted(segments),
+            "lines": results,
+            "summary": summarize_discount_evaluation(results)
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 9. Customer Quotation Access
 @api_router.post("/quotations/{quotation_id}/generate-access-token", response_model=APIResponse)
 @require_permission("/opportunities", "edit")
 async def generate_customer_access_token(quotation_id: str, access_data: dict, current_user: User = Depends(get_current_user)):
@@ -12924,6 +17211,7 @@ async def create_product(product_data: CoreProductModel, current_user: User = De
         product_dict = product_data.dict()
         
         result = await db.core_product_model.insert_one(product_dict)
+        _quotation_catalog_cache.clear()
         product_dict.pop("_id", None)
         
         return APIResponse(success=True, message="Product created successfully", data=product_dict)
@@ -12959,6 +17247,7 @@ async def update_product(product_id: str, product_data: CoreProductModel, curren
             {"id": product_id},
             {"$set": update_dict}
         )
+        _quotation_catalog_cache.clear()
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Product not found or no changes made")
@@ -12981,6 +17270,7 @@ async def delete_product(product_id: str, current_user: User = Depends(get_curre
             {"id": product_id, "is_deleted": False},
             {"$set": {"is_deleted": True, "updated_at": datetime.now(timezone.utc)}}
         )
+        _quotation_catalog_cache.clear()
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Product not found")
@@ -13110,6 +17400,7 @@ async def create_pricing_model(pricing_data: PricingModel, current_user: User =
         
         pricing_dict = pricing_data.dict()
         result = await db.pricing_models.insert_one(pricing_dict)
+        _quotation_catalog_cache.clear()
         pricing_dict.pop("_id", None)
         
         return APIResponse(success=True, message="Pricing model created successfully", data=pricing_dict)
@@ -13141,6 +17432,7 @@ async def update_pricing_model(pricing_model_id: str, pricing_data: PricingModel
             {"id": pricing_model_id},
             {"$set": update_dict}
         )
+        _quotation_catalog_cache.clear()
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Pricing model not found or no changes made")
@@ -13163,6 +17455,7 @@ async def delete_pricing_model(pricing_model_id: str, current_user: User = Depen
             {"id": pricing_model_id, "is_deleted": False},
             {"$set": {"is_deleted": True, "updated_at": datetime.now(timezone.utc)}}
         )
+        _quotation_catalog_cache.clear()
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Pricing model not found")
@@ -13296,6 +17589,70 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Long-running background tasks started with the app
+background_tasks: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await db.opportunity_kpi_snapshots.create_index([("period", 1), ("owner_id", 1), ("stage_id", 1)], unique=True)
+    if await db.opportunity_kpi_snapshots.count_documents({}, limit=1) == 0:
+        await rebuild_opportunity_kpi_snapshots()
+    background_tasks.append(asyncio.create_task(run_nightly_kpi_snapshot_rebuild()))
+    background_tasks.append(asyncio.create_task(run_live_update_change_stream()))
+    
+    await db.pipeline_board_view.create_index("id", unique=True)
+    await db.pipeline_board_view.create_index([("current_stage_code", 1), ("updated_at", -1)])
+    await db.pipeline_board_view.create_index([("owner_id", 1), ("updated_at", -1)])
+    await db.pipeline_board_view.create_index("updated_at")
+    await db.sd_upcoming_view.create_index("opportunity_id", unique=True)
+    await db.sd_upcoming_view.create_index([("stage_rank", 1), ("created_at", 1)])
+    await db.quotation_inbox_view.create_index("id", unique=True)
+    await db.quotation_inbox_view.create_index([("status", 1), ("updated_at", -1)])
+    await db.quotation_inbox_view.create_index([("owner_id", 1), ("status", 1), ("updated_at", -1)])
+    background_tasks.append(asyncio.create_task(run_projection_consumer()))
+    if await db.pipeline_board_view.count_documents({}, limit=1) == 0:
+        background_tasks.append(asyncio.create_task(rebuild_projections()))
+    
+    await db.quotation_phases.create_index([("quotation_id", 1), ("phase_order", 1)])
+    await db.quotation_groups.create_index([("phase_id", 1), ("group_order", 1)])
+    await db.quotation_items.create_index([("group_id", 1), ("item_order", 1)])
+    try:
+        await db.quotation_versions.create_index([("quotation_id", 1), ("version_number", -1)], unique=True)
+    except OperationFailure as e:
+        print(f"Warning: Could not create unique quotation version index (duplicate version numbers?): {str(e)}")
+    background_tasks.append(asyncio.create_task(migrate_quotation_item_yearly()))
+    await db.audit_events.create_index([("entity_type", 1), ("entity_id", 1), ("timestamp", -1), ("id", -1)])
+    for collection_name, specs in DENORMALIZED_DISPLAY_FIELDS.items():
+        for _, key_field, _ in specs:
+            await db[collection_name].create_index(key_field)
+    background_tasks.append(asyncio.create_task(backfill_display_fields()))
+    await db.outbox_events.create_index("id", unique=True)
+    await db.outbox_events.create_index([("status", 1), ("available_at", 1)])
+    await db.outbox_events.create_index("processed_at", expireAfterSeconds=OUTBOX_RETENTION_DAYS * 86400)
+    try:
+        # One open SDR per opportunity; the service_delivery outbox handler upserts against it
+        await db.service_delivery_requests.create_index(
+            "opportunity_id", unique=True, partialFilterExpression={"is_deleted": False}
+        )
+    except OperationFailure as e:
+        print(f"Warning: Could not create unique SDR index (duplicate open SDRs?): {str(e)}")
+    for _ in range(OUTBOX_WORKER_COUNT):
+        background_tasks.append(asyncio.create_task(run_outbox_worker()))
+    background_tasks.append(asyncio.create_task(run_nightly_analytics_snapshot_export()))
+    await db.export_jobs.create_index("id", unique=True)
+    await db.export_jobs.create_index([("status", 1), ("created_at", 1)])
+    await db.export_jobs.create_index([("user_id", 1), ("created_at", -1)])
+    await db.export_jobs.create_index("completed_at", expireAfterSeconds=EXPORT_JOB_HISTORY_DAYS * 86400)
+    for _ in range(EXPORT_JOB_WORKER_COUNT):
+        background_tasks.append(asyncio.create_task(run_export_job_worker()))
+    background_tasks.append(asyncio.create_task(run_export_job_cleanup()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    if _analytics_executor is not None:
+        _analytics_executor.shutdown(wait=False, cancel_futures=True)
+    if _quotation_export_executor is not None:
+        _quotation_export_executor.shutdown(wait=False, cancel_futures=True)
     client.close()
\ No newline at end of file
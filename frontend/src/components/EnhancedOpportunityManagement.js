@@ -1289,9 +1289,20 @@ const EnhancedOpportunityManagement = () => {
       });
 
       if (response.data.success) {
+        const { download_url, filename } = response.data.data;
+        const file = await axios.get(`${API_BASE_URL}${download_url}`, {
+          headers: getAuthHeaders(),
+          responseType: 'blob'
+        });
+        const url = window.URL.createObjectURL(file.data);
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = filename;
+        document.body.appendChild(a);
+        a.click();
+        window.URL.revokeObjectURL(url);
+        document.body.removeChild(a);
         toast.success(`Quotation exported as ${format.toUpperCase()}`);
-        // In a real implementation, this would trigger a file download
-        console.log('Export data:', response.data.data);
       }
     } catch (error) {
       console.error('Error exporting quotation:', error);
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from server import ANALYTICS_MAX_ROWS, HTTPException, build_analytics_query_spec
+
+COLUMNS = {"id": "string", "stage": "string", "owner": "string", "amount": "number", "created_at": "datetime"}
+
+
+def test_group_by_defaults_to_count():
+    spec = build_analytics_query_spec({"group_by": "stage"}, COLUMNS)
+    assert spec["type"] == "group_by"
+    assert spec["group_by"] == ["stage"]
+    assert spec["metrics"] == [{"name": "count", "field": "id", "aggregation": "count"}]
+    assert spec["columns"] == ["stage", "id"]
+    assert spec["limit"] == 1000
+
+
+def test_metrics_filters_and_limit():
+    spec = build_analytics_query_spec({
+        "group_by": ["stage", "owner"],
+        "metrics": [{"field": "amount", "aggregation": "sum"}, {"aggregation": "count"}],
+        "filters": {"amount": {"ge": "10", "lt": 100}, "stage": ["L1", 2], "created_at": "2025-01-01"},
+        "limit": ANALYTICS_MAX_ROWS * 10
+    }, COLUMNS)
+    assert [metric["name"] for metric in spec["metrics"]] == ["amount_sum", "count"]
+    # Filter values are coerced to the column type
+    assert spec["filters"] == {"amount": {"ge": 10.0, "lt": 100.0}, "stage": ["L1", "2"], "created_at": "2025-01-01"}
+    assert spec["limit"] == ANALYTICS_MAX_ROWS
+    assert spec["columns"] == ["stage", "owner", "amount", "id", "created_at"]
+
+
+def test_pivot_and_time_series():
+    pivot = build_analytics_query_spec({"type": "pivot", "index": "owner", "columns": "stage", "values": "amount", "aggregation": "mean"}, COLUMNS)
+    assert (pivot["index"], pivot["pivot_column"], pivot["values"], pivot["aggregation"]) == (["owner"], "stage", "amount", "mean")
+
+    series = build_analytics_query_spec({"type": "time_series", "interval": "week"}, COLUMNS)
+    assert (series["date_field"], series["interval"]) == ("created_at", "week")
+
+
+@pytest.mark.parametrize("request_data, detail", [
+    ({"type": "table"}, "type must be"),
+    ({"metrics": "x"}, "metrics must be a list of objects"),
+    ({"metrics": ["amount"]}, "metrics must be a list of objects"),
+    ({"group_by": [["stage"]]}, "group_by must be a column name or a list of column names"),
+    ({"group_by": {"stage": 1}}, "group_by must be a column name or a list of column names"),
+    ({"group_by": "missing"}, "Unknown column: missing"),
+    ({"metrics": [{"field": ["amount"], "aggregation": "sum"}]}, "Unknown column"),
+    ({"metrics": [{"field": "stage", "aggregation": "sum"}]}, "Column stage must be of type number"),
+    ({"metrics": [{"field": "amount", "aggregation": "median"}]}, "aggregation must be one of"),
+    ({"filters": ["stage"]}, "filters must be an object"),
+    ({"filters": {"amount": "lots"}}, "Filter amount expects a number value"),
+    ({"filters": {"amount": {"between": 1}}}, "Range filter on amount"),
+    ({"filters": {"stage": None}}, "Filter stage values must be plain values"),
+    ({"filters": {"created_at": "not a date"}}, "Filter created_at expects a datetime value"),
+    ({"limit": "many"}, "limit must be an integer"),
+    ({"type": "pivot", "index": "owner"}, "Pivot queries require index and columns"),
+    ({"type": "pivot", "index": [["owner"]], "columns": "stage"}, "index must be a column name or a list of column names"),
+    ({"type": "time_series", "date_field": "amount"}, "Column amount must be of type datetime"),
+    ({"type": "time_series", "interval": "hour"}, "interval must be one of")
+])
+def test_invalid_requests_are_rejected(request_data, detail):
+    with pytest.raises(HTTPException) as error:
+        build_analytics_query_spec(request_data, COLUMNS)
+    assert error.value.status_code == 400
+    assert detail in error.value.detail
@@ -0,0 +1,139 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from server import compile_discount_rules, discount_evaluation_lines, evaluate_discount_lines
+
+AS_OF = "2025-06-01"
+
+
+def rule(rule_id, **fields):
+    return {
+        "id": rule_id,
+        "rule_name": rule_id,
+        "discount_type": "percentage",
+        "discount_value": 10,
+        "priority_order": 100,
+        "stackable": False,
+        "min_quantity": 0,
+        "min_value": 0,
+        **fields
+    }
+
+
+def line(line_id="l1", quantity=1, line_value=100.0, **fields):
+    return {"id": line_id, "core_product_id": None, "sku_code": None, "category": None,
+            "quantity": quantity, "line_value": line_value, **fields}
+
+
+def evaluate(rules, lines, segments=frozenset()):
+    return evaluate_discount_lines(compile_discount_rules(rules), lines, set(segments), AS_OF)
+
+
+def applied(result):
+    return [entry["rule_id"] for entry in result["applied_rules"]]
+
+
+def test_highest_priority_non_stackable_rule_wins_alone():
+    result = evaluate([
+        rule("low", priority_order=5, discount_value=50, stackable=True),
+        rule("top", priority_order=1, discount_value=10)
+    ], [line()])[0]
+    assert applied(result) == ["top"]
+    assert result["discount_amount"] == 10.0
+    assert result["net_value"] == 90.0
+
+
+def test_stackable_rules_compound_and_skip_non_stackable_matches():
+    result = evaluate([
+        rule("first", priority_order=1, discount_value=10, stackable=True),
+        rule("fixed", priority_order=2, discount_type="absolute", discount_value=5),
+        rule("second", priority_order=3, discount_value=50, stackable=True)
+    ], [line(line_value=200.0)])[0]
+    assert applied(result) == ["first", "second"]
+    # 10% of 200, then 50% of the remaining 180
+    assert [entry["discount_amount"] for entry in result["applied_rules"]] == [20.0, 90.0]
+    assert result["net_value"] == 90.0
+    assert result["discount_percentage"] == 55.0
+
+
+def test_caps_and_remaining_value_bound_each_discount():
+    result = evaluate([
+        rule("capped", priority_order=1, discount_value=50, stackable=True, max_discount_amount=20),
+        rule("absolute", priority_order=2, discount_type="absolute", discount_value=500, stackable=True),
+        rule("unused", priority_order=3, discount_value=10, stackable=True)
+    ], [line()])[0]
+    assert [(entry["rule_id"], entry["discount_amount"], entry["capped"]) for entry in result["applied_rules"]] == [
+        ("capped", 20.0, True), ("absolute", 80.0, False)
+    ]
+    assert result["net_value"] == 0.0
+
+
+def test_quantity_and_value_bounds_are_half_open():
+    rules = [
+        rule("qty", priority_order=1, min_quantity=1, max_quantity=5),
+        rule("value", priority_order=2, min_value=100, max_value=200)
+    ]
+    results = evaluate(rules, [
+        line("q-lower", quantity=1, line_value=50.0),
+        line("q-upper", quantity=5, line_value=50.0),
+        line("v-lower", quantity=10, line_value=100.0),
+        line("v-upper", quantity=10, line_value=200.0)
+    ])
+    assert [applied(result) for result in results] == [["qty"], [], ["value"], []]
+
+
+def test_validity_window_and_segments():
+    rules = [
+        rule("expired", priority_order=1, valid_to="2025-05-31T23:59:59"),
+        rule("future", priority_order=2, valid_from="2025-06-02"),
+        rule("segment", priority_order=3, customer_segments='["gov"]'),
+        rule("today", priority_order=4, valid_from="2025-06-01", valid_to="2025-06-01")
+    ]
+    assert applied(evaluate(rules, [line()])[0]) == ["today"]
+    assert applied(evaluate(rules, [line()], {"gov"})[0]) == ["segment"]
+
+
+def test_product_and_category_scopes():
+    rules = [
+        rule("product-in-category", priority_order=1, applicable_products='["sku-1"]', applicable_categories="Compute"),
+        rule("category", priority_order=2, applicable_categories='["Storage"]')
+    ]
+    results = evaluate(rules, [
+        line("match", sku_code="sku-1", category="Compute"),
+        line("wrong-category", sku_code="sku-1", category="Network"),
+        line("by-category", core_product_id="p9", category="Storage"),
+        line("unscoped")
+    ])
+    assert [applied(result) for result in results] == [["product-in-category"], [], ["category"], []]
+
+
+def test_approval_threshold():
+    rules = [rule("approval", requires_approval=True, approval_threshold=150)]
+    results = evaluate(rules, [line("small", line_value=100.0), line("large", line_value=150.0)])
+    assert [result["requires_approval"] for result in results] == [False, True]
+    assert results[1]["approval_rules"] == ["approval"]
+
+
+def test_no_rules_and_zero_value_lines():
+    result = evaluate([], [line(line_value=0.0)])[0]
+    assert result["applied_rules"] == []
+    assert result["discount_percentage"] == 0.0
+
+
+def test_line_value_prorates_recurring_price_over_the_term():
+    catalog = {"products": {"p1": {"skucode": "SKU-1", "primary_category": "Compute"}}}
+    lines = discount_evaluation_lines([
+        {"id": "a", "core_product_id": "p1", "quantity": 2, "base_otp": 100, "base_recurring": 10, "contract_duration_months": 18},
+        {"id": "b", "core_product_id": "missing", "quantity": None, "base_otp": 100}
+    ], catalog)
+    assert lines[0]["sku_code"] == "SKU-1"
+    assert lines[0]["category"] == "Compute"
+    # 2 x (100 OTP + 10 recurring x 1.5 years)
+    assert lines[0]["line_value"] == pytest.approx(230.0)
+    assert lines[1]["line_value"] == 0.0
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from server import HTTPException, byte_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=500-", (500, 999)),
+    ("bytes=-100", (900, 999)),
+    (" bytes=0-0 ", (0, 0)),
+    # Ranges running past the end are clamped to the file
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-5000", (0, 999))
+])
+def test_byte_range(header, expected):
+    assert byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [None, "", "bytes=-", "items=0-10", "bytes=0-1,5-6", "bytes=a-b"])
+def test_byte_range_serves_whole_file_for_missing_or_unsupported_ranges(header):
+    assert byte_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1000-", 1000), ("bytes=5-2", 1000), ("bytes=-0", 1000), ("bytes=0-", 0)])
+def test_unsatisfiable_byte_range(header, size):
+    with pytest.raises(HTTPException) as error:
+        byte_range(header, size)
+    assert error.value.status_code == 416
+    assert error.value.headers == {"Content-Range": f"bytes */{size}"}
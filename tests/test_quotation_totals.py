@@ -0,0 +1,191 @@
+import asyncio
+import copy
+import os
+import sys
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server
+from server import compute_quotation_totals, discount_factors, item_total_updates, recalculate_quotation_group_path
+
+
+def test_discount_factors():
+    factors = discount_factors(
+        ["percentage", "percentage", "absolute", "absolute", "absolute", None, "unknown"],
+        [10, 150, 25, 500, 10, 30, 30],
+        np.array([100.0, 100.0, 100.0, 100.0, 0.0, 100.0, 100.0])
+    )
+    # Absolute amounts are spread pro rata, over-sized discounts clip at zero and a zero total is left alone
+    assert factors.tolist() == pytest.approx([0.9, 0.0, 0.75, 0.0, 1.0, 1.0, 1.0])
+
+
+def test_discount_factors_treat_missing_values_as_zero():
+    assert discount_factors(["percentage", "absolute"], [None, None], np.array([50.0, 50.0])).tolist() == [1.0, 1.0]
+
+
+def quotation_fixture():
+    quotation = {"id": "q", "overall_discount_type": "absolute", "overall_discount_value": 22.5}
+    phases = [{"id": "p1"}]
+    groups = [
+        {"id": "g1", "phase_id": "p1", "discount_type": "percentage", "discount_value": 50},
+        {"id": "g2", "phase_id": "p1"},
+        {"id": "orphan-group", "phase_id": "other-phase"}
+    ]
+    items = [
+        {"id": "a", "group_id": "g1", "quantity": 2, "base_otp": 100, "base_recurring": 50,
+         "contract_duration_months": 18, "discount_type": "percentage", "discount_value": 10},
+        {"id": "b", "group_id": "g1", "quantity": 1, "base_otp": 0, "base_recurring": 120,
+         "discount_type": "absolute", "discount_value": 20},
+        {"id": "c", "group_id": "g2", "quantity": 1, "base_otp": 10, "base_recurring": None},
+        {"id": "orphan-item", "group_id": "orphan-group", "quantity": 1, "base_otp": 1000}
+    ]
+    return quotation, phases, groups, items
+
+
+def test_compute_quotation_totals_rolls_up_discounts():
+    totals = compute_quotation_totals(*quotation_fixture())
+
+    assert [item["id"] for item in totals["items"]] == ["a", "b", "c"]
+    assert [group["id"] for group in totals["groups"]] == ["g1", "g2"]
+    # An 18 month term covers all of year 1 and half of year 2
+    assert totals["proration"][0][:3].tolist() == [1.0, 0.5, 0.0]
+    # Item a: gross 200 OTP + 100 + 50 recurring less 10%; item b: 120 recurring less 20 absolute
+    assert totals["net_prices"][0].tolist() == pytest.approx([180.0, 90.0])
+    assert totals["group_matrix"][0][:3].tolist() == pytest.approx([90.0, 95.0, 22.5])
+    assert totals["group_matrix"][1][:3].tolist() == pytest.approx([10.0, 0.0, 0.0])
+    assert totals["phase_matrix"][0][:3].tolist() == pytest.approx([100.0, 95.0, 22.5])
+    assert totals["quotation_row"].sum() == pytest.approx(195.0)
+
+
+def test_item_totals_carry_group_discount_in_line_totals_only():
+    updates = item_total_updates(compute_quotation_totals(*quotation_fixture()))
+
+    assert updates[0]["net_otp"] == 180.0
+    assert updates[0]["net_recurring"] == 90.0
+    assert updates[0]["line_total_otp"] == 90.0
+    assert updates[0]["line_total_recurring"] == 67.5
+    years = updates[0]["yearly_allocations"]
+    assert len(years) == server.QUOTATION_YEARS
+    assert years[0] == {"year_no": 1, "allocated_otp": 90.0, "allocated_recurring": 45.0, "year_total": 135.0, "proration_factor": 1.0}
+    assert years[1] == {"year_no": 2, "allocated_otp": 0.0, "allocated_recurring": 22.5, "year_total": 22.5, "proration_factor": 0.5}
+    assert years[2]["year_total"] == 0.0
+
+
+def test_compute_quotation_totals_without_items():
+    totals = compute_quotation_totals({"id": "q"}, [{"id": "p1"}], [{"id": "g1", "phase_id": "p1"}], [])
+    assert totals["group_matrix"].sum() == 0
+    assert totals["quotation_row"].shape == (len(server.QUOTATION_TOTAL_COLUMNS),)
+
+
+class FakeCollection:
+    """In-memory stand-in for the handful of collection calls the dirty-path recalculation makes"""
+
+    def __init__(self, documents=None):
+        self.documents = [dict(document) for document in documents or []]
+        self.updates = []
+
+    @staticmethod
+    def matches(document, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict) and "$in" in condition:
+                if document.get(field) not in condition["$in"]:
+                    return False
+            elif document.get(field) != condition:
+                return False
+        return True
+
+    def apply(self, document, update):
+        self.updates.append(update)
+        document.update(update.get("$set", {}))
+        for field, amount in update.get("$inc", {}).items():
+            document[field] = (document.get(field) or 0) + amount
+
+    async def find_one(self, query, *args, **kwargs):
+        return next((copy.deepcopy(document) for document in self.documents if self.matches(document, query)), None)
+
+    def find(self, query, *args, **kwargs):
+        documents = [copy.deepcopy(document) for document in self.documents if self.matches(document, query)]
+
+        class Cursor:
+            async def to_list(self, length):
+                return documents
+        return Cursor()
+
+    async def find_one_and_update(self, query, update, *args, **kwargs):
+        for document in self.documents:
+            if self.matches(document, query):
+                before = copy.deepcopy(document)
+                self.apply(document, update)
+                return before
+        return None
+
+    async def update_one(self, query, update, *args, **kwargs):
+        for document in self.documents:
+            if self.matches(document, query):
+                self.apply(document, update)
+                return
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            await self.update_one(operation._filter, operation._doc)
+
+
+class FakeDatabase:
+    def __init__(self, **collections):
+        for name, documents in collections.items():
+            setattr(self, name, FakeCollection(documents))
+
+
+def run_group_path(monkeypatch, database, group_id):
+    monkeypatch.setattr(server, "db", database)
+    return asyncio.run(recalculate_quotation_group_path("q", group_id))
+
+
+def test_recalculate_group_path_moves_phase_by_group_delta(monkeypatch):
+    database = FakeDatabase(
+        quotations=[{"id": "q", "is_deleted": False}],
+        # g2's totals are already persisted in the phase; they must survive recalculating g1
+        quotation_phases=[{"id": "p1", "quotation_id": "q", "is_deleted": False, "phase_total_otp": 10.0, "phase_grand_total": 10.0}],
+        quotation_groups=[
+            {"id": "g1", "phase_id": "p1", "is_deleted": False},
+            {"id": "g2", "phase_id": "p1", "is_deleted": False, "group_total_otp": 10.0, "group_grand_total": 10.0}
+        ],
+        quotation_items=[{"id": "a", "group_id": "g1", "is_deleted": False, "quantity": 1, "base_otp": 100, "base_recurring": 0}]
+    )
+
+    totals = run_group_path(monkeypatch, database, "g1")
+    phase = database.quotation_phases.documents[0]
+    assert phase["phase_total_otp"] == 110.0
+    assert phase["phase_grand_total"] == 110.0
+    assert totals["total_otp"] == 110.0
+    assert totals["grand_total"] == 110.0
+    assert database.quotation_items.documents[0]["line_total_otp"] == 100.0
+
+    # A price cut moves the phase by the difference only
+    database.quotation_items.documents[0]["base_otp"] = 40
+    totals = run_group_path(monkeypatch, database, "g1")
+    assert phase["phase_total_otp"] == 50.0
+    assert totals["grand_total"] == 50.0
+
+    # Nothing changed, so the phase is not touched again
+    phase_updates = len(database.quotation_phases.updates)
+    run_group_path(monkeypatch, database, "g1")
+    assert len(database.quotation_phases.updates) == phase_updates
+
+
+def test_recalculate_group_path_rejects_group_of_another_quotation(monkeypatch):
+    database = FakeDatabase(
+        quotations=[{"id": "q", "is_deleted": False}],
+        quotation_phases=[{"id": "p-other", "quotation_id": "other", "is_deleted": False}],
+        quotation_groups=[{"id": "g1", "phase_id": "p-other", "is_deleted": False}],
+        quotation_items=[]
+    )
+    with pytest.raises(server.HTTPException) as error:
+        run_group_path(monkeypatch, database, "g1")
+    assert error.value.status_code == 404
+    assert database.quotation_groups.updates == []
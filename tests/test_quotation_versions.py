@@ -0,0 +1,105 @@
+import os
+import sys
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from server import apply_snapshot_patch, decode_snapshot_data, describe_snapshot_patch, encode_snapshot_data, snapshot_patch
+
+
+def quotation_snapshot():
+    return {
+        "id": "q",
+        "status": "Draft",
+        "grand_total": 100.0,
+        "phases": [
+            {"id": "p1", "phase_name": "Setup", "groups": [
+                {"id": "g1", "items": [{"id": "i1", "quantity": 1}, {"id": "i2", "quantity": 2}]}
+            ]},
+            {"id": "p2", "phase_name": "Run", "groups": []}
+        ],
+        "terms": ["net 30", "net 30"]
+    }
+
+
+def round_trip(old, new):
+    patch = snapshot_patch(old, new)
+    # Patches are stored as canonical JSON
+    patch = decode_snapshot_data(encode_snapshot_data(patch)) if patch is not None else None
+    assert apply_snapshot_patch(old, patch) == new
+    return patch
+
+
+def test_unchanged_snapshot_has_no_patch():
+    assert snapshot_patch(quotation_snapshot(), quotation_snapshot()) is None
+    assert apply_snapshot_patch(quotation_snapshot(), None) == quotation_snapshot()
+
+
+def test_patch_round_trips_field_and_nested_item_changes():
+    old, new = quotation_snapshot(), quotation_snapshot()
+    new["status"] = "Unapproved"
+    new["phases"][0]["groups"][0]["items"][1]["quantity"] = 5
+    del new["grand_total"]
+    new["submitted_by"] = "u1"
+
+    patch = round_trip(old, new)
+    assert patch["x"] == ["grand_total"]
+    assert patch["d"]["submitted_by"] == {"r": "u1"}
+    # Only the changed item is carried, addressed by id
+    items_patch = patch["d"]["phases"]["l"]["d"]["p1"]["d"]["groups"]["l"]["d"]["g1"]["d"]["items"]["l"]
+    assert items_patch["d"] == {"i2": {"d": {"quantity": {"r": 5}}, "x": []}}
+
+
+def test_patch_round_trips_added_removed_and_reordered_elements():
+    old, new = quotation_snapshot(), quotation_snapshot()
+    new["phases"][0]["groups"][0]["items"] = [{"id": "i3", "quantity": 3}, {"id": "i1", "quantity": 1}]
+    new["phases"].reverse()
+
+    patch = round_trip(old, new)
+    phases_patch = patch["d"]["phases"]["l"]
+    assert phases_patch["order"] == ["p2", "p1"]
+    items_patch = phases_patch["d"]["p1"]["d"]["groups"]["l"]["d"]["g1"]["d"]["items"]["l"]
+    assert items_patch["n"] == [{"id": "i3", "quantity": 3}]
+    assert items_patch["x"] == ["i2"]
+    assert items_patch["order"] == ["i3", "i1"]
+
+
+def test_appended_elements_need_no_order():
+    old, new = quotation_snapshot(), quotation_snapshot()
+    new["phases"].append({"id": "p3", "phase_name": "Exit", "groups": []})
+    assert "order" not in round_trip(old, new)["d"]["phases"]["l"]
+
+
+def test_lists_without_unique_ids_are_replaced():
+    old, new = quotation_snapshot(), quotation_snapshot()
+    new["terms"] = ["net 45"]
+    assert round_trip(old, new)["d"]["terms"] == {"r": ["net 45"]}
+
+    old["phases"].append({"id": "p1", "phase_name": "Duplicate", "groups": []})
+    new = quotation_snapshot()
+    assert round_trip(old, new)["d"]["phases"] == {"r": new["phases"]}
+
+
+def test_type_changes_are_replaced():
+    assert round_trip({"value": {"a": 1}}, {"value": [1]}) == {"d": {"value": {"r": [1]}}, "x": []}
+    assert round_trip({"value": None}, {"value": {"a": 1}}) == {"d": {"value": {"r": {"a": 1}}}, "x": []}
+
+
+def test_unchanged_subtrees_are_shared():
+    old, new = quotation_snapshot(), quotation_snapshot()
+    new["status"] = "Approved"
+    rebuilt = apply_snapshot_patch(old, snapshot_patch(old, new))
+    assert rebuilt["phases"] is old["phases"]
+
+
+def test_describe_patch_lists_path_level_changes():
+    old, new = quotation_snapshot(), quotation_snapshot()
+    new["status"] = "Unapproved"
+    new["phases"][1]["groups"].append({"id": "g2", "items": []})
+    del new["grand_total"]
+
+    entries = describe_snapshot_patch(old, snapshot_patch(old, new))
+    assert {"path": "grand_total", "change": "removed", "old": 100.0} in entries
+    assert {"path": "status", "change": "changed", "old": "Draft", "new": "Unapproved"} in entries
+    assert {"path": "phases[p2].groups[g2]", "change": "added", "new": {"id": "g2", "items": []}} in entries
@@ -0,0 +1,27 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from server import build_sd_upcoming_row
+
+
+def test_sd_upcoming_row_with_datetime_closure_date():
+    opportunity = {
+        "id": "opp-1",
+        "current_stage_name": "L6",
+        "expected_closure_date": datetime(2025, 3, 1, tzinfo=timezone.utc)
+    }
+    row = build_sd_upcoming_row(opportunity, [], None)
+    assert row["estimated_delivery_date"] == "2025-03-31"
+
+
+def test_sd_upcoming_row_with_string_closure_date():
+    opportunity = {"id": "opp-2", "current_stage_name": "L7", "expected_closure_date": "2025-03-01T00:00:00Z"}
+    assert build_sd_upcoming_row(opportunity, [], None)["estimated_delivery_date"] == "2025-03-31"
+
+    opportunity["expected_closure_date"] = "not a date"
+    assert build_sd_upcoming_row(opportunity, [], None)["estimated_delivery_date"] is None